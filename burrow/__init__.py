@@ -19,14 +19,19 @@ import pbr
 
 from burrow import client
 from burrow import server
+from burrow import worker
 
 __version_info__ = pbr.version.VersionInfo("burrow")
 __version__ = __version_info__.version_string()
 
 Client = client.Client
+GreenClient = client.GreenClient
 Account = client.Account
 Queue = client.Queue
+Producer = client.Producer
+Consumer = client.Consumer
 Server = server.Server
+Worker = worker.Worker
 
 
 class NotFound(Exception):
@@ -14,11 +14,24 @@
 
 '''Backends for burrow.'''
 
+import collections
+import sys
 import time
+import urlparse
 
 import eventlet
+from eventlet.green import socket
+import eventlet.hubs
+import eventlet.semaphore
 
 import burrow.common
+import burrow.metrics
+import burrow.profiler
+from burrow.openstack.common.gettextutils import _
+
+# Seconds in each of the fixed windows used to estimate queue enqueue
+# and dequeue rates.
+STATS_WINDOW = 60
 
 # Since this is an interface, arguments are unused. Ignore warnings in pylint.
 # pylint: disable=W0613
@@ -29,13 +42,29 @@ class Backend(burrow.common.Module):
 
     def __init__(self, config):
         super(Backend, self).__init__(config)
-        self.queues = {}
+        self.waiters = Waiters()
+        self.metrics = burrow.metrics.Metrics()
+        self.metrics.describe('burrow_waiters', 'gauge',
+            'Requests parked waiting for messages.')
+        self.metrics.add_collector(self._collect_metrics)
+        self.profiler = burrow.profiler.Profiler(log=self.log)
+
+    def _collect_metrics(self):
+        '''Return backend gauge samples for the metrics registry.'''
+        return [('burrow_waiters', (), self.waiters.count)]
 
     def run(self, thread_pool):
         '''Run the backend. This should start any periodic tasks in
         separate threads and should never block.'''
+        self.waiters.add_pool(thread_pool)
         thread_pool.spawn_n(self._clean)
 
+    def close(self):
+        '''Release anything the backend holds outside of the process,
+        such as sockets or files. This is called when the server
+        exits.'''
+        pass
+
     def delete_accounts(self, filters=None):
         '''Delete accounts, which includes all queues and messages within
         the accounts. With no filters, this will delete all data for the
@@ -143,6 +172,91 @@ class Backend(burrow.common.Module):
         '''
         return []
 
+    def claim_messages(self, account, queue, attributes, filters=None):
+        '''Claim a list of visible messages by setting the given
+        attributes on them in the same operation that finds them,
+        so no other caller can get the same messages in between. This
+        uses the same parameters and return type as
+        :func:`update_messages()`, except 'match_hidden' is ignored
+        since only visible messages can be claimed, the 'hide'
+        attribute must be given with a value greater than 0, and the
+        default value for 'detail' in 'filters' is 'all'.
+        '''
+        return []
+
+    def delete_messages_any(self, account, queues=None, filters=None):
+        '''Delete messages from the first of the given queues that has
+        any matching messages. If none of the queues have matching
+        messages and a 'wait' filter is given, wait for a message to
+        appear in any of them.
+
+        :param account: Account the queues are in.
+
+        :param queues: List of queue IDs to check in order, or None
+            to check every queue in the account.
+
+        :param filters: Optional dict of filters for the request, the
+            same as :func:`delete_messages()`.
+
+        :returns: A dict with 'queue' set to the queue ID the messages
+            came from and 'messages' set to the list of messages.
+        '''
+        def method(queue, filters):
+            return self.delete_messages(account, queue, filters)
+        return self._messages_any(account, queues, filters, method, True)
+
+    def get_messages_any(self, account, queues=None, filters=None):
+        '''Get messages from the first of the given queues that has any
+        matching messages. This uses the same parameters and return
+        type as :func:`delete_messages_any()`, except the default value
+        for 'detail' in 'filters' is 'all'.'''
+        def method(queue, filters):
+            return self.get_messages(account, queue, filters)
+        return self._messages_any(account, queues, filters, method, False)
+
+    def claim_messages_any(self, account, queues, attributes, filters=None):
+        '''Claim messages from the first of the given queues that has any
+        visible messages. This uses the same parameters and return type
+        as :func:`delete_messages_any()`, except this also requires
+        'attributes' as described in :func:`claim_messages()`.'''
+        def method(queue, filters):
+            return self.claim_messages(account, queue, attributes, filters)
+        return self._messages_any(account, queues, filters, method, True)
+
+    def _messages_any(self, account, queues, filters, method, consume):
+        '''Run method on each queue in turn until one returns messages,
+        waiting on all the queues for up to the 'wait' filter seconds
+        if none do.'''
+        filters = {} if filters is None else dict(filters)
+        seconds = filters.pop('wait', 0)
+        if filters.get('marker', None) is not None or \
+            filters.get('match_hidden', False):
+            consume = False
+        if queues is None:
+            keys = [account]
+        else:
+            keys = ['%s/%s' % (account, queue) for queue in queues]
+        deadline = time.time() + seconds
+        notified = False
+        while True:
+            names = queues
+            if names is None:
+                try:
+                    names = list(self.get_queues(account, dict(detail='id')))
+                except burrow.NotFound:
+                    names = []
+            for name in names:
+                try:
+                    messages = list(method(name, filters))
+                except burrow.NotFound:
+                    continue
+                return dict(queue=name, messages=messages)
+            now = time.time()
+            if deadline <= now:
+                raise burrow.NotFound('Message not found')
+            notified = self.waiters.wait_any(keys, deadline - now, consume,
+                notified)
+
     def create_message(self, account, queue, message, body, attributes=None):
         '''Create a new message in the given account and queue.
 
@@ -198,6 +312,29 @@ class Backend(burrow.common.Module):
         '''
         return None
 
+    def get_queue_stats(self, account, queue):
+        '''Get statistics for a queue. These are kept up to date as
+        messages change, so this is O(1) no matter how many messages
+        are in the queue. Queues only exist while they have messages,
+        so the statistics are reset once a queue is empty.
+
+        :param account: Account the queue is in.
+
+        :param queue: Queue within the given account to get the
+            statistics for.
+
+        :returns: A dict with 'id' set to the queue ID, 'visible' and
+            'hidden' set to the number of visible and hidden messages,
+            'bytes' set to the total size of the message bodies,
+            'oldest_age' set to the number of seconds since the oldest
+            message was created, 'enqueued' and 'dequeued' set to the
+            number of messages created and removed, and 'enqueue_rate'
+            and 'dequeue_rate' set to the number of messages per second
+            created and removed over about the last :data:`STATS_WINDOW`
+            seconds.
+        '''
+        return {}
+
     def clean(self):
         '''This method should remove all messages with an expired
         TTL and make hidden messages that have an expired hide time
@@ -221,6 +358,21 @@ class Backend(burrow.common.Module):
             hide += int(time.time())
         return ttl, hide
 
+    def _get_claim_attributes(self, attributes):
+        '''Helper method to parse claim attributes for implementations
+        to use. A claim must hide the messages it returns.'''
+        ttl, hide = self._get_attributes(attributes)
+        if hide is None or hide <= 0:
+            raise burrow.InvalidArguments('hide')
+        return ttl, hide
+
+    def _get_claim_filters(self, filters):
+        '''Helper method to build claim filters for implementations to
+        use. Only visible messages can be claimed.'''
+        filters = {} if filters is None else dict(filters)
+        filters['match_hidden'] = False
+        return filters
+
     def _get_detail(self, filters, default=None):
         '''Helper method to parse account and queue detail for
         implementations to use.'''
@@ -242,52 +394,283 @@ class Backend(burrow.common.Module):
             raise burrow.InvalidArguments(detail)
         return detail
 
-    def notify(self, account, queue):
+    def notify(self, account, queue, count=None):
         '''Notify any waiting callers that the account/queue has
-        a visible message.'''
-        queue = '%s/%s' % (account, queue)
-        if queue in self.queues:
-            for _count in xrange(0, self.queues[queue].getting()):
-                self.queues[queue].put(0)
-
-    def wait(self, account, queue, seconds):
-        '''Wait for a message to appear in the account/queue.'''
-        queue = '%s/%s' % (account, queue)
-        if queue not in self.queues:
-            self.queues[queue] = eventlet.Queue()
+        visible messages. The count is the number of newly visible
+        messages, which limits how many callers that consume messages
+        are woken. If count is None, all waiting callers are woken.
+        Callers waiting on the queue are woken before callers waiting
+        on the whole account.'''
+        woken = self.waiters.notify('%s/%s' % (account, queue), count)
+        if count is not None:
+            count = max(count - woken, 0)
+        self.waiters.notify(account, count)
+
+    def wait(self, account, queue, seconds, exclusive=False, first=False):
+        '''Wait for a message to appear in the account/queue. Callers
+        that consume the messages they find should be exclusive. See
+        :class:`Waiters` for details. Returns True if notified.'''
+        return self.waiters.wait('%s/%s' % (account, queue), seconds,
+            exclusive, first)
+
+
+class Waiters(object):
+    '''Registry of green threads waiting for a key, usually an
+    account/queue, to be notified. A parked waiter is only a small
+    record in a per-key deque and a hub timer, and if the waiting
+    green thread was spawned from one of the registered pools, its
+    pool slot is released while it is parked. This keeps idle long-poll
+    requests from starving other work in the pool. A waiter must get
+    a pool slot back before it resumes, so resumed waiters are still
+    bounded by the pool size.
+
+    Waiters are either shared or exclusive. Shared waiters, such as
+    requests that only get messages, are all woken on every
+    notification. Exclusive waiters consume the messages they find,
+    so they are woken in FIFO order and only as many as the number of
+    newly visible messages given to :func:`notify()`.'''
+
+    def __init__(self):
+        self.queues = {}
+        self.pools = []
+        self.count = 0
+
+    def add_pool(self, pool):
+        '''Add a pool whose slots are released by parked waiters. This
+        is a :class:`WaiterPool` or anything else with the same park()
+        and unpark() methods.'''
+        if pool not in self.pools:
+            self.pools.append(pool)
+
+    def notify(self, key, count=None):
+        '''Wake up all shared waiters for the given key, along with
+        up to count exclusive waiters. If count is None, all exclusive
+        waiters are woken as well. Returns the number of exclusive
+        waiters woken.'''
+        queue = self.queues.get(key)
+        if queue is None:
+            return 0
+        hub = eventlet.hubs.get_hub()
+        while len(queue.shared) > 0:
+            queue.shared.popleft().resume(hub, True)
+        woken = 0
+        while len(queue.exclusive) > 0 and (count is None or woken < count):
+            if queue.exclusive.popleft().resume(hub, True):
+                woken += 1
+        return woken
+
+    def wait(self, key, seconds, exclusive=False, first=False):
+        '''Park the current green thread until the key is notified
+        or the timeout in seconds expires. If first is True, the waiter
+        is put at the front of the line, which is used by exclusive
+        waiters that were woken but found nothing to keep their place.
+        Returns True if notified.'''
+        return self.wait_any([key], seconds, exclusive, first)
+
+    def wait_any(self, keys, seconds, exclusive=False, first=False):
+        '''Same as :func:`wait()`, except park until any of the given
+        keys is notified.'''
+        hub = eventlet.hubs.get_hub()
+        waiter = _Waiter(eventlet.getcurrent())
+        queues = []
+        for key in keys:
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = _WaitQueue()
+            waiters = queue.exclusive if exclusive else queue.shared
+            if first:
+                waiters.appendleft(waiter)
+            else:
+                waiters.append(waiter)
+            queue.active += 1
+            queues.append((key, queue))
+        waiter.timer = hub.schedule_call_global(seconds, waiter.resume, None,
+            False)
+        pools = [pool for pool in self.pools if pool.park(waiter.greenlet)]
+        self.count += 1
+        try:
+            return hub.switch()
+        finally:
+            self.count -= 1
+            waiter.cancel()
+            for key, queue in queues:
+                queue.active -= 1
+                self._cleanup(key, queue)
+            for pool in pools:
+                pool.unpark(eventlet.getcurrent())
+
+    def _cleanup(self, key, queue):
+        '''Remove the key once nothing is waiting on it, and compact
+        the deques if they are mostly waiters that have already
+        resumed.'''
+        if queue.active == 0:
+            if self.queues.get(key) is queue:
+                del self.queues[key]
+        elif len(queue.shared) + len(queue.exclusive) > 2 * queue.active + 16:
+            for waiters in [queue.shared, queue.exclusive]:
+                active = [waiter for waiter in waiters
+                    if waiter.greenlet is not None]
+                waiters.clear()
+                waiters.extend(active)
+
+
+class WaiterPool(object):
+    '''Green thread pool that can be registered with :class:`Waiters`.
+    At most size green threads in the pool are working at a time, but
+    parked green threads give their slot to other work until they
+    resume. Slots are counted by a semaphore owned by this pool, and
+    the green threads are run in an unbounded eventlet.GreenPool so
+    waitall() still waits for parked green threads.'''
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.slots = eventlet.semaphore.Semaphore(size)
+        self.coroutines_running = set()
+        self.parked = set()
+        self.pool = eventlet.GreenPool(sys.maxint)
+
+    def free(self):
+        '''Return the number of free slots.'''
+        return self.slots.counter
+
+    def running(self):
+        '''Return the number of green threads in the pool, including
+        parked green threads.'''
+        return self.pool.running()
+
+    def spawn(self, function, *args, **kwargs):
+        '''Wait for a free slot and run the function in a new green
+        thread, returning the green thread.'''
+        self.slots.acquire()
+        try:
+            return self.pool.spawn(self._run, function, args, kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def spawn_n(self, function, *args, **kwargs):
+        '''Same as :func:`spawn()`, but return nothing.'''
+        self.slots.acquire()
+        try:
+            self.pool.spawn_n(self._run, function, args, kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def waitall(self):
+        '''Wait until all green threads in the pool are finished.'''
+        self.pool.waitall()
+
+    def park(self, greenlet):
+        '''Give the slot of a green thread in the pool to other work
+        while it is parked. Returns False if the green thread is not
+        working in this pool.'''
+        if greenlet not in self.coroutines_running or greenlet in self.parked:
+            return False
+        self.parked.add(greenlet)
+        self.slots.release()
+        return True
+
+    def unpark(self, greenlet):
+        '''Wait for a slot for a parked green thread again.'''
+        self.slots.acquire()
+        self.parked.discard(greenlet)
+
+    def _run(self, function, args, kwargs):
+        '''Run the function and release its slot, unless it was parked
+        and never got its slot back.'''
+        current = eventlet.getcurrent()
+        self.coroutines_running.add(current)
         try:
-            self.queues[queue].get(timeout=seconds)
-        except eventlet.queue.Empty:
-            pass
-        if self.queues[queue].getting() == 0:
-            del self.queues[queue]
+            return function(*args, **kwargs)
+        finally:
+            self.coroutines_running.discard(current)
+            if current in self.parked:
+                self.parked.discard(current)
+            else:
+                self.slots.release()
+
+
+class _WaitQueue(object):
+    '''Shared and exclusive waiters for a key, along with a count
+    of the waiters that have not resumed yet.'''
+
+    __slots__ = ['shared', 'exclusive', 'active']
+
+    def __init__(self):
+        self.shared = collections.deque()
+        self.exclusive = collections.deque()
+        self.active = 0
+
+
+class _Waiter(object):
+    '''A green thread parked in the waiter registry.'''
+
+    __slots__ = ['greenlet', 'timer']
+
+    def __init__(self, greenlet):
+        self.greenlet = greenlet
+        self.timer = None
+
+    def cancel(self):
+        '''Mark the waiter as resumed and cancel its timer.'''
+        self.greenlet = None
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def resume(self, hub, value):
+        '''Resume the waiter with the given value, either by scheduling
+        a switch on the hub or, with no hub, by switching directly.
+        Returns False if the waiter has already resumed.'''
+        greenlet = self.greenlet
+        if greenlet is None:
+            return False
+        self.cancel()
+        if hub is None:
+            greenlet.switch(value)
+        else:
+            hub.schedule_call_global(0, greenlet.switch, value)
+        return True
 
 
 def wait_without_attributes(method):
     '''Decorator that will wait for messages with the method does not
-    take attributes.'''
+    take attributes. Deleting messages consumes them, so those waiters
+    are exclusive.'''
+    consume = method.__name__.startswith('delete_')
+
     def __wrapper__(self, account, queue, filters=None):
         original = lambda: method(self, account, queue, filters)
-        return wait(self, account, queue, filters, original)
+        return wait(self, account, queue, filters, original, consume)
     return __wrapper__
 
 
 def wait_with_attributes(method):
     '''Decorator that will wait for messages with the method takes
-    attributes.'''
+    attributes. Hiding messages consumes them, so those waiters are
+    exclusive.'''
     def __wrapper__(self, account, queue, attributes, filters=None):
         original = lambda: method(self, account, queue, attributes, filters)
-        return wait(self, account, queue, filters, original)
+        hide = None if attributes is None else attributes.get('hide', None)
+        consume = hide is not None and hide > 0
+        return wait(self, account, queue, filters, original, consume)
     return __wrapper__
 
 
-def wait(self, account, queue, filters, method):
+def wait(self, account, queue, filters, method, consume=False):
     '''Decorator to wait on a queue if the wait option is given. This
     will block until a message in the queue is ready or the timeout
-    expires.'''
+    expires. If the method consumes the messages it finds and any
+    visible message would match, the wait is exclusive so only one
+    caller is woken per new message.'''
     seconds = 0 if filters is None else filters.get('wait', 0)
     if seconds > 0:
         seconds += time.time()
+    if filters is not None:
+        if filters.get('marker', None) is not None or \
+            filters.get('match_hidden', False):
+            consume = False
+    notified = False
     while True:
         try:
             for message in method():
@@ -296,6 +679,93 @@ def wait(self, account, queue, filters, method):
         except burrow.NotFound as exception:
             now = time.time()
             if seconds - now > 0:
-                self.wait(account, queue, seconds - now)
+                notified = self.wait(account, queue, seconds - now, consume,
+                    notified)
             if seconds < time.time():
                 raise exception
+
+
+class WindowCounter(object):
+    '''Count events in fixed windows of :data:`STATS_WINDOW` seconds,
+    keeping the counts for the current and previous windows along with
+    the total. This gives an O(1) rate estimate with :func:`rate`.'''
+
+    __slots__ = ['window', 'current', 'previous', 'total']
+
+    def __init__(self):
+        self.window = 0
+        self.current = 0
+        self.previous = 0
+        self.total = 0
+
+    def add(self, now):
+        '''Count an event at the given time.'''
+        window = int(now) // STATS_WINDOW
+        if window == self.window + 1:
+            self.previous = self.current
+            self.current = 0
+        elif window != self.window:
+            self.previous = 0
+            self.current = 0
+        self.window = window
+        self.current += 1
+        self.total += 1
+
+    def rate(self, now):
+        '''Return the estimated events per second at the given time.'''
+        return rate(self.window, self.current, self.previous, now)
+
+
+def rate(window, current, previous, now):
+    '''Estimate events per second over the last :data:`STATS_WINDOW`
+    seconds from the counts for a window and the one before it. The
+    previous count is weighted by how much of the previous window is
+    still within the last :data:`STATS_WINDOW` seconds.'''
+    now_window, offset = divmod(now, STATS_WINDOW)
+    if now_window == window + 1:
+        previous = current
+        current = 0
+    elif now_window != window:
+        return 0.0
+    overlap = 1 - offset / float(STATS_WINDOW)
+    return (previous * overlap + current) / float(STATS_WINDOW)
+
+
+def parse_server(url, default_port):
+    '''Parse a server URL, returning the socket path for unix:// or
+    backend+unix:// URLs and a (host, port) tuple otherwise. Relative
+    paths such as unix://burrow.sock end up in the network location,
+    so it is included in the path.'''
+    parsed = urlparse.urlparse(url.strip())
+    if parsed.scheme == 'unix' or parsed.scheme.endswith('+unix'):
+        path = parsed.netloc + parsed.path
+        if path == '':
+            raise ValueError(_('No socket path in %s') % url)
+        return path
+    port = parsed.port
+    if port is None:
+        port = default_port
+    return (parsed.hostname, port)
+
+
+def connect(server):
+    '''Connect to a server returned by parse_server. Unix domain
+    sockets are used for paths, TCP otherwise.'''
+    if isinstance(server, basestring):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(server)
+        except socket.error:
+            connection.close()
+            raise
+        return connection
+    connection = socket.create_connection(server)
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+def server_name(server):
+    '''Return a printable name for a server returned by parse_server.'''
+    if isinstance(server, basestring):
+        return 'unix:%s' % server
+    return '%s:%d' % server
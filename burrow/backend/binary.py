@@ -0,0 +1,198 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Binary protocol backend for burrow, used by clients and proxies to
+talk to the binary TCP frontend. All requests share one connection
+per backend and are multiplexed by request ID, so many requests,
+including long-polls, can be in progress at once.'''
+
+import json
+
+import eventlet
+import eventlet.event
+from eventlet.green import socket
+import eventlet.semaphore
+
+import burrow
+import burrow.backend
+import burrow.frontend.binary as protocol
+from burrow.openstack.common.gettextutils import _
+
+# Default configuration values for this module.
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 8081
+
+
+class Backend(burrow.backend.Backend):
+    '''This backend forwards all requests to the binary frontend.'''
+
+    def __init__(self, config):
+        super(Backend, self).__init__(config)
+        url = self.config.get('url')
+        port = self.config.getint('port', DEFAULT_PORT)
+        if url:
+            self.server = burrow.backend.parse_server(url, port)
+        else:
+            self.server = (self.config.get('host', DEFAULT_HOST), port)
+        self.connection = None
+        self.lock = eventlet.semaphore.Semaphore()
+
+    def delete_accounts(self, filters=None):
+        return self._stream('delete_accounts', filters)
+
+    def get_accounts(self, filters=None):
+        return self._stream('get_accounts', filters)
+
+    def delete_queues(self, account, filters=None):
+        return self._stream('delete_queues', account, filters)
+
+    def get_queues(self, account, filters=None):
+        return self._stream('get_queues', account, filters)
+
+    def delete_messages(self, account, queue, filters=None):
+        return self._stream('delete_messages', account, queue, filters)
+
+    def get_messages(self, account, queue, filters=None):
+        return self._stream('get_messages', account, queue, filters)
+
+    def update_messages(self, account, queue, attributes, filters=None):
+        return self._stream('update_messages', account, queue, attributes,
+            filters)
+
+    def claim_messages(self, account, queue, attributes, filters=None):
+        return self._stream('claim_messages', account, queue, attributes,
+            filters)
+
+    def delete_messages_any(self, account, queues=None, filters=None):
+        return self._call('delete_messages_any', [account, queues, filters])
+
+    def get_messages_any(self, account, queues=None, filters=None):
+        return self._call('get_messages_any', [account, queues, filters])
+
+    def claim_messages_any(self, account, queues, attributes, filters=None):
+        return self._call('claim_messages_any',
+            [account, queues, attributes, filters])
+
+    def create_message(self, account, queue, message, body, attributes=None):
+        return self._call('create_message',
+            [account, queue, message, attributes], body)
+
+    def delete_message(self, account, queue, message, filters=None):
+        return self._call('delete_message', [account, queue, message, filters])
+
+    def get_message(self, account, queue, message, filters=None):
+        return self._call('get_message', [account, queue, message, filters])
+
+    def update_message(self, account, queue, message, attributes,
+        filters=None):
+        return self._call('update_message',
+            [account, queue, message, attributes, filters])
+
+    def get_queue_stats(self, account, queue):
+        return self._call('get_queue_stats', [account, queue])
+
+    def clean(self):
+        pass
+
+    def _stream(self, method, *args):
+        '''Generator that makes the call once iteration starts and
+        yields each item in the result.'''
+        for item in self._call(method, list(args)):
+            yield item
+
+    def _call(self, method, args, body=''):
+        '''Send a request on the shared connection and wait for the
+        response.'''
+        connection = self._connect()
+        status, payload = connection.call(method, args, body)
+        if status == protocol.STATUS_JSON:
+            return json.loads(payload)
+        if status == protocol.STATUS_RAW:
+            return payload
+        if status == protocol.STATUS_NOT_FOUND:
+            raise burrow.NotFound(payload)
+        if status == protocol.STATUS_INVALID_ARGUMENTS:
+            raise burrow.InvalidArguments(payload)
+        raise Exception(payload)
+
+    def _connect(self):
+        '''Return the shared connection, connecting if needed.'''
+        with self.lock:
+            if self.connection is None or self.connection.closed:
+                self.connection = Connection(self.server)
+            return self.connection
+
+
+class Connection(object):
+    '''Connection to the binary frontend. A reader green thread
+    matches response frames to waiting requests by ID. If the
+    connection fails, all waiting requests get a socket error.'''
+
+    def __init__(self, server):
+        self.socket = burrow.backend.connect(server)
+        self.lock = eventlet.semaphore.Semaphore()
+        self.pending = {}
+        self.next_id = 0
+        self.closed = False
+        self.reader = eventlet.spawn(self._read)
+
+    def call(self, method, args, body):
+        '''Send a request and return the response status and payload.'''
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        args = json.dumps(args)
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) % 2 ** 32
+        result = eventlet.event.Event()
+        self.pending[request_id] = result
+        try:
+            header = protocol.REQUEST.pack(request_id,
+                protocol.METHODS.index(method), len(args))
+            frame = protocol.pack_frame(header, args, body)
+            with self.lock:
+                self.socket.sendall(frame)
+            return result.wait()
+        except socket.error:
+            self.close()
+            raise
+        finally:
+            del self.pending[request_id]
+
+    def close(self):
+        '''Close the connection, failing all waiting requests.'''
+        if self.closed:
+            return
+        self.closed = True
+        self.socket.close()
+        for result in self.pending.values():
+            if not result.ready():
+                result.send_exception(socket.error(_('Connection closed')))
+
+    def _read(self):
+        '''Read response frames and pass them to waiting requests.'''
+        file_object = self.socket.makefile('rb')
+        try:
+            while True:
+                frame = protocol.read_frame(file_object)
+                if frame is None:
+                    break
+                request_id, status = protocol.RESPONSE.unpack_from(frame)
+                result = self.pending.get(request_id)
+                if result is not None and not result.ready():
+                    result.send((status, frame[protocol.RESPONSE.size:]))
+        except (IOError, ValueError):
+            pass
+        finally:
+            file_object.close()
+            self.close()
@@ -12,17 +12,54 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-'''HTTP backend for burrow using httplib.'''
+'''HTTP backend for burrow using httplib. The green version of
+httplib is used so requests only block the calling green thread.'''
 
-import httplib
-import json
+import collections
+import random
+import threading
+import time
 import urlparse
 
+import eventlet
+import eventlet.event
+from eventlet.green import httplib
+from eventlet.green import socket
+import eventlet.queue
+import eventlet.semaphore
+
 import burrow.backend
+import burrow.common
+from burrow.openstack.common.gettextutils import _
 
 # Default configuration values for this module.
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 8080
+DEFAULT_COMPRESSION = True
+DEFAULT_COMPRESS_REQUESTS = False
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_IDLE_TIMEOUT = 30
+DEFAULT_BALANCE = 'least_outstanding'
+DEFAULT_HEDGE = True
+DEFAULT_PIPELINE_DEPTH = 1
+
+# Number of recent request latencies kept for hedging decisions, how
+# many are needed before hedging starts, and the percentile of them a
+# read may take before it is hedged.
+LATENCY_SAMPLES = 1000
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+
+# Weight given to each new latency in the moving average for a server.
+EWMA_WEIGHT = 0.3
+
+# Size of each read from a response.
+READ_CHUNK_SIZE = 16384
+
+# Methods that are safe to send again if a pooled connection turns out
+# to have been closed by the server.
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT']
 
 
 class Backend(burrow.backend.Backend):
@@ -31,15 +68,37 @@ class Backend(burrow.backend.Backend):
 
     def __init__(self, config):
         super(Backend, self).__init__(config)
+        servers = []
         url = self.config.get('url')
         if url:
-            url = urlparse.urlparse(url)
-            self.config.set('host', url.hostname)
-            if url.port is not None:
-                self.config.set('port', str(url.port))
-        host = self.config.get('host', DEFAULT_HOST)
-        port = self.config.getint('port', DEFAULT_PORT)
-        self.server = (host, port)
+            port = self.config.getint('port', DEFAULT_PORT)
+            for url in url.split(','):
+                servers.append(burrow.backend.parse_server(url, port))
+        else:
+            host = self.config.get('host', DEFAULT_HOST)
+            port = self.config.getint('port', DEFAULT_PORT)
+            servers.append((host, port))
+        self.compression = self.config.getboolean('compression',
+            DEFAULT_COMPRESSION)
+        self.compress_requests = self.config.getboolean('compress_requests',
+            DEFAULT_COMPRESS_REQUESTS)
+        self.compress_min_size = self.config.getint('compress_min_size',
+            DEFAULT_COMPRESS_MIN_SIZE)
+        max_connections = self.config.getint('max_connections',
+            DEFAULT_MAX_CONNECTIONS)
+        idle_timeout = self.config.getint('idle_timeout',
+            DEFAULT_IDLE_TIMEOUT)
+        self.endpoints = [Endpoint(server,
+            ConnectionPool(server, max_connections, idle_timeout))
+            for server in servers]
+        self.balance = self.config.get('balance', DEFAULT_BALANCE)
+        if self.balance not in ['least_outstanding', 'ewma']:
+            raise burrow.InvalidArguments(self.balance)
+        self.hedge = self.config.getboolean('hedge', DEFAULT_HEDGE)
+        self.pipeline_depth = self.config.getint('pipeline_depth',
+            DEFAULT_PIPELINE_DEPTH)
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.hedge_delay = None
 
     def delete_accounts(self, filters=None):
         url = self._add_parameters('', filters=filters)
@@ -72,11 +131,35 @@ class Backend(burrow.backend.Backend):
         url = self._add_parameters(url, attributes, filters)
         return self._request('POST', url)
 
+    def claim_messages(self, account, queue, attributes, filters=None):
+        url = '/%s/%s?claim=true' % (account, queue)
+        url = self._add_parameters(url, attributes, filters)
+        return self._request('POST', url)
+
+    def delete_messages_any(self, account, queues=None, filters=None):
+        url = self._add_queues('/%s' % account, queues)
+        url = self._add_parameters(url, filters=filters)
+        return self._request('DELETE', url).next()
+
+    def get_messages_any(self, account, queues=None, filters=None):
+        url = self._add_queues('/%s' % account, queues)
+        url = self._add_parameters(url, filters=filters)
+        return self._request('GET', url).next()
+
+    def claim_messages_any(self, account, queues, attributes, filters=None):
+        url = self._add_queues('/%s?claim=true' % account, queues)
+        url = self._add_parameters(url, attributes, filters)
+        return self._request('POST', url).next()
+
     def create_message(self, account, queue, message, body, attributes=None):
         url = '/%s/%s/%s' % (account, queue, message)
         url = self._add_parameters(url, attributes)
+        headers = {}
+        if self.compress_requests and len(body) >= self.compress_min_size:
+            body = ''.join(burrow.common.compress([body], 'gzip'))
+            headers['Content-Encoding'] = 'gzip'
         try:
-            return self._request('PUT', url, body=body).next()
+            return self._request('PUT', url, body, headers).next()
         except StopIteration:
             return False
 
@@ -105,12 +188,23 @@ class Backend(burrow.backend.Backend):
         except StopIteration:
             return None
 
+    def get_queue_stats(self, account, queue):
+        url = '/%s/%s?stats=true' % (account, queue)
+        return self._request('GET', url).next()
+
     def clean(self):
         pass
 
+    def _add_queues(self, url, queues):
+        '''Add the list of queues on to the URL as a query parameter,
+        using '*' for all queues in the account.'''
+        separator = '&' if '?' in url else '?'
+        queues = '*' if queues is None else ','.join(queues)
+        return '%s%squeues=%s' % (url, separator, queues)
+
     def _add_parameters(self, url, attributes=None, filters=None):
         '''Add attributes and filters on to the URL as query parameters.'''
-        separator = '?'
+        separator = '&' if '?' in url else '?'
         if attributes is not None:
             parameters = ['ttl', 'hide']
             for parameter in parameters:
@@ -127,29 +221,451 @@ class Backend(burrow.backend.Backend):
                     separator = '&'
         return url
 
-    def _request(self, method, url, *args, **kwargs):
+    def get_connection_stats(self):
+        '''Return connection pool statistics, including the rate at
+        which requests reused an existing connection. Totals for all
+        servers are given along with the statistics for each one.'''
+        endpoints = [endpoint.get_stats() for endpoint in self.endpoints]
+        stats = dict(endpoints=endpoints, hedge_delay=self.hedge_delay)
+        for key in ['requests', 'reused', 'created', 'retried', 'evicted',
+            'idle', 'hedged', 'pipelined']:
+            stats[key] = sum(endpoint[key] for endpoint in endpoints)
+        stats['reuse_rate'] = 0.0
+        if stats['requests'] > 0:
+            stats['reuse_rate'] = stats['reused'] / float(stats['requests'])
+        return stats
+
+    def _request(self, method, url, body=None, headers=None):
         '''Perform the request and handle the response.'''
-        connection = httplib.HTTPConnection(*self.server)
-        connection.request(method, '/v1.0' + url, *args, **kwargs)
-        response = connection.getresponse()
-        if response.status >= 200 and response.status < 300:
-            if int(response.getheader('content-length')) == 0:
-                if response.status == 201:
-                    yield True
-                return
-            body = response.read()
-            if response.getheader('content-type')[:16] == 'application/json':
-                body = json.loads(body)
-                if isinstance(body, list):
-                    for item in body:
+        headers = {} if headers is None else headers
+        if self.compression:
+            headers['Accept-Encoding'] = ', '.join(burrow.common.ENCODINGS)
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        # Long-polling requests are not hedged and their latency is not
+        # recorded since they are expected to take a long time.
+        waiting = 'wait' in query
+        hedge = self.hedge and method == 'GET' and not waiting
+        # Only requests that are safe to send again are pipelined, since
+        # a broken pipeline loses every request waiting on it.
+        pipeline = self.pipeline_depth > 1 and not waiting and \
+            method in IDEMPOTENT_METHODS
+        endpoint, connection, response = self._send(method, '/v1.0' + url,
+            body, headers, hedge, not waiting, pipeline)
+        chunks = self._read_chunks(response)
+        try:
+            if isinstance(connection, Pipeline):
+                # Read the whole body and free the turn before anything
+                # is yielded, otherwise a caller that stops iterating
+                # part way blocks every later request on the pipeline.
+                pipeline, connection = connection, None
+                try:
+                    chunks = list(chunks)
+                finally:
+                    pipeline.release(response)
+            if response.status >= 200 and response.status < 300:
+                content_type = response.getheader('content-type', '')
+                if content_type[:16] == 'application/json':
+                    for item in burrow.common.decode_json(chunks):
                         yield item
                     return
-            yield body
-        body = response.read()
-        if body == '':
-            body = response.reason
-        if response.status == 400:
-            raise burrow.InvalidArguments(body)
-        if response.status == 404:
-            raise burrow.NotFound(body)
-        raise Exception(response.reason)
+                body = ''.join(chunks)
+                if response.getheader('content-length') == '0':
+                    if response.status == 201:
+                        yield True
+                    return
+                yield body
+                return
+            body = ''.join(chunks)
+            if body == '':
+                body = response.reason
+            if response.status == 400:
+                raise burrow.InvalidArguments(body)
+            if response.status == 404:
+                raise burrow.NotFound(body)
+            raise Exception(response.reason)
+        finally:
+            self._release(endpoint, connection, response)
+
+    def _send(self, method, url, body, headers, hedge, record, pipeline):
+        '''Send the request to the best server and return the server
+        endpoint, connection, and response. If hedge is true and the
+        response takes longer than most recent requests, the request
+        is also sent to another server and the first response wins.
+        Hedged requests are never pipelined, since killing the losing
+        request would break the pipeline for other requests on it.'''
+        endpoint = self._choose()
+        if not hedge or len(self.endpoints) < 2 or self.hedge_delay is None:
+            return self._send_endpoint(endpoint, method, url, body, headers,
+                record, pipeline)
+        results = eventlet.queue.LightQueue()
+        first = eventlet.spawn(self._send_endpoint, endpoint, method, url,
+            body, headers, record, False)
+        first.link(results.put)
+        with eventlet.Timeout(self.hedge_delay, False):
+            return results.get().wait()
+        endpoint.hedged += 1
+        second = eventlet.spawn(self._send_endpoint, self._choose(endpoint),
+            method, url, body, headers, record, False)
+        second.link(results.put)
+        winner = results.get()
+        loser = second if winner is first else first
+        try:
+            result = winner.wait()
+        except Exception:
+            return results.get().wait()
+        loser.kill()
+        try:
+            self._release(*loser.wait())
+        except BaseException:
+            pass
+        return result
+
+    def _send_endpoint(self, endpoint, method, url, body, headers, record,
+        pipeline):
+        '''Send the request to a server, keeping track of outstanding
+        requests and latency for it.'''
+        endpoint.outstanding += 1
+        start = time.time()
+        try:
+            if pipeline:
+                connection, response = self._send_pipeline(endpoint, method,
+                    url, body, headers)
+            else:
+                connection, response = self._send_pool(endpoint.pool,
+                    method, url, body, headers)
+        except BaseException:
+            endpoint.outstanding -= 1
+            raise
+        if record:
+            latency = time.time() - start
+            endpoint.record(latency)
+            self._record(latency)
+        return endpoint, connection, response
+
+    def _send_pool(self, pool, method, url, body, headers):
+        '''Send the request on a pooled connection and return the
+        connection and response. If a reused connection was closed by
+        the server, idempotent requests are sent again on a new
+        connection.'''
+        connection, reused = pool.get()
+        try:
+            connection.request(method, url, body, headers)
+            return connection, connection.getresponse()
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            if not reused or method not in IDEMPOTENT_METHODS:
+                raise
+        except BaseException:
+            connection.close()
+            raise
+        pool.retried()
+        connection = pool.create()
+        try:
+            connection.request(method, url, body, headers)
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _send_pipeline(self, endpoint, method, url, body, headers):
+        '''Send the request on the pipelined connection for the server
+        without waiting for earlier responses. If the pipeline is full
+        or broken, the request is sent on a pooled connection instead.'''
+        pipeline = endpoint.pipeline
+        if pipeline is not None and \
+            len(pipeline.turns) >= self.pipeline_depth:
+            return self._send_pool(endpoint.pool, method, url, body, headers)
+        try:
+            if pipeline is None or pipeline.closed or \
+                pipeline.idle() > endpoint.pool.idle_timeout:
+                if pipeline is not None:
+                    pipeline.abort()
+                pipeline = Pipeline(endpoint.server)
+                endpoint.pipeline = pipeline
+            endpoint.pipelined += 1
+            return pipeline, pipeline.send(method, url, body, headers)
+        except (socket.error, httplib.HTTPException):
+            endpoint.pool.retried()
+        return self._send_pool(endpoint.pool, method, url, body, headers)
+
+    def _choose(self, exclude=None):
+        '''Choose a server using the configured balance policy, either
+        the fewest outstanding requests or the lowest moving average
+        latency weighted by outstanding requests. Ties are broken
+        randomly.'''
+        endpoints = [endpoint for endpoint in self.endpoints
+            if endpoint is not exclude]
+        if self.balance == 'ewma':
+            loads = [endpoint.ewma * (endpoint.outstanding + 1)
+                for endpoint in endpoints]
+        else:
+            loads = [endpoint.outstanding for endpoint in endpoints]
+        least = min(loads)
+        return random.choice([endpoint for endpoint, load
+            in zip(endpoints, loads) if load == least])
+
+    def _record(self, latency):
+        '''Record a request latency and update the hedge delay.'''
+        self.latencies.append(latency)
+        count = len(self.latencies)
+        if count < HEDGE_MIN_SAMPLES or count % HEDGE_MIN_SAMPLES != 0:
+            return
+        latencies = sorted(self.latencies)
+        self.hedge_delay = latencies[int(count * HEDGE_PERCENTILE)]
+
+    def _read_chunks(self, response):
+        '''Read the response body in chunks, decompressing it if
+        needed.'''
+        chunks = iter(lambda: response.read(READ_CHUNK_SIZE), '')
+        encoding = response.getheader('content-encoding')
+        if encoding not in burrow.common.ENCODINGS:
+            return chunks
+        return burrow.common.decompress(chunks, encoding)
+
+    def _release(self, endpoint, connection, response):
+        '''Return the connection to the pool if the response was read
+        completely, otherwise close it since unread data is left. The
+        connection is None for pipelined responses that were already
+        released after being buffered.'''
+        endpoint.outstanding -= 1
+        if connection is None:
+            return
+        if isinstance(connection, Pipeline):
+            connection.release(response)
+        elif response.isclosed():
+            endpoint.pool.put(connection, response)
+        else:
+            connection.close()
+
+
+class Endpoint(object):
+    '''A server along with its connection pool and the number of
+    outstanding requests and moving average latency used to balance
+    load between servers.'''
+
+    def __init__(self, server, pool):
+        self.server = server
+        self.pool = pool
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.hedged = 0
+        self.pipeline = None
+        self.pipelined = 0
+
+    def record(self, latency):
+        '''Update the moving average latency.'''
+        self.ewma += EWMA_WEIGHT * (latency - self.ewma)
+
+    def get_stats(self):
+        '''Return the pool statistics along with the server load.'''
+        stats = self.pool.get_stats()
+        stats['server'] = burrow.backend.server_name(self.server)
+        stats['outstanding'] = self.outstanding
+        stats['ewma'] = self.ewma
+        stats['hedged'] = self.hedged
+        stats['pipelined'] = self.pipelined
+        return stats
+
+
+class Pipeline(object):
+    '''A connection that has several requests sent on it before their
+    responses are read. Responses come back in the order the requests
+    were sent, so each request waits for the responses before it to be
+    read completely before reading its own. If any response is not
+    read completely, or the connection fails, the pipeline is closed
+    and requests still waiting get a socket error.'''
+
+    def __init__(self, server):
+        self.server = server
+        self.socket = burrow.backend.connect(server)
+        self.file = _ResponseFile(self.socket.makefile('rb'))
+        self.lock = eventlet.semaphore.Semaphore()
+        self.turns = collections.deque()
+        self.closed = False
+        self.last_used = time.time()
+
+    def send(self, method, url, body, headers):
+        '''Send a request and return the response once the responses
+        for earlier requests have been read.'''
+        lines = ['%s %s HTTP/1.1' % (method, url),
+            'Host: %s' % _host_header(self.server)]
+        for name, value in headers.iteritems():
+            lines.append('%s: %s' % (name, value))
+        if body is not None or method in ['POST', 'PUT']:
+            body = body or ''
+            lines.append('Content-Length: %d' % len(body))
+        request = '\r\n'.join(lines) + '\r\n\r\n' + (body or '')
+        turn = eventlet.event.Event()
+        with self.lock:
+            if self.closed:
+                raise socket.error(_('Pipeline closed'))
+            self.turns.append(turn)
+            if len(self.turns) == 1:
+                turn.send()
+            try:
+                self.socket.sendall(request)
+            except BaseException:
+                self.abort()
+                raise
+        try:
+            turn.wait()
+            response = httplib.HTTPResponse(self.file, method=method)
+            response.begin()
+        except BaseException:
+            self.abort()
+            raise
+        return response
+
+    def release(self, response):
+        '''Let the next request read its response, or close the
+        pipeline if the response was not read completely.'''
+        self.last_used = time.time()
+        if self.closed:
+            return
+        if not response.isclosed() or response.will_close:
+            self.abort()
+            return
+        self.turns.popleft()
+        if len(self.turns) > 0:
+            self.turns[0].send()
+
+    def idle(self):
+        '''Return how long the pipeline has been idle, or zero if
+        requests are in progress.'''
+        if len(self.turns) > 0:
+            return 0
+        return time.time() - self.last_used
+
+    def abort(self):
+        '''Close the pipeline, failing requests waiting for a turn.'''
+        if self.closed:
+            return
+        self.closed = True
+        self.socket.close()
+        for turn in self.turns:
+            if not turn.ready():
+                turn.send_exception(socket.error(_('Pipeline closed')))
+        self.turns.clear()
+
+
+class _ResponseFile(object):
+    '''Buffered file shared by all responses on a pipeline. It acts as
+    the socket given to httplib.HTTPResponse, and ignores close() from
+    each response since later responses still need it.'''
+
+    def __init__(self, file_object):
+        self.file_object = file_object
+
+    def makefile(self, *_args, **_kwargs):
+        '''Return this object as the response file.'''
+        return self
+
+    def read(self, *args):
+        '''Read from the shared file.'''
+        return self.file_object.read(*args)
+
+    def readline(self, *args):
+        '''Read a line from the shared file.'''
+        return self.file_object.readline(*args)
+
+    def close(self):
+        '''Leave the shared file open for later responses.'''
+        pass
+
+
+class ConnectionPool(object):
+    '''Pool of persistent HTTP/1.1 connections to a single server.
+    At most size idle connections are kept, and connections idle for
+    longer than idle_timeout seconds are closed instead of reused. The
+    lock is never held across I/O, so this is safe to share between
+    threads and green threads.'''
+
+    def __init__(self, server, size, idle_timeout):
+        self.server = server
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connections = collections.deque()
+        self.lock = threading.Lock()
+        self.stats = dict(requests=0, reused=0, created=0, retried=0,
+            evicted=0)
+
+    def get(self):
+        '''Get a connection, returning the connection and whether it
+        was reused from the pool.'''
+        with self.lock:
+            self.stats['requests'] += 1
+            self._evict(time.time())
+            if self.connections:
+                self.stats['reused'] += 1
+                return self.connections.pop()[0], True
+        return self.create(), False
+
+    def create(self):
+        '''Create a new connection to the server.'''
+        with self.lock:
+            self.stats['created'] += 1
+        if isinstance(self.server, basestring):
+            return UnixHTTPConnection(self.server)
+        return httplib.HTTPConnection(*self.server)
+
+    def put(self, connection, response):
+        '''Return a connection to the pool once the response has been
+        read completely. Connections the server will close or that do
+        not fit in the pool are closed.'''
+        if not response.will_close:
+            with self.lock:
+                self._evict(time.time())
+                if len(self.connections) < self.size:
+                    self.connections.append((connection, time.time()))
+                    return
+        connection.close()
+
+    def retried(self):
+        '''Record a request that was retried on a stale connection.'''
+        with self.lock:
+            self.stats['retried'] += 1
+
+    def close(self):
+        '''Close all idle connections.'''
+        with self.lock:
+            while self.connections:
+                self.connections.pop()[0].close()
+
+    def get_stats(self):
+        '''Return a copy of the pool statistics with the reuse rate.'''
+        with self.lock:
+            stats = dict(self.stats)
+        stats['idle'] = len(self.connections)
+        stats['reuse_rate'] = 0.0
+        if stats['requests'] > 0:
+            stats['reuse_rate'] = stats['reused'] / float(stats['requests'])
+        return stats
+
+    def _evict(self, now):
+        '''Close connections that have been idle for too long. The
+        oldest connections are on the left side of the deque.'''
+        while self.connections:
+            if now - self.connections[0][1] <= self.idle_timeout:
+                break
+            self.connections.popleft()[0].close()
+            self.stats['evicted'] += 1
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    '''HTTP connection over a unix domain socket, used for servers
+    given as unix:// URLs to avoid the TCP stack for local servers.'''
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        '''Connect to the socket path instead of a host and port.'''
+        self.sock = burrow.backend.connect(self.path)
+
+
+def _host_header(server):
+    '''Return the Host header value to send to a server.'''
+    if isinstance(server, basestring):
+        return 'localhost'
+    return '%s:%d' % server
@@ -30,6 +30,26 @@ class Backend(burrow.backend.Backend):
     def __init__(self, config):
         super(Backend, self).__init__(config)
         self.accounts = Accounts()
+        for name in ['accounts', 'queues', 'messages', 'bytes']:
+            self.metrics.describe('burrow_memory_' + name, 'gauge',
+                'Number of %s stored in the memory backend.' % name)
+
+    def _collect_metrics(self):
+        '''Add counts of stored accounts, queues, messages, and message
+        bytes to the backend gauges.'''
+        queues = 0
+        messages = 0
+        size = 0
+        for account in self.accounts.index.itervalues():
+            queues += account.queues.count()
+            for queue in account.queues.index.itervalues():
+                messages += queue.visible + queue.hidden
+                size += queue.bytes
+        return super(Backend, self)._collect_metrics() + [
+            ('burrow_memory_accounts', (), self.accounts.count()),
+            ('burrow_memory_queues', (), queues),
+            ('burrow_memory_messages', (), messages),
+            ('burrow_memory_bytes', (), size)]
 
     def delete_accounts(self, filters=None):
         if filters is None or len(filters) == 0:
@@ -71,8 +91,9 @@ class Backend(burrow.backend.Backend):
     def delete_messages(self, account, queue, filters=None):
         account, queue = self.accounts.get_queue(account, queue)
         detail = self._get_message_detail(filters)
+        now = time.time()
         for message in queue.messages.iter(filters):
-            queue.messages.delete(message.id)
+            queue.delete_message(message, now)
             if detail is not None:
                 yield message.detail(detail)
         if queue.messages.count() == 0:
@@ -90,41 +111,64 @@ class Backend(burrow.backend.Backend):
     def update_messages(self, account, queue, attributes, filters=None):
         account, queue = self.accounts.get_queue(account, queue)
         notify = False
+        visible = 0
         ttl, hide = self._get_attributes(attributes)
         detail = self._get_message_detail(filters)
         for message in queue.messages.iter(filters):
             if ttl is not None:
                 message.ttl = ttl
             if hide is not None:
-                message.hide = hide
                 if hide == 0:
                     notify = True
+                    if message.hide != 0:
+                        visible += 1
+                queue.set_hide(message, hide)
             if detail is not None:
                 yield message.detail(detail)
         if notify:
-            self.notify(account.id, queue.id)
+            self.notify(account.id, queue.id, visible)
+
+    @burrow.backend.wait_with_attributes
+    def claim_messages(self, account, queue, attributes, filters=None):
+        account, queue = self.accounts.get_queue(account, queue)
+        ttl, hide = self._get_claim_attributes(attributes)
+        detail = self._get_message_detail(filters, 'all')
+        messages = []
+        for message in queue.messages.iter(self._get_claim_filters(filters)):
+            if ttl is not None:
+                message.ttl = ttl
+            queue.set_hide(message, hide)
+            messages.append(message.detail(detail))
+        for message in messages:
+            if detail is not None:
+                yield message
 
     def create_message(self, account, queue, message, body, attributes=None):
         account, queue = self.accounts.get_queue(account, queue, True)
         ttl, hide = self._get_attributes(attributes, ttl=0, hide=0)
+        now = time.time()
         try:
             message = queue.messages.get(message)
+            queue.count(message, -1)
             created = False
         except burrow.NotFound:
             message = queue.messages.get(message, True)
+            message.created = now
+            queue.enqueued.add(now)
             created = True
         message.ttl = ttl
         message.hide = hide
         message.body = body
+        queue.count(message, 1)
         if created or hide == 0:
-            self.notify(account.id, queue.id)
+            self.notify(account.id, queue.id, 1 if hide == 0 else 0)
         return created
 
     def delete_message(self, account, queue, message, filters=None):
         account, queue = self.accounts.get_queue(account, queue)
         message = queue.messages.get(message)
         detail = self._get_message_detail(filters)
-        queue.messages.delete(message.id)
+        queue.delete_message(message, time.time())
         if queue.messages.count() == 0:
             self.accounts.delete_queue(account.id, queue.id)
         return message.detail(detail)
@@ -144,24 +188,28 @@ class Backend(burrow.backend.Backend):
         if ttl is not None:
             message.ttl = ttl
         if hide is not None:
-            message.hide = hide
+            queue.set_hide(message, hide)
             if hide == 0:
-                self.notify(account.id, queue.id)
+                self.notify(account.id, queue.id, 1)
         return message.detail(detail)
 
+    def get_queue_stats(self, account, queue):
+        account, queue = self.accounts.get_queue(account, queue)
+        return queue.stats(time.time())
+
     def clean(self):
         now = int(time.time())
         for account in self.accounts.iter():
             for queue in account.queues.iter():
-                notify = False
+                visible = 0
                 for message in queue.messages.iter(dict(match_hidden=True)):
                     if 0 < message.ttl <= now:
-                        queue.messages.delete(message.id)
+                        queue.delete_message(message, now)
                     elif 0 < message.hide <= now:
-                        message.hide = 0
-                        notify = True
-                if notify:
-                    self.notify(account.id, queue.id)
+                        queue.set_hide(message, 0)
+                        visible += 1
+                if visible > 0:
+                    self.notify(account.id, queue.id, visible)
                 if queue.messages.count() == 0:
                     self.accounts.delete_queue(account.id, queue.id)
 
@@ -292,11 +340,50 @@ class Accounts(IndexedList):
 
 
 class Queue(Item):
-    '''A type of item representing a queue.'''
+    '''A type of item representing a queue. This also keeps the queue
+    statistics, which must be updated through the methods here when
+    messages are changed.'''
 
     def __init__(self, id=None):
         super(Queue, self).__init__(id)
         self.messages = Messages()
+        self.visible = 0
+        self.hidden = 0
+        self.bytes = 0
+        self.enqueued = burrow.backend.WindowCounter()
+        self.dequeued = burrow.backend.WindowCounter()
+
+    def count(self, message, sign):
+        '''Add (sign of 1) or remove (sign of -1) the message from the
+        message and byte counts.'''
+        if message.hide == 0:
+            self.visible += sign
+        else:
+            self.hidden += sign
+        self.bytes += sign * len(message.body)
+
+    def set_hide(self, message, hide):
+        '''Set the hide attribute of a message, updating the counts.'''
+        self.count(message, -1)
+        message.hide = hide
+        self.count(message, 1)
+
+    def delete_message(self, message, now):
+        '''Delete a message from the queue, updating the counts.'''
+        self.messages.delete(message.id)
+        self.count(message, -1)
+        self.dequeued.add(now)
+
+    def stats(self, now):
+        '''Return the queue statistics.'''
+        oldest_age = None
+        if self.messages.first is not None:
+            oldest_age = max(now - self.messages.first.created, 0)
+        return dict(id=self.id, visible=self.visible, hidden=self.hidden,
+            bytes=self.bytes, oldest_age=oldest_age,
+            enqueued=self.enqueued.total, dequeued=self.dequeued.total,
+            enqueue_rate=self.enqueued.rate(now),
+            dequeue_rate=self.dequeued.rate(now))
 
 
 class Queues(IndexedList):
@@ -313,6 +400,7 @@ class Message(Item):
         self.ttl = 0
         self.hide = 0
         self.body = None
+        self.created = 0
 
     def detail(self, detail=None):
         if detail == 'id':
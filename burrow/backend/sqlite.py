@@ -14,21 +14,94 @@
 
 '''SQLite backend for burrow.'''
 
+import errno
+import os
 import sqlite3
 import time
 import urlparse
 
+import eventlet
+import eventlet.green.socket
+import eventlet.greenthread
+
 import burrow.backend
+from burrow.openstack.common.gettextutils import _
 
 # Default configuration values for this module.
 DEFAULT_DATABASE = ':memory:'
 DEFAULT_SYNCHRONOUS = 'FULL'
+DEFAULT_NOTIFY_PATH = None
 
 # Maximum number of parameters to pass to execute. Testing shows a max of
 # 999, so leave a few extra for parameters not added by a list of IDs.
 MAXIMUM_PARAMETERS = 990
 
 
+class Cursor(sqlite3.Cursor):
+    '''SQLite cursor that records how long its statement takes,
+    including fetching the rows, once the rows are exhausted.'''
+
+    metrics = None
+    labels = ()
+    elapsed = 0.0
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.elapsed += time.time() - start
+
+    def observe(self):
+        '''Record the time taken so far, at most once per cursor.'''
+        if self.metrics is not None:
+            self.metrics.observe('burrow_sqlite_statement_duration_seconds',
+                self.elapsed, self.labels)
+            self.metrics = None
+
+    def next(self):
+        try:
+            return self._timed(super(Cursor, self).next)
+        except StopIteration:
+            self.observe()
+            raise
+
+    def fetchone(self):
+        row = self._timed(super(Cursor, self).fetchone)
+        if row is None:
+            self.observe()
+        return row
+
+    def fetchall(self):
+        rows = self._timed(super(Cursor, self).fetchall)
+        self.observe()
+        return rows
+
+    def close(self):
+        self.observe()
+        super(Cursor, self).close()
+
+
+class Connection(sqlite3.Connection):
+    '''SQLite connection that records how long each statement takes,
+    labeled by the first word of the statement.'''
+
+    metrics = None
+
+    def execute(self, query, *args):
+        cursor = self.cursor(Cursor)
+        cursor.metrics = self.metrics
+        cursor.labels = (('statement', query.split(None, 1)[0].upper()),)
+        try:
+            cursor._timed(cursor.execute, query, *args)
+        except Exception:
+            cursor.observe()
+            raise
+        if cursor.description is None:
+            cursor.observe()
+        return cursor
+
+
 class Backend(burrow.backend.Backend):
     '''Backend implemention that uses SQLite to store the account, queue,
     and message data.'''
@@ -40,7 +113,11 @@ class Backend(burrow.backend.Backend):
             url = urlparse.urlparse(url)
             self.config.set('database', url.netloc)
         database = self.config.get('database', DEFAULT_DATABASE)
-        self.db = sqlite3.connect(database)
+        self.db = sqlite3.connect(database, factory=Connection)
+        self.db.metrics = self.metrics
+        self.metrics.describe('burrow_sqlite_statement_duration_seconds',
+            'histogram', 'Time taken to execute SQLite statements and fetch '
+            'their rows.')
         synchronous = self.config.get('synchronous', DEFAULT_SYNCHRONOUS)
         self.db.execute('PRAGMA synchronous=' + synchronous)
         self.db.isolation_level = None
@@ -58,9 +135,97 @@ class Backend(burrow.backend.Backend):
             '    ttl INT UNSIGNED NOT NULL,'
             '    hide INT UNSIGNED NOT NULL,'
             '    body BLOB NOT NULL,'
+            '    created INT UNSIGNED NOT NULL DEFAULT 0,'
             '    PRIMARY KEY (queue, message))']
         for query in queries:
             self.db.execute(query)
+        self._create_stats()
+        notify_path = self.config.get('notify_path', DEFAULT_NOTIFY_PATH)
+        if notify_path:
+            self.bus = NotifyBus(notify_path, self.log)
+        else:
+            self.bus = None
+
+    def _create_stats(self):
+        '''Create the queue statistics table along with the triggers
+        that keep it up to date, so statistics change in the same
+        transaction as the messages. Databases created before the
+        statistics existed are upgraded in place.'''
+        columns = [row[1] for row in
+            self.db.execute('PRAGMA table_info(messages)')]
+        if 'created' not in columns:
+            self.db.execute('ALTER TABLE messages ADD COLUMN '
+                'created INT UNSIGNED NOT NULL DEFAULT 0')
+            self.db.execute('UPDATE messages SET created=?',
+                (int(time.time()),))
+        query = "SELECT name FROM sqlite_master WHERE name='stats'"
+        exists = len(self.db.execute(query).fetchall()) > 0
+        queries = [
+            'CREATE INDEX IF NOT EXISTS messages_queue ON messages (queue)',
+            'CREATE TABLE IF NOT EXISTS stats ('
+            '    queue INTEGER PRIMARY KEY,'
+            '    visible INT NOT NULL DEFAULT 0,'
+            '    hidden INT NOT NULL DEFAULT 0,'
+            '    bytes INT NOT NULL DEFAULT 0,'
+            '    enqueued INT NOT NULL DEFAULT 0,'
+            '    enqueue_window INT NOT NULL DEFAULT 0,'
+            '    enqueue_current INT NOT NULL DEFAULT 0,'
+            '    enqueue_previous INT NOT NULL DEFAULT 0,'
+            '    dequeued INT NOT NULL DEFAULT 0,'
+            '    dequeue_window INT NOT NULL DEFAULT 0,'
+            '    dequeue_current INT NOT NULL DEFAULT 0,'
+            '    dequeue_previous INT NOT NULL DEFAULT 0)',
+            'CREATE TRIGGER IF NOT EXISTS messages_insert '
+            'AFTER INSERT ON messages BEGIN '
+            '    INSERT OR IGNORE INTO stats (queue) VALUES (NEW.queue);'
+            '    UPDATE stats SET visible=visible+(NEW.hide=0),'
+            '        hidden=hidden+(NEW.hide!=0),'
+            '        bytes=bytes+length(CAST(NEW.body AS BLOB)),'
+            '        %s WHERE queue=NEW.queue; '
+            'END' % _count_window('enqueue'),
+            'CREATE TRIGGER IF NOT EXISTS messages_update '
+            'AFTER UPDATE OF hide,body ON messages BEGIN '
+            '    UPDATE stats SET visible=visible+(NEW.hide=0)-(OLD.hide=0),'
+            '        hidden=hidden+(NEW.hide!=0)-(OLD.hide!=0),'
+            '        bytes=bytes+length(CAST(NEW.body AS BLOB))'
+            '            -length(CAST(OLD.body AS BLOB))'
+            '        WHERE queue=NEW.queue; '
+            'END',
+            'CREATE TRIGGER IF NOT EXISTS messages_delete '
+            'AFTER DELETE ON messages BEGIN '
+            '    UPDATE stats SET visible=visible-(OLD.hide=0),'
+            '        hidden=hidden-(OLD.hide!=0),'
+            '        bytes=bytes-length(CAST(OLD.body AS BLOB)),'
+            '        %s WHERE queue=OLD.queue; '
+            'END' % _count_window('dequeue'),
+            'CREATE TRIGGER IF NOT EXISTS queues_delete '
+            'AFTER DELETE ON queues BEGIN '
+            '    DELETE FROM stats WHERE queue=OLD.rowid; '
+            'END']
+        for query in queries:
+            self.db.execute(query)
+        if not exists:
+            self.db.execute('INSERT INTO stats (queue,visible,hidden,bytes) '
+                'SELECT queue,SUM(hide=0),SUM(hide!=0),'
+                'SUM(length(CAST(body AS BLOB))) FROM messages GROUP BY queue')
+
+    def run(self, thread_pool):
+        super(Backend, self).run(thread_pool)
+        if self.bus is not None:
+            thread_pool.spawn_n(self.bus.listen, self._notify_local)
+
+    def close(self):
+        if self.bus is not None:
+            self.bus.close()
+
+    def notify(self, account, queue, count=None):
+        self._notify_local(account, queue, count)
+        if self.bus is not None:
+            self.bus.publish(account, queue, count)
+
+    def _notify_local(self, account, queue, count=None):
+        '''Notify waiting callers in this process only.'''
+        super(Backend, self).notify(account, queue, count)
 
     def delete_accounts(self, filters=None):
         if filters is None or len(filters) == 0:
@@ -346,9 +511,12 @@ class Backend(burrow.backend.Backend):
         detail = self._get_message_detail(filters)
         ids = []
         notify = False
+        visible = 0
         ttl, hide = self._get_attributes(attributes)
         query = 'SELECT rowid,message,ttl,hide,body FROM messages'
         for row in self._get_messages(query, queue_rowid, filters):
+            if hide == 0 and row[3] != 0:
+                visible += 1
             if detail is not None:
                 row = list(row)
                 if ttl is not None:
@@ -365,7 +533,7 @@ class Backend(burrow.backend.Backend):
             if self._update_messages(ttl, hide, ids):
                 notify = True
         if notify:
-            self.notify(account, queue)
+            self.notify(account, queue, visible)
 
     def _update_messages(self, ttl, hide, ids):
         '''Build the SQL query to update messages.'''
@@ -386,6 +554,33 @@ class Backend(burrow.backend.Backend):
         self.db.execute(query + query_values, tuple(values + ids))
         return True
 
+    @burrow.backend.wait_with_attributes
+    def claim_messages(self, account, queue, attributes, filters=None):
+        detail = self._get_message_detail(filters, 'all')
+        ttl, hide = self._get_claim_attributes(attributes)
+        filters = self._get_claim_filters(filters)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            account_rowid = self._get_account(account)
+            queue_rowid = self._get_queue(account_rowid, queue)
+            query = 'SELECT rowid,message,ttl,hide,body FROM messages'
+            rows = list(self._get_messages(query, queue_rowid, filters))
+            ids = [row[0] for row in rows]
+            for start in xrange(0, len(ids), MAXIMUM_PARAMETERS):
+                self._update_messages(ttl, hide,
+                    ids[start:start + MAXIMUM_PARAMETERS])
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        for row in rows:
+            if detail is not None:
+                row = list(row)
+                if ttl is not None:
+                    row[2] = ttl
+                row[3] = hide
+                yield self._message_detail(row[1:], detail)
+
     def create_message(self, account, queue, message, body, attributes=None):
         ttl, hide = self._get_attributes(attributes, ttl=0, hide=0)
         try:
@@ -405,11 +600,14 @@ class Backend(burrow.backend.Backend):
             self.db.execute(query, (ttl, hide, body, message_rowid))
             created = False
         except burrow.NotFound:
-            query = 'INSERT INTO messages VALUES (?,?,?,?,?)'
-            self.db.execute(query, (queue_rowid, message, ttl, hide, body))
+            query = 'INSERT INTO messages ' \
+                '(queue,message,ttl,hide,body,created) VALUES (?,?,?,?,?,?)'
+            values = (queue_rowid, message, ttl, hide, body,
+                int(time.time()))
+            self.db.execute(query, values)
             created = True
         if created or hide == 0:
-            self.notify(account, queue)
+            self.notify(account, queue, 1 if hide == 0 else 0)
         return created
 
     def delete_message(self, account, queue, message, filters=None):
@@ -434,7 +632,7 @@ class Backend(burrow.backend.Backend):
         detail = self._get_message_detail(filters)
         ttl, hide = self._get_attributes(attributes)
         if self._update_messages(ttl, hide, [row[0]]):
-            self.notify(account, queue)
+            self.notify(account, queue, 1 if hide == 0 and row[3] != 0 else 0)
         row = list(row)
         if ttl is not None:
             row[2] = ttl
@@ -442,6 +640,26 @@ class Backend(burrow.backend.Backend):
             row[3] = hide
         return self._message_detail(row[1:], detail)
 
+    def get_queue_stats(self, account, queue):
+        queue_rowid = self._get_queue(self._get_account(account), queue)
+        query = 'SELECT visible,hidden,bytes,' \
+            'enqueued,enqueue_window,enqueue_current,enqueue_previous,' \
+            'dequeued,dequeue_window,dequeue_current,dequeue_previous ' \
+            'FROM stats WHERE queue=?'
+        rows = self.db.execute(query, (queue_rowid,)).fetchall()
+        row = rows[0] if len(rows) > 0 else (0,) * 11
+        query = 'SELECT created FROM messages WHERE queue=? ' \
+            'ORDER BY rowid LIMIT 1'
+        rows = self.db.execute(query, (queue_rowid,)).fetchall()
+        now = time.time()
+        oldest_age = None
+        if len(rows) > 0:
+            oldest_age = max(now - rows[0][0], 0)
+        return dict(id=queue, visible=row[0], hidden=row[1], bytes=row[2],
+            oldest_age=oldest_age, enqueued=row[3], dequeued=row[7],
+            enqueue_rate=burrow.backend.rate(row[4], row[5], row[6], now),
+            dequeue_rate=burrow.backend.rate(row[8], row[9], row[10], now))
+
     def clean(self):
         now = int(time.time())
         query = 'SELECT rowid,queue FROM messages WHERE ttl > 0 AND ttl <= ?'
@@ -464,7 +682,7 @@ class Backend(burrow.backend.Backend):
             self._check_empty_queue(account, queue)
         query = 'SELECT rowid,queue FROM messages WHERE hide > 0 AND hide <= ?'
         messages = []
-        queues = set()
+        queues = {}
         message_query = 'UPDATE messages SET hide=0 WHERE rowid IN '
         message_query_values = '(?' + (',?' * (MAXIMUM_PARAMETERS - 1)) + ')'
         for row in self.db.execute(query, (now,)):
@@ -472,14 +690,125 @@ class Backend(burrow.backend.Backend):
             if len(messages) == MAXIMUM_PARAMETERS:
                 self.db.execute(message_query + message_query_values, messages)
                 messages = []
-            queues.add(row[1])
+            queues[row[1]] = queues.get(row[1], 0) + 1
         if len(messages) > 0:
             message_query_values = '(?' + (',?' * (len(messages) - 1)) + ')'
             self.db.execute(message_query + message_query_values, messages)
-        for queue in queues:
+        for queue, visible in queues.iteritems():
             query = 'SELECT accounts.account,queues.queue ' \
                 'FROM queues JOIN accounts ' \
                 'ON queues.account=accounts.rowid ' \
                 'WHERE queues.rowid=?'
             result = self.db.execute(query, (queue,)).fetchall()[0]
-            self.notify(result[0], result[1])
+            self.notify(result[0], result[1], visible)
+
+
+class NotifyBus(object):
+    '''Notification bus for multiple processes sharing a database
+    file. Each process binds a unix domain datagram socket in the
+    given directory, and notifications are sent to all other sockets
+    found there so waiters in any process are woken right away. Sends
+    never block, so if a peer is not keeping up, its notification is
+    dropped and its waiters fall back to their timeout.'''
+
+    # Seconds to cache the list of peer sockets.
+    peer_ttl = 1
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.name = os.path.join(path, '%d-%x.sock' % (os.getpid(), id(self)))
+        socket = eventlet.green.socket
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.name)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.peers = None
+        self.peers_time = 0
+        self.listener = None
+
+    def close(self):
+        '''Stop the listener, close the socket, and remove it from the
+        bus directory.'''
+        listener, self.listener = self.listener, None
+        if listener is not None and listener is not eventlet.getcurrent():
+            eventlet.greenthread.kill(listener)
+        self.socket.close()
+        self.sender.close()
+        try:
+            os.unlink(self.name)
+        except OSError:
+            pass
+
+    def publish(self, account, queue, count=None):
+        '''Send a notification to all other processes on the bus.'''
+        count = -1 if count is None else count
+        message = '%s\n%s\n%d' % (account, queue, count)
+        for peer in list(self._get_peers()):
+            try:
+                self.sender.sendto(message, peer)
+            except eventlet.green.socket.error as exception:
+                if exception.errno in [errno.ECONNREFUSED, errno.ENOENT]:
+                    self._remove_peer(peer)
+                else:
+                    self.log.debug(_('Dropped notification for %(peer)s: '
+                        '%(error)s') % dict(peer=peer, error=exception))
+
+    def listen(self, callback):
+        '''Receive notifications from other processes forever, calling
+        callback(account, queue, count) for each one. This returns
+        once the bus is closed.'''
+        self.listener = eventlet.getcurrent()
+        while True:
+            try:
+                message = self.socket.recv(65536)
+            except eventlet.green.socket.error as exception:
+                if exception.errno == errno.EBADF:
+                    return
+                raise
+            try:
+                account, queue, count = message.split('\n')
+                count = int(count)
+            except ValueError:
+                self.log.warning(_('Invalid notification: %r') % message)
+                continue
+            callback(account, queue, None if count < 0 else count)
+
+    def _get_peers(self):
+        '''Get the list of peer sockets, using a cached list if it is
+        recent enough.'''
+        now = time.time()
+        if self.peers is None or now - self.peers_time > self.peer_ttl:
+            self.peers = []
+            for name in os.listdir(self.path):
+                name = os.path.join(self.path, name)
+                if name != self.name and name.endswith('.sock'):
+                    self.peers.append(name)
+            self.peers_time = now
+        return self.peers
+
+    def _remove_peer(self, peer):
+        '''Remove a socket that no process is listening on.'''
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+        if peer in self.peers:
+            self.peers.remove(peer)
+
+
+def _count_window(prefix):
+    '''Return the SQL assignments to count an event in the window
+    columns with the given prefix, in the same way as
+    :class:`burrow.backend.WindowCounter`.'''
+    window = "CAST(strftime('%%s','now') AS INTEGER)/%d" % \
+        burrow.backend.STATS_WINDOW
+    return '%(prefix)sd=%(prefix)sd+1,' \
+        '%(prefix)s_previous=CASE %(window)s ' \
+        'WHEN %(prefix)s_window THEN %(prefix)s_previous ' \
+        'WHEN %(prefix)s_window+1 THEN %(prefix)s_current ELSE 0 END,' \
+        '%(prefix)s_current=CASE %(window)s ' \
+        'WHEN %(prefix)s_window THEN %(prefix)s_current+1 ELSE 1 END,' \
+        '%(prefix)s_window=%(window)s' % dict(prefix=prefix, window=window)
@@ -14,15 +14,36 @@
 
 '''Client module for burrow.'''
 
+import time
+import types
 import urlparse
 
+import eventlet
+import eventlet.event
+import eventlet.queue
+import eventlet.semaphore
+
+import burrow
+
 import burrow.common
 import burrow.config
+from burrow.openstack.common.gettextutils import _
 from burrow.openstack.common import importutils
 
 
 # Default configuration values for this module.
 DEFAULT_BACKEND = 'burrow.backend.http'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_BYTES = 1048576
+DEFAULT_LINGER = 0.01
+DEFAULT_BUFFER_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PREFETCH = 10
+DEFAULT_HIDE = 60
+DEFAULT_WAIT = 10
+DEFAULT_ACK_BATCH_SIZE = 10
+DEFAULT_RETRY_DELAY = 1
 
 
 class Client(object):
@@ -45,8 +66,12 @@ class Client(object):
 
     def _parse_url(self, url):
         '''Parse a backend URL and set config values so it overrides
-        previous values.'''
-        backend = 'burrow.backend.' + urlparse.urlparse(url).scheme
+        previous values. Unix domain socket URLs use the http backend
+        unless another is given, such as binary+unix://path.'''
+        scheme = urlparse.urlparse(url).scheme
+        if scheme == 'unix':
+            scheme = 'http'
+        backend = 'burrow.backend.' + scheme.split('+')[0]
         self.config.set('backend', backend)
         if not self._config.has_section(backend):
             self._config.add_section(backend)
@@ -62,6 +87,39 @@ class Client(object):
         return getattr(self.backend, name)
 
 
+class GreenClient(Client):
+    '''Client that runs each request in a green thread so many
+    requests, including long-polling requests, can be outstanding
+    at once. Each method returns an eventlet GreenThread, and calling
+    wait() on it returns the result or raises the exception for the
+    request. Results that are generators are returned as lists.'''
+
+    def __init__(self, *args, **kwargs):
+        super(GreenClient, self).__init__(*args, **kwargs)
+        pool_size = self.config.getint('pool_size', DEFAULT_POOL_SIZE)
+        self.pool = eventlet.GreenPool(pool_size)
+
+    def __getattr__(self, name):
+        function = getattr(self.backend, name)
+
+        def spawn(*args, **kwargs):
+            '''Start the backend method in a green thread.'''
+            return self.pool.spawn(_call, function, args, kwargs)
+        return spawn
+
+    def waitall(self):
+        '''Wait for all outstanding requests to finish.'''
+        self.pool.waitall()
+
+
+def _call(function, args, kwargs):
+    '''Call the function, reading the result if it is a generator.'''
+    result = function(*args, **kwargs)
+    if isinstance(result, types.GeneratorType):
+        result = list(result)
+    return result
+
+
 class Account(object):
     '''Convenience wrapper around the Client class that saves the
     account setting. This allows you to use methods without specifying
@@ -70,9 +128,13 @@ class Account(object):
     account_methods = [
         'delete_queues',
         'get_queues',
+        'delete_messages_any',
+        'get_messages_any',
+        'claim_messages_any',
         'delete_messages',
         'get_messages',
         'update_messages',
+        'claim_messages',
         'create_message',
         'delete_message',
         'get_message',
@@ -105,7 +167,7 @@ class Queue(Account):
     def __init__(self, account, queue, **kwargs):
         super(Queue, self).__init__(account, **kwargs)
         self.queue = queue
-        self.queue_methods = self.account_methods[2:]
+        self.queue_methods = self.account_methods[5:]
 
     def __getattr__(self, name):
         '''If the requested method is a queue method, return a wrapper
@@ -118,3 +180,213 @@ class Queue(Account):
             return getattr(self.client, name)(self.account, self.queue, *args,
                 **kwargs)
         return function
+
+
+class Producer(object):
+    '''Buffer messages for a Queue and create them in batches. A
+    batch is sent when it reaches batch_size messages or batch_bytes
+    of message bodies, or linger seconds after the first message was
+    buffered. Batches are sent in the background, each in a single
+    green thread over one keep-alive connection, with up to
+    concurrency batches in flight. Batches in flight at the same time
+    may be created in any order, so use a concurrency of one to keep
+    messages in the order they were sent. When buffer_size
+    messages are waiting to be created, send blocks until there
+    is room.'''
+
+    def __init__(self, queue, batch_size=DEFAULT_BATCH_SIZE,
+        batch_bytes=DEFAULT_BATCH_BYTES, linger=DEFAULT_LINGER,
+        buffer_size=DEFAULT_BUFFER_SIZE, concurrency=DEFAULT_CONCURRENCY):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.linger = linger
+        self.slots = eventlet.semaphore.Semaphore(buffer_size)
+        self.pool = eventlet.GreenPool(concurrency)
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.timer = None
+
+    def send(self, message, body, attributes=None, callback=None):
+        '''Buffer a message to be created. This returns an event whose
+        wait() method returns the create_message result (True if the
+        message was created, False if it replaced an existing one)
+        or raises the error. If given, callback is called with the
+        message ID, the result, and the exception or None.'''
+        self.slots.acquire()
+        result = eventlet.event.Event()
+        self.buffer.append((message, body, attributes, result, callback))
+        self.buffer_bytes += len(body)
+        if len(self.buffer) >= self.batch_size or \
+            self.buffer_bytes >= self.batch_bytes:
+            self.flush()
+        elif self.timer is None:
+            self.timer = eventlet.spawn_after(self.linger, self._linger)
+        return result
+
+    def flush(self):
+        '''Start sending all buffered messages.'''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        if len(batch) > 0:
+            self.pool.spawn_n(self._create_messages, batch)
+
+    def close(self):
+        '''Send all buffered messages and wait for them to finish.'''
+        self.flush()
+        self.pool.waitall()
+
+    def _linger(self):
+        '''Flush the buffer once the linger time has passed.'''
+        self.timer = None
+        self.flush()
+
+    def _create_messages(self, batch):
+        '''Create each message in the batch and send the results.'''
+        for message, body, attributes, result, callback in batch:
+            try:
+                created = self.queue.create_message(message, body,
+                    attributes)
+                exception = None
+            except Exception as exception:
+                created = None
+            self.slots.release()
+            if exception is None:
+                result.send(created)
+            else:
+                result.send_exception(exception)
+            if callback is not None:
+                try:
+                    callback(message, created, exception)
+                except Exception:
+                    self.queue.log.exception(_('Producer callback failed'))
+
+
+class Consumer(object):
+    '''Keep up to prefetch claimed messages from a Queue in a local
+    buffer so the next message is ready as soon as the last one is
+    processed. Messages are claimed with the given hide time by a
+    background green thread, which long-polls for more once at least
+    refill messages have been taken from the buffer. Messages that
+    sat in the buffer longer than their hide time are skipped since
+    another worker may have claimed them. Calls to ack() delete
+    messages in batches of ack_batch_size, or linger seconds after
+    the first unsent ack.'''
+
+    def __init__(self, queue, prefetch=DEFAULT_PREFETCH, hide=DEFAULT_HIDE,
+        wait=DEFAULT_WAIT, refill=None, ack_batch_size=DEFAULT_ACK_BATCH_SIZE,
+        linger=DEFAULT_LINGER):
+        self.queue = queue
+        self.prefetch = prefetch
+        self.hide = hide
+        self.wait = wait
+        self.refill = max(1, prefetch / 2) if refill is None else refill
+        self.ack_batch_size = ack_batch_size
+        self.linger = linger
+        self.buffer = eventlet.queue.LightQueue()
+        self.drained = eventlet.event.Event()
+        self.acks = []
+        self.ack_pool = eventlet.GreenPool(1)
+        self.timer = None
+        self.closed = False
+        self.fetcher = eventlet.spawn(self._fetch)
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    def get(self, timeout=None):
+        '''Return the next claimed message, waiting up to timeout
+        seconds for one. This raises eventlet.queue.Empty if no message
+        arrives in time.'''
+        return self.get_claim(timeout)[1]
+
+    def get_claim(self, timeout=None):
+        '''Like get(), but return the time the message was claimed
+        along with the message.'''
+        while True:
+            claimed, message = self.buffer.get(timeout=timeout)
+            free = self.prefetch - self.buffer.qsize()
+            if free >= self.refill and not self.drained.ready():
+                self.drained.send()
+            if time.time() - claimed < self.hide:
+                return claimed, message
+
+    def ack(self, message):
+        '''Queue a message ID to be deleted once processing is done.'''
+        self.acks.append(message)
+        if len(self.acks) >= self.ack_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = eventlet.spawn_after(self.linger, self._linger)
+
+    def flush(self):
+        '''Start sending all queued acks.'''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        acks = self.acks
+        self.acks = []
+        if len(acks) > 0:
+            self.ack_pool.spawn_n(self._delete_messages, acks)
+
+    def close(self):
+        '''Stop prefetching, send all queued acks, and make messages
+        still in the buffer visible to other workers again. A claim
+        request in progress is allowed to finish, since the server
+        would still claim messages for it, so this may block for up
+        to the wait time.'''
+        self.closed = True
+        if not self.drained.ready():
+            self.drained.send()
+        self.fetcher.wait()
+        self.flush()
+        self.ack_pool.waitall()
+        while self.buffer.qsize() > 0:
+            message = self.buffer.get()[1]
+            try:
+                self.queue.update_message(message['id'], dict(hide=0))
+            except burrow.NotFound:
+                pass
+
+    def _fetch(self):
+        '''Claim messages whenever there is room in the buffer.'''
+        attributes = dict(hide=self.hide)
+        while not self.closed:
+            free = self.prefetch - self.buffer.qsize()
+            if free < self.refill:
+                self.drained = eventlet.event.Event()
+                self.drained.wait()
+                continue
+            filters = dict(limit=free, wait=self.wait, detail='all')
+            try:
+                messages = list(self.queue.claim_messages(attributes,
+                    filters))
+            except burrow.NotFound:
+                continue
+            except Exception:
+                self.queue.log.exception(_('Consumer claim failed'))
+                eventlet.sleep(DEFAULT_RETRY_DELAY)
+                continue
+            claimed = time.time()
+            for message in messages:
+                self.buffer.put((claimed, message))
+
+    def _linger(self):
+        '''Flush the acks once the linger time has passed.'''
+        self.timer = None
+        self.flush()
+
+    def _delete_messages(self, acks):
+        '''Delete each acknowledged message.'''
+        for message in acks:
+            try:
+                self.queue.delete_message(message)
+            except burrow.NotFound:
+                pass
+            except Exception:
+                self.queue.log.exception(_('Consumer ack failed'))
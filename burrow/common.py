@@ -14,7 +14,10 @@
 
 '''Common classes and functions for burrow.'''
 
+import json
 import logging
+import re
+import zlib
 
 import burrow.config
 from burrow.openstack.common.gettextutils import _
@@ -30,6 +33,16 @@ class Module(object):
         self.log.debug(_('Module created'))
 
 
+# Content encodings supported by compress and decompress.
+ENCODINGS = ['gzip', 'deflate']
+
+# Maximum size of each chunk produced by decompress.
+DECOMPRESS_CHUNK_SIZE = 65536
+
+# Whitespace allowed between JSON tokens.
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
 def get_logger(config):
     '''Create a logger from the given config using the section name
     and optional log level.'''
@@ -51,3 +64,103 @@ def add_default_log_handler():
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     handler.setFormatter(logging.Formatter(log_format))
     root_log.addHandler(handler)
+
+
+def compress(chunks, encoding, level=zlib.Z_DEFAULT_COMPRESSION):
+    '''Incrementally compress an iterable of strings using the given
+    content encoding, yielding compressed chunks as they are ready.'''
+    if encoding == 'gzip':
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == 'deflate':
+        wbits = zlib.MAX_WBITS
+    else:
+        raise ValueError(encoding)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def decompress(chunks, encoding):
+    '''Incrementally decompress an iterable of strings using the given
+    content encoding. Output chunks are limited in size so a small,
+    highly compressed input can not expand all at once.'''
+    if encoding not in ENCODINGS:
+        raise ValueError(encoding)
+    # Automatically detect either a gzip or zlib header.
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+            if data:
+                yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def decode_json(chunks):
+    '''Incrementally decode a JSON document from an iterable of
+    strings. If the document is a list, each item is yielded as soon
+    as it has been received, otherwise the document is yielded once
+    it has been read completely.'''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    text = ''
+    position = 0
+    state = 'start'
+    # Minimum buffered size before trying to decode an item again, so
+    # large items are not rescanned for every chunk.
+    needed = 0
+    exhausted = False
+    while True:
+        position = JSON_WHITESPACE.match(text, position).end()
+        available = len(text) - position
+        if not exhausted and (available == 0 or available < needed):
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                text = text[position:] + chunk
+                position = 0
+            continue
+        if available == 0:
+            if state == 'start':
+                return
+            raise ValueError('Truncated JSON document')
+        if state == 'start':
+            if text[position] != '[':
+                yield json.loads(text[position:] + ''.join(chunks))
+                return
+            position += 1
+            state = 'first'
+        elif state == 'first' and text[position] == ']':
+            return
+        elif state in ['first', 'item']:
+            try:
+                item, end = decoder.raw_decode(text, position)
+                end = JSON_WHITESPACE.match(text, end).end()
+            except ValueError:
+                end = len(text)
+            # A list item is always followed by a separator or the end
+            # of the list, otherwise it may still be incomplete, such
+            # as a number that was split across chunks.
+            if end == len(text) or text[end] not in ',]':
+                if exhausted:
+                    raise ValueError('Truncated JSON document')
+                needed = available * 2
+                continue
+            needed = 0
+            position = end
+            state = 'separator'
+            yield item
+        elif text[position] == ',':
+            position += 1
+            state = 'item'
+        elif text[position] == ']':
+            return
+        else:
+            raise ValueError('Expecting , or ] in JSON list')
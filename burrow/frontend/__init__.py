@@ -14,7 +14,18 @@
 
 '''Frontends for burrow.'''
 
+import errno
+import os
+import socket
+import stat
+import time
+import types
+
+import eventlet
+
+import burrow
 import burrow.common
+from burrow.openstack.common.gettextutils import _
 
 
 class Frontend(burrow.common.Module):
@@ -23,8 +34,89 @@ class Frontend(burrow.common.Module):
     def __init__(self, config, backend):
         super(Frontend, self).__init__(config)
         self.backend = backend
+        metrics = self.backend.metrics
+        metrics.describe('burrow_backend_duration_seconds', 'histogram',
+            'Time taken by backend methods, including waiting.')
+        metrics.describe('burrow_backend_calls_total', 'counter',
+            'Backend method calls by result.')
 
     def run(self, thread_pool):
         '''Run the frontend instance, adding any threads to the
         thread_pool if needed.'''
         pass
+
+    def listen(self, default_host, default_port, default_backlog):
+        '''Create the listening socket. If the unix_socket option is
+        set, listen on that path so local clients can connect without
+        going through TCP, otherwise listen on the host and port.'''
+        backlog = self.config.getint('backlog', default_backlog)
+        path = self.config.get('unix_socket')
+        if path:
+            if os.path.exists(path) and \
+                stat.S_ISSOCK(os.stat(path).st_mode):
+                self._remove_stale_socket(path)
+            listener = eventlet.listen(path, family=socket.AF_UNIX,
+                backlog=backlog)
+            mode = self.config.get('unix_socket_mode')
+            if mode:
+                os.chmod(path, int(mode, 8))
+            self.log.info(_('Listening on %s') % path)
+            return listener
+        host = self.config.get('host', default_host)
+        port = self.config.getint('port', default_port)
+        listener = eventlet.listen((host, port), backlog=backlog)
+        self.log.info(
+            _('Listening on %(host)s:%(port)d') % dict(host=host, port=port))
+        return listener
+
+    def _remove_stale_socket(self, path):
+        '''Remove a socket left behind by a previous server. If a server
+        still accepts connections on it, it is left alone and an error
+        is raised instead.'''
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error as exception:
+            if exception.errno == errno.ECONNREFUSED:
+                os.unlink(path)
+                return
+            if exception.errno == errno.ENOENT:
+                return
+            raise
+        finally:
+            probe.close()
+        raise socket.error(errno.EADDRINUSE,
+            _('Socket %s is in use by another server') % path)
+
+    def call_backend(self, method, *args, **kwargs):
+        '''Call a backend method, reading a generator result into a
+        list, and record how long it took and the result in the backend
+        metrics.'''
+        start = time.time()
+        result = 'error'
+        try:
+            value = self.backend.profiler.call(self._call_backend, method,
+                args, kwargs)
+            result = 'ok'
+            return value
+        except burrow.NotFound:
+            result = 'not_found'
+            raise
+        except burrow.InvalidArguments:
+            result = 'invalid_arguments'
+            raise
+        finally:
+            labels = (('method', method),)
+            metrics = self.backend.metrics
+            metrics.observe('burrow_backend_duration_seconds',
+                time.time() - start, labels)
+            metrics.increment('burrow_backend_calls_total',
+                labels + (('result', result),))
+
+    def _call_backend(self, method, args, kwargs):
+        '''Call a backend method, reading a generator result into a
+        list.'''
+        value = getattr(self.backend, method)(*args, **kwargs)
+        if isinstance(value, types.GeneratorType):
+            value = list(value)
+        return value
@@ -0,0 +1,318 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Admission control for frontends. This limits how often and in
+what order requests from each account are handled, so one busy
+account can not slow down requests for all the others.'''
+
+import collections
+import time
+
+import eventlet
+import eventlet.event
+
+# Number of token buckets to keep before dropping the least recently
+# used one. A dropped bucket starts full again on the next request.
+MAX_BUCKETS = 10000
+
+# Weight given to each new request time in the moving average.
+EWMA_WEIGHT = 0.1
+
+
+def parse_account_values(value, convert=float):
+    '''Parse a comma separated list of account:value pairs into a
+    dict, such as 'a:100, b:10'.'''
+    values = {}
+    if not value:
+        return values
+    for pair in value.split(','):
+        account, _sep, pair_value = pair.strip().rpartition(':')
+        values[account] = convert(pair_value)
+    return values
+
+
+class TokenBucket(object):
+    '''Token bucket that refills at rate tokens per second up to burst
+    tokens.'''
+
+    __slots__ = ['rate', 'burst', 'tokens', 'last']
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def take(self, now):
+        '''Take a token, returning 0 if one was available or else the
+        number of seconds until one will be.'''
+        self.tokens = min(self.burst,
+            self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    '''Per account token bucket rate limits. Accounts get rate
+    requests per second with bursts of up to burst requests, unless
+    the account has its own rate in rates. A rate of 0 means no
+    limit.'''
+
+    def __init__(self, rate, burst=0, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.buckets = collections.OrderedDict()
+
+    def take(self, account):
+        '''Take a token for the account, returning 0 if the request is
+        allowed or else the number of seconds to wait before retrying.
+        Buckets are kept in least recently used order so the oldest
+        can be dropped in O(1) time once there are MAX_BUCKETS.'''
+        bucket = self.buckets.pop(account, None)
+        now = time.time()
+        if bucket is None:
+            rate = self.rates.get(account, self.rate)
+            if rate <= 0:
+                return 0
+            if len(self.buckets) >= MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+            burst = self.burst if self.burst > 0 else max(rate, 1)
+            bucket = TokenBucket(rate, burst, now)
+        self.buckets[account] = bucket
+        return bucket.take(now)
+
+
+class FairScheduler(object):
+    '''Admit at most size requests at a time, with waiting requests
+    admitted in weighted round robin order by account. An account with
+    weight 2 has two requests admitted for each one from an account
+    with weight 1 while both have requests waiting, and requests from
+    the same account are admitted in order. Admitting and releasing
+    are O(1).
+
+    This can also be registered with :class:`burrow.backend.Waiters`
+    like a green thread pool, so requests parked in a long-poll give
+    their slot to other requests until they resume.'''
+
+    def __init__(self, size, weights=None, default_weight=1):
+        self.size = size
+        self.available = size
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.waiting = {}
+        self.waiting_total = 0
+        self.accounts = collections.deque()
+        self.credit = 0
+        self.coroutines_running = {}
+        self.parked = set()
+
+    def acquire(self, account):
+        '''Wait until a request for the account is admitted.'''
+        self._acquire(account)
+        self.coroutines_running[eventlet.getcurrent()] = account
+
+    def release(self):
+        '''Release the slot held by the current request.'''
+        current = eventlet.getcurrent()
+        self.coroutines_running.pop(current, None)
+        if current in self.parked:
+            self.parked.discard(current)
+            return
+        self._grant()
+
+    def park(self, greenlet):
+        '''Give the slot of an admitted request to another request while
+        it is parked. Returns False if the request was not admitted.'''
+        if greenlet not in self.coroutines_running or greenlet in self.parked:
+            return False
+        self.parked.add(greenlet)
+        self._grant()
+        return True
+
+    def unpark(self, greenlet):
+        '''Wait in line for a slot for a parked request again.'''
+        self._acquire(self.coroutines_running[greenlet])
+        self.parked.discard(greenlet)
+
+    def waiting_count(self):
+        '''Return the number of requests waiting to be admitted.'''
+        return self.waiting_total
+
+    def _weight(self, account):
+        '''Return the weight for an account.'''
+        return self.weights.get(account, self.default_weight)
+
+    def _acquire(self, account):
+        '''Take a free slot, or wait in line for one.'''
+        if self.available > 0 and len(self.accounts) == 0:
+            self.available -= 1
+            return
+        queue = self.waiting.get(account)
+        if queue is None:
+            queue = self.waiting[account] = collections.deque()
+            self.accounts.append(account)
+            if len(self.accounts) == 1:
+                self.credit = self._weight(account)
+        event = eventlet.event.Event()
+        queue.append(event)
+        self.waiting_total += 1
+        try:
+            event.wait()
+        except BaseException:
+            if event.ready():
+                self._grant()
+            else:
+                self._cancel(account, event)
+            raise
+
+    def _grant(self):
+        '''Give a released slot to the next waiting request, or make it
+        available if nothing is waiting.'''
+        if len(self.accounts) == 0:
+            self.available += 1
+            return
+        account = self.accounts[0]
+        queue = self.waiting[account]
+        queue.popleft().send()
+        self.waiting_total -= 1
+        self.credit -= 1
+        if len(queue) == 0:
+            del self.waiting[account]
+            self.accounts.popleft()
+        elif self.credit <= 0:
+            self.accounts.rotate(-1)
+        else:
+            return
+        if len(self.accounts) > 0:
+            self.credit = self._weight(self.accounts[0])
+
+    def _cancel(self, account, event):
+        '''Remove a request that stopped waiting before being admitted.'''
+        queue = self.waiting[account]
+        queue.remove(event)
+        self.waiting_total -= 1
+        if len(queue) == 0:
+            del self.waiting[account]
+            first = self.accounts[0] == account
+            self.accounts.remove(account)
+            if first and len(self.accounts) > 0:
+                self.credit = self._weight(self.accounts[0])
+
+
+class LoadShedder(object):
+    '''Reject requests early when the server is saturated instead of
+    letting them queue until clients time out. Requests wait for a slot
+    in a :class:`FairScheduler`, and the time spent waiting is tracked
+    in the style of CoDel: if even the shortest wait during an interval
+    was over the target, the queue is standing rather than absorbing a
+    burst, so the server is considered overloaded.
+
+    Normally a request may wait up to timeout seconds for a slot. While
+    overloaded, requests may only wait up to the target, or the smaller
+    listing target for expensive listing requests, so listings are shed
+    before cheap single message requests. Requests are also rejected
+    without waiting if the expected wait, based on the number waiting
+    and the moving average time requests take, is over that limit, or
+    if fewer than pool_reserve of the server thread pool is free.'''
+
+    def __init__(self, scheduler, target, listing_target, interval, timeout,
+        pool_reserve=0):
+        self.scheduler = scheduler
+        self.target = target
+        self.listing_target = listing_target
+        self.interval = interval
+        self.timeout = timeout
+        self.pool_reserve = pool_reserve
+        self.pool = None
+        self.overloaded = False
+        self.window_end = 0
+        self.window_min = None
+        self.service_time = 0.0
+        self.stats = dict(admitted=0, shed=0, timeouts=0)
+
+    def admit(self, account, listing=False):
+        '''Wait for a slot for a request, returning True if the request
+        was admitted or False if it should be rejected.'''
+        now = time.time()
+        self._update(now)
+        if self.overloaded:
+            wait = self.listing_target if listing else self.target
+        else:
+            wait = self.timeout
+        if self._pool_exhausted() or self._expected_wait() > wait:
+            self.stats['shed'] += 1
+            return False
+        timeout = eventlet.Timeout(wait)
+        try:
+            self.scheduler.acquire(account)
+        except eventlet.Timeout as exception:
+            if exception is not timeout:
+                raise
+            self._record(wait, time.time())
+            self.stats['timeouts'] += 1
+            return False
+        finally:
+            timeout.cancel()
+        end = time.time()
+        self._record(end - now, end)
+        self.stats['admitted'] += 1
+        return True
+
+    def release(self, service_time):
+        '''Release the slot for a request and record how long it took
+        once admitted.'''
+        self.scheduler.release()
+        self.service_time += EWMA_WEIGHT * (service_time - self.service_time)
+
+    def get_stats(self):
+        '''Return counts of admitted and rejected requests along with
+        the current state.'''
+        stats = dict(self.stats)
+        stats['overloaded'] = self.overloaded
+        stats['waiting'] = self.scheduler.waiting_count()
+        stats['service_time'] = self.service_time
+        return stats
+
+    def _pool_exhausted(self):
+        '''Check if too little of the server thread pool is free.'''
+        if self.pool is None or self.pool_reserve <= 0:
+            return False
+        return self.pool.free() < self.pool.size * self.pool_reserve
+
+    def _expected_wait(self):
+        '''Estimate how long a new request would wait for a slot.'''
+        return self.scheduler.waiting_count() * self.service_time / \
+            self.scheduler.size
+
+    def _record(self, wait, now):
+        '''Record how long a request waited for a slot.'''
+        self._update(now)
+        if self.window_min is None or wait < self.window_min:
+            self.window_min = wait
+
+    def _update(self, now):
+        '''Start a new interval if the current one has ended, deciding
+        if the server is overloaded from the shortest wait in it.'''
+        if now < self.window_end:
+            return
+        if self.window_min is not None:
+            self.overloaded = self.window_min > self.target
+        elif self.scheduler.waiting_count() == 0:
+            self.overloaded = False
+        self.window_min = None
+        self.window_end = now + self.interval
@@ -0,0 +1,206 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Binary TCP frontend for the burrow server. Each request and
+response is a frame made of a 4 byte length followed by that many
+bytes. A request frame starts with a request ID, a method number
+from METHODS, and the length of a JSON list of arguments, followed by
+the arguments and then the raw message body for create_message. A
+response frame starts with the request ID and a status, followed by
+the result as JSON or a raw string, or the error message. Requests
+on a connection are handled concurrently and responses are sent as
+they complete, so clients match them to requests by ID.'''
+
+import errno
+import json
+import struct
+
+import eventlet
+from eventlet.green import socket
+import eventlet.semaphore
+
+import burrow
+import burrow.backend
+import burrow.frontend
+from burrow.openstack.common.gettextutils import _
+
+# Default configuration values for this module.
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8081
+DEFAULT_BACKLOG = 64
+DEFAULT_THREAD_POOL_SIZE = 0
+DEFAULT_TTL = 600
+DEFAULT_HIDE = 0
+DEFAULT_MAX_FRAME_SIZE = 16777216
+
+# Backend methods that can be called, in method number order.
+METHODS = [
+    'delete_accounts',
+    'get_accounts',
+    'delete_queues',
+    'get_queues',
+    'delete_messages_any',
+    'get_messages_any',
+    'claim_messages_any',
+    'delete_messages',
+    'get_messages',
+    'update_messages',
+    'claim_messages',
+    'create_message',
+    'delete_message',
+    'get_message',
+    'update_message',
+    'get_queue_stats']
+
+# Frame formats for the length prefix, request header, and response
+# header.
+LENGTH = struct.Struct('!I')
+REQUEST = struct.Struct('!IBI')
+RESPONSE = struct.Struct('!IB')
+
+# Response status values.
+STATUS_JSON = 0
+STATUS_RAW = 1
+STATUS_NOT_FOUND = 2
+STATUS_INVALID_ARGUMENTS = 3
+STATUS_ERROR = 4
+
+
+def read_frame(file_object, max_size=0):
+    '''Read a frame from a file object, returning None at the end of
+    the stream. This raises ValueError if the stream ends in the middle
+    of a frame or if the frame is larger than max_size.'''
+    data = file_object.read(LENGTH.size)
+    if data == '':
+        return None
+    if len(data) < LENGTH.size:
+        raise ValueError(_('Truncated frame'))
+    size = LENGTH.unpack(data)[0]
+    if max_size > 0 and size > max_size:
+        raise ValueError(_('Frame too large'))
+    data = file_object.read(size)
+    if len(data) < size:
+        raise ValueError(_('Truncated frame'))
+    return data
+
+
+def pack_frame(*parts):
+    '''Join the parts into a frame with a length prefix.'''
+    data = ''.join(parts)
+    return LENGTH.pack(len(data)) + data
+
+
+class Frontend(burrow.frontend.Frontend):
+    '''Frontend implementation that implements a binary protocol
+    over TCP.'''
+
+    def __init__(self, config, backend):
+        super(Frontend, self).__init__(config, backend)
+        self.default_ttl = int(self.config.get('default_ttl', DEFAULT_TTL))
+        self.default_hide = int(self.config.get('default_hide', DEFAULT_HIDE))
+        self.max_frame_size = self.config.getint('max_frame_size',
+            DEFAULT_MAX_FRAME_SIZE)
+        self.socket = None
+
+    def run(self, thread_pool):
+        '''Create the listening socket and start the thread that
+        accepts connections.'''
+        self.socket = self.listen(DEFAULT_HOST, DEFAULT_PORT,
+            DEFAULT_BACKLOG)
+        thread_pool.spawn_n(self._run, self.socket, thread_pool)
+
+    def _run(self, listener, thread_pool):
+        '''Thread to accept connections.'''
+        thread_pool_size = self.config.getint('thread_pool_size',
+            DEFAULT_THREAD_POOL_SIZE)
+        if thread_pool_size != 0:
+            thread_pool = burrow.backend.WaiterPool(size=thread_pool_size)
+            self.backend.waiters.add_pool(thread_pool)
+        while True:
+            try:
+                connection = listener.accept()[0]
+            except socket.error as exception:
+                if exception.errno == errno.EBADF:
+                    return
+                self.log.exception(_('Error accepting connection'))
+                continue
+            if listener.family != socket.AF_UNIX:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                    1)
+            thread_pool.spawn_n(self._read, connection, thread_pool)
+
+    def _read(self, connection, thread_pool):
+        '''Read request frames from a connection and start a thread
+        to handle each one.'''
+        file_object = connection.makefile('rb')
+        lock = eventlet.semaphore.Semaphore()
+        try:
+            while True:
+                frame = read_frame(file_object, self.max_frame_size)
+                if frame is None:
+                    break
+                if len(frame) < REQUEST.size:
+                    raise ValueError(_('Truncated request'))
+                thread_pool.spawn_n(self._handle, connection, lock, frame)
+        except (IOError, ValueError) as exception:
+            self.log.debug(_('Closing connection: %s') % exception)
+        finally:
+            file_object.close()
+            connection.close()
+
+    def _handle(self, connection, lock, frame):
+        '''Handle a request frame and send the response.'''
+        request_id = REQUEST.unpack_from(frame)[0]
+        try:
+            status, payload = self._call(frame)
+        except burrow.NotFound as exception:
+            status, payload = STATUS_NOT_FOUND, str(exception)
+        except burrow.InvalidArguments as exception:
+            status, payload = STATUS_INVALID_ARGUMENTS, str(exception)
+        except Exception as exception:
+            self.log.exception(_('Error handling request'))
+            status, payload = STATUS_ERROR, str(exception)
+        frame = pack_frame(RESPONSE.pack(request_id, status), payload)
+        with lock:
+            try:
+                connection.sendall(frame)
+            except IOError as exception:
+                self.log.debug(_('Error sending response: %s') % exception)
+
+    def _call(self, frame):
+        '''Call the backend method for a request frame and return the
+        response status and payload.'''
+        _request_id, method, size = REQUEST.unpack_from(frame)
+        if method >= len(METHODS):
+            raise burrow.InvalidArguments(_('Unknown method'))
+        method = METHODS[method]
+        start = REQUEST.size
+        try:
+            args = json.loads(frame[start:start + size])
+        except ValueError:
+            raise burrow.InvalidArguments(_('Arguments must be JSON'))
+        if not isinstance(args, list):
+            raise burrow.InvalidArguments(_('Arguments must be a list'))
+        if method == 'create_message':
+            args = args[:3] + [frame[start + size:]] + args[3:]
+            attributes = dict(ttl=self.default_ttl, hide=self.default_hide)
+            if len(args) > 4 and args[4] is not None:
+                for name, value in args[4].iteritems():
+                    if value is not None:
+                        attributes[name] = value
+            args = args[:4] + [attributes]
+        result = self.call_backend(method, *args)
+        if isinstance(result, str):
+            return STATUS_RAW, result
+        return STATUS_JSON, json.dumps(result)
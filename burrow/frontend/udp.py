@@ -0,0 +1,193 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''UDP frontend for the burrow server. This only creates messages and
+never responds, so it is meant for high volume producers that can
+tolerate lost messages. Each datagram is a 2 byte length followed by
+a JSON object with account, queue, and optional message, ttl, and hide
+keys, and then the raw message body. A message ID is generated if one
+is not given. Datagrams are buffered and created in batches by a
+separate thread, and datagrams that arrive while the buffer is full
+are dropped.'''
+
+import json
+import struct
+import uuid
+
+import eventlet
+from eventlet.green import socket
+import eventlet.queue
+
+import burrow.frontend
+from burrow.openstack.common.gettextutils import _
+
+# Default configuration values for this module.
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8082
+DEFAULT_TTL = 600
+DEFAULT_HIDE = 0
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_RECEIVE_BUFFER_SIZE = 4194304
+
+# Largest possible datagram.
+MAX_DATAGRAM_SIZE = 65535
+
+# Format for the length of the JSON header.
+LENGTH = struct.Struct('!H')
+
+
+def pack_datagram(account, queue, message, body, attributes=None):
+    '''Pack a message into a datagram. The message ID may be None to
+    have the server generate one.'''
+    header = dict(account=account, queue=queue)
+    if message is not None:
+        header['message'] = message
+    if attributes is not None:
+        for name in ['ttl', 'hide']:
+            if attributes.get(name) is not None:
+                header[name] = attributes[name]
+    header = json.dumps(header)
+    return LENGTH.pack(len(header)) + header + body
+
+
+def unpack_datagram(data):
+    '''Unpack a datagram, returning the account, queue, message,
+    attributes, and body. Attributes not given in the datagram are
+    None. This raises ValueError if the datagram is malformed.'''
+    if len(data) < LENGTH.size:
+        raise ValueError(_('Truncated datagram'))
+    size = LENGTH.unpack_from(data)[0]
+    start = LENGTH.size
+    if len(data) < start + size:
+        raise ValueError(_('Truncated datagram'))
+    header = json.loads(data[start:start + size])
+    if not isinstance(header, dict):
+        raise ValueError(_('Header must be an object'))
+    for name in ['account', 'queue']:
+        if not isinstance(header.get(name), basestring):
+            raise ValueError(_('Missing %s') % name)
+    message = header.get('message')
+    if message is None:
+        message = uuid.uuid4().hex
+    elif not isinstance(message, basestring):
+        raise ValueError(_('Invalid message'))
+    attributes = {}
+    for name in ['ttl', 'hide']:
+        value = header.get(name)
+        if value is not None and not isinstance(value, (int, long)):
+            raise ValueError(_('Invalid %s') % name)
+        attributes[name] = value
+    return header['account'], header['queue'], message, attributes, \
+        data[start + size:]
+
+
+class Frontend(burrow.frontend.Frontend):
+    '''Frontend implementation that creates messages from UDP
+    datagrams.'''
+
+    def __init__(self, config, backend):
+        super(Frontend, self).__init__(config, backend)
+        self.default_ttl = int(self.config.get('default_ttl', DEFAULT_TTL))
+        self.default_hide = int(self.config.get('default_hide', DEFAULT_HIDE))
+        self.batch_size = self.config.getint('batch_size', DEFAULT_BATCH_SIZE)
+        buffer_size = self.config.getint('buffer_size', DEFAULT_BUFFER_SIZE)
+        self.buffer = eventlet.queue.LightQueue(buffer_size)
+        self.socket = None
+        self.stats = dict(received=0, malformed=0, dropped=0, created=0,
+            failed=0)
+        self.backend.metrics.describe('burrow_udp_datagrams_total',
+            'counter', 'UDP datagrams by result.')
+        self.backend.metrics.describe('burrow_udp_buffered', 'gauge',
+            'UDP datagrams waiting to be created.')
+        self.backend.metrics.add_collector(self._collect_metrics)
+
+    def run(self, thread_pool):
+        '''Create the socket and start the threads that receive and
+        create messages.'''
+        host = self.config.get('host', DEFAULT_HOST)
+        port = self.config.getint('port', DEFAULT_PORT)
+        receive_buffer_size = self.config.getint('receive_buffer_size',
+            DEFAULT_RECEIVE_BUFFER_SIZE)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+            receive_buffer_size)
+        self.socket.bind((host, port))
+        self.log.info(
+            _('Listening on %(host)s:%(port)d') % dict(host=host, port=port))
+        thread_pool.spawn_n(self._receive)
+        thread_pool.spawn_n(self._create)
+
+    def get_stats(self):
+        '''Return counts of datagrams received, malformed, and dropped
+        because the buffer was full, and of messages created and failed
+        to be created, along with the number buffered.'''
+        stats = dict(self.stats)
+        stats['buffered'] = self.buffer.qsize()
+        return stats
+
+    def _collect_metrics(self):
+        '''Return samples for the datagram counts and buffer.'''
+        name = self.config.instance or self.config.section
+        samples = []
+        for result, count in sorted(self.stats.iteritems()):
+            samples.append(('burrow_udp_datagrams_total',
+                (('frontend', name), ('result', result)), count))
+        samples.append(('burrow_udp_buffered', (('frontend', name),),
+            self.buffer.qsize()))
+        return samples
+
+    def _receive(self):
+        '''Thread to receive datagrams and add them to the buffer.'''
+        while True:
+            try:
+                data = self.socket.recv(MAX_DATAGRAM_SIZE)
+            except IOError:
+                return
+            self.stats['received'] += 1
+            try:
+                message = unpack_datagram(data)
+            except ValueError:
+                self.stats['malformed'] += 1
+                continue
+            try:
+                self.buffer.put_nowait(message)
+            except eventlet.queue.Full:
+                self.stats['dropped'] += 1
+            # Receiving does not yield while datagrams are waiting, so
+            # give the create thread a chance to run.
+            if self.stats['received'] % self.batch_size == 0:
+                eventlet.sleep(0)
+
+    def _create(self):
+        '''Thread to create buffered messages in batches.'''
+        while True:
+            batch = [self.buffer.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.buffer.get_nowait())
+                except eventlet.queue.Empty:
+                    break
+            for account, queue, message, attributes, body in batch:
+                if attributes['ttl'] is None:
+                    attributes['ttl'] = self.default_ttl
+                if attributes['hide'] is None:
+                    attributes['hide'] = self.default_hide
+                try:
+                    self.call_backend('create_message', account, queue,
+                        message, body, attributes)
+                    self.stats['created'] += 1
+                except Exception:
+                    self.stats['failed'] += 1
+                    self.log.exception(_('Error creating message'))
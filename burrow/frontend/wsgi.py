@@ -15,14 +15,24 @@
 '''WSGI frontend for the burrow server.'''
 
 import json
+import math
+import time
 import types
+import zlib
 
+import eventlet
+import eventlet.queue
+import eventlet.websocket
 import eventlet.wsgi
-import routes.middleware
+import routes
 import webob.dec
 
+import burrow
+import burrow.backend
+import burrow.common
 import burrow.frontend
-from burrow.openstack.common.gettextutils import _
+import burrow.frontend.admission
+import burrow.metrics
 
 # Default configuration values for this module.
 DEFAULT_HOST = '0.0.0.0'
@@ -34,6 +44,38 @@ DEFAULT_SSL_KEYFILE = 'example.key'
 DEFAULT_THREAD_POOL_SIZE = 0
 DEFAULT_TTL = 600
 DEFAULT_HIDE = 0
+DEFAULT_MAX_BODY_SIZE = 0
+DEFAULT_MAX_DECOMPRESSED_SIZE = 16777216
+DEFAULT_COMPRESSION = True
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_SUBSCRIBE_WAIT = 10
+DEFAULT_SUBSCRIBE_LIMIT = 100
+DEFAULT_RATE_LIMIT = 0
+DEFAULT_RATE_BURST = 0
+DEFAULT_FAIR_CONCURRENCY = 0
+DEFAULT_SHED = False
+DEFAULT_SHED_CONCURRENCY = 100
+DEFAULT_SHED_TARGET = 0.05
+DEFAULT_SHED_LISTING_TARGET = 0.01
+DEFAULT_SHED_INTERVAL = 0.5
+DEFAULT_SHED_TIMEOUT = 5
+DEFAULT_SHED_POOL_RESERVE = 0.1
+DEFAULT_SHED_RETRY_AFTER = 1
+DEFAULT_METRICS = True
+DEFAULT_PROFILE_TOKEN = None
+DEFAULT_PROFILE_SECONDS = 30
+
+# Routes for cheap single message requests, which are shed after
+# listings when the server is overloaded.
+CHEAP_ACTIONS = ['versions', 'message']
+
+# Administrative routes, which skip rate limits and admission control so
+# they keep working while the server is overloaded.
+ADMIN_ACTIONS = ['metrics', 'profile']
+
+# Size of each read when consuming a request body.
+READ_CHUNK_SIZE = 16384
 
 
 class Frontend(burrow.frontend.Frontend):
@@ -44,24 +86,90 @@ class Frontend(burrow.frontend.Frontend):
         super(Frontend, self).__init__(config, backend)
         self.default_ttl = int(self.config.get('default_ttl', DEFAULT_TTL))
         self.default_hide = int(self.config.get('default_hide', DEFAULT_HIDE))
+        self.max_body_size = self.config.getint('max_body_size',
+            DEFAULT_MAX_BODY_SIZE)
+        self.max_decompressed_size = self.config.getint(
+            'max_decompressed_size', DEFAULT_MAX_DECOMPRESSED_SIZE)
+        self.compression = self.config.getboolean('compression',
+            DEFAULT_COMPRESSION)
+        self.compress_min_size = self.config.getint('compress_min_size',
+            DEFAULT_COMPRESS_MIN_SIZE)
+        self.compress_level = self.config.getint('compress_level',
+            DEFAULT_COMPRESS_LEVEL)
+        self.subscribe_wait = self.config.getint('subscribe_wait',
+            DEFAULT_SUBSCRIBE_WAIT)
+        self.subscribe_limit = self.config.getint('subscribe_limit',
+            DEFAULT_SUBSCRIBE_LIMIT)
+        self.rate_limiter = None
+        rate_limit = self.config.getfloat('rate_limit', DEFAULT_RATE_LIMIT)
+        rate_limits = burrow.frontend.admission.parse_account_values(
+            self.config.get('rate_limits'))
+        if rate_limit > 0 or rate_limits:
+            rate_burst = self.config.getint('rate_burst', DEFAULT_RATE_BURST)
+            self.rate_limiter = burrow.frontend.admission.RateLimiter(
+                rate_limit, rate_burst, rate_limits)
+        self.scheduler = None
+        self.shedder = None
+        fair_concurrency = self.config.getint('fair_concurrency',
+            DEFAULT_FAIR_CONCURRENCY)
+        shed = self.config.getboolean('shed', DEFAULT_SHED)
+        if shed and fair_concurrency <= 0:
+            fair_concurrency = DEFAULT_SHED_CONCURRENCY
+        if fair_concurrency > 0:
+            weights = burrow.frontend.admission.parse_account_values(
+                self.config.get('account_weights'), int)
+            self.scheduler = burrow.frontend.admission.FairScheduler(
+                fair_concurrency, weights)
+            self.backend.waiters.add_pool(self.scheduler)
+        if shed:
+            self.shedder = burrow.frontend.admission.LoadShedder(
+                self.scheduler,
+                self.config.getfloat('shed_target', DEFAULT_SHED_TARGET),
+                self.config.getfloat('shed_listing_target',
+                    DEFAULT_SHED_LISTING_TARGET),
+                self.config.getfloat('shed_interval', DEFAULT_SHED_INTERVAL),
+                self.config.getfloat('shed_timeout', DEFAULT_SHED_TIMEOUT),
+                self.config.getfloat('shed_pool_reserve',
+                    DEFAULT_SHED_POOL_RESERVE))
+        self.shed_retry_after = self.config.getint('shed_retry_after',
+            DEFAULT_SHED_RETRY_AFTER)
+        self.metrics = self.config.getboolean('metrics', DEFAULT_METRICS)
+        self.profile_token = self.config.get('profile_token',
+            DEFAULT_PROFILE_TOKEN)
+        self.thread_pool = None
+        metrics = self.backend.metrics
+        metrics.describe('burrow_http_requests_total', 'counter',
+            'HTTP requests by route, method, and status.')
+        metrics.describe('burrow_http_errors_total', 'counter',
+            'HTTP requests that failed with a server error.')
+        metrics.describe('burrow_http_request_duration_seconds',
+            'histogram', 'Time taken to handle HTTP requests.')
+        metrics.describe('burrow_pool_size', 'gauge',
+            'Size of green thread pools.')
+        metrics.describe('burrow_pool_running', 'gauge',
+            'Green threads running in pools.')
+        metrics.describe('burrow_admission_waiting', 'gauge',
+            'Requests waiting to be admitted.')
+        metrics.describe('burrow_admission_overloaded', 'gauge',
+            'Whether requests are being shed.')
+        metrics.add_collector(self._collect_metrics)
+        self._websocket = eventlet.websocket.WebSocketWSGI(
+            self._subscribe_websocket)
         mapper = routes.Mapper()
         mapper.connect('/', action='versions')
+        mapper.connect('/metrics', action='metrics')
+        mapper.connect('/profile', action='profile')
         mapper.connect('/v1.0', action='accounts')
         mapper.connect('/v1.0/{account}', action='queues')
         mapper.connect('/v1.0/{account}/{queue}', action='messages')
         mapper.connect('/v1.0/{account}/{queue}/{message}', action='message')
-        self._routes = routes.middleware.RoutesMiddleware(self._route, mapper)
+        self._mapper = mapper
 
     def run(self, thread_pool):
         '''Create the listening socket and start the thread that runs
         the WSGI server. This extra thread is needed since the WSGI
         server function blocks.'''
-        host = self.config.get('host', DEFAULT_HOST)
-        port = self.config.getint('port', DEFAULT_PORT)
-        backlog = self.config.getint('backlog', DEFAULT_BACKLOG)
-        socket = eventlet.listen((host, port), backlog=backlog)
-        self.log.info(
-            _('Listening on %(host)s:%(port)d') % dict(host=host, port=port))
+        socket = self.listen(DEFAULT_HOST, DEFAULT_PORT, DEFAULT_BACKLOG)
         if self.config.getboolean('ssl', DEFAULT_SSL):
             certfile = self.config.get('ssl_certfile', DEFAULT_SSL_CERTFILE)
             keyfile = self.config.get('ssl_keyfile', DEFAULT_SSL_KEYFILE)
@@ -75,55 +183,395 @@ class Frontend(burrow.frontend.Frontend):
             DEFAULT_THREAD_POOL_SIZE)
         log_format = '%(client_ip)s "%(request_line)s" %(status_code)s ' \
                      '%(body_length)s %(wall_seconds).6f'
-        if thread_pool_size == 0:
-            eventlet.wsgi.server(socket, self, log=_WSGILog(self.log),
-                log_format=log_format, custom_pool=thread_pool)
-        else:
-            eventlet.wsgi.server(socket, self, log=_WSGILog(self.log),
-                log_format=log_format, max_size=thread_pool_size)
+        if thread_pool_size != 0:
+            thread_pool = burrow.backend.WaiterPool(size=thread_pool_size)
+            self.backend.waiters.add_pool(thread_pool)
+            self.thread_pool = thread_pool
+        if self.shedder is not None:
+            self.shedder.pool = thread_pool
+        eventlet.wsgi.server(socket, self, log=_WSGILog(self.log),
+            log_format=log_format, custom_pool=thread_pool)
+
+    def __call__(self, environ, start_response):
+        args, route = self._mapper.routematch(environ['PATH_INFO']) or \
+            ({}, None)
+        environ['wsgiorg.routing_args'] = ((), args)
+        environ['routes.route'] = route
+        start = time.time()
+        status = []
+
+        def _start_response(response_status, headers, exc_info=None):
+            '''Save the response status for metrics.'''
+            status.append(response_status)
+            return start_response(response_status, headers, exc_info)
 
-    def __call__(self, *args, **kwargs):
-        return self._routes(*args, **kwargs)
+        try:
+            return self.backend.profiler.call(self._call, environ,
+                _start_response, args)
+        except Exception:
+            status.append('500')
+            raise
+        finally:
+            self._record_request(environ, status, time.time() - start)
+
+    def _record_request(self, environ, status, duration):
+        '''Record the request in the backend metrics, labelled with the
+        route from the routing result of the request.'''
+        metrics = self.backend.metrics
+        args = environ['wsgiorg.routing_args'][1]
+        labels = (('route', args.get('action', 'unknown')),
+            ('method', environ['REQUEST_METHOD']))
+        metrics.observe('burrow_http_request_duration_seconds', duration,
+            labels)
+        status = status[-1].split(' ', 1)[0] if status else 'none'
+        metrics.increment('burrow_http_requests_total',
+            labels + (('status', status),))
+        if status.startswith('5'):
+            metrics.increment('burrow_http_errors_total', labels)
+
+    def _collect_metrics(self):
+        '''Return gauge samples for the frontend thread pool and
+        admission control.'''
+        samples = []
+        name = self.config.instance or self.config.section
+        if self.thread_pool is not None:
+            labels = (('pool', name),)
+            samples.append(('burrow_pool_size', labels, self.thread_pool.size))
+            samples.append(('burrow_pool_running', labels,
+                self.thread_pool.running()))
+        if self.scheduler is not None:
+            samples.append(('burrow_admission_waiting',
+                (('frontend', name),), self.scheduler.waiting_count()))
+        if self.shedder is not None:
+            samples.append(('burrow_admission_overloaded',
+                (('frontend', name),), self.shedder.overloaded))
+        return samples
+
+    def _call(self, environ, start_response, args):
+        '''Apply rate limits and admission control, then route the
+        request.'''
+        if args.get('action') in ADMIN_ACTIONS:
+            return self._route(environ, start_response)
+        account = args.get('account')
+        if self.rate_limiter is not None and account is not None:
+            retry_after = self.rate_limiter.take(account)
+            if retry_after > 0:
+                response = self._response(status='429 Too Many Requests')
+                response.retry_after = int(math.ceil(retry_after))
+                return response(environ, start_response)
+        if environ.get('HTTP_UPGRADE', '').lower() == 'websocket' and \
+            args.get('action') == 'messages':
+            return self._websocket(environ, start_response)
+        if self.shedder is not None:
+            listing = args.get('action') not in CHEAP_ACTIONS
+            if not self.shedder.admit(account, listing):
+                response = self._response(status=503)
+                response.retry_after = self.shed_retry_after
+                return response(environ, start_response)
+            start = time.time()
+            try:
+                return self._route(environ, start_response)
+            finally:
+                self.shedder.release(time.time() - start)
+        if self.scheduler is None:
+            return self._route(environ, start_response)
+        self.scheduler.acquire(account)
+        try:
+            return self._route(environ, start_response)
+        finally:
+            self.scheduler.release()
 
     @webob.dec.wsgify
     def _route(self, req):
         '''Parse the request args and see if there is a matching method.'''
-        args = req.environ['wsgiorg.routing_args'][1]
+        args = dict(req.environ['wsgiorg.routing_args'][1])
         if not args:
             return self._response(status=404)
         action = args.pop('action')
         method = getattr(self, '_%s_%s' % (req.method.lower(), action), None)
         if method is not None:
-            return method(req, **args)
+            return self._encode_response(req, method(req, **args))
         method = req.method.lower()
-        args = dict(args)
+        if action == 'queues' and 'queues' in req.params:
+            action = 'messages_any'
+            args['queues'] = self._parse_queues(req)
+        if method == 'get' and action == 'messages' and \
+            self._is_subscribe(req):
+            return self._subscribe_events(req, **args)
+        if method == 'get' and action == 'messages' and \
+            'stats' in req.params and req.params['stats'].lower() == 'true':
+            response = self._response(
+                body=lambda: self.call_backend('get_queue_stats', **args))
+            return self._encode_response(req, response)
         if method == 'post':
             method = 'update'
+            claim = req.params.get('claim', '').lower() == 'true'
+            if action in ['messages', 'messages_any'] and claim:
+                method = 'claim'
             args['attributes'] = self._parse_attributes(req)
-        method = getattr(self.backend, '%s_%s' % (method, action), None)
-        if method is None:
+        method = '%s_%s' % (method, action)
+        if getattr(self.backend, method, None) is None:
             return self._response(status=405)
         args['filters'] = self._parse_filters(req)
-        return self._response(body=lambda: method(**args))
+        response = self._response(
+            body=lambda: self.call_backend(method, **args))
+        return self._encode_response(req, response)
 
     @webob.dec.wsgify
     def _get_versions(self, _req):
         '''Return a list of API versions.'''
         return self._response(body=['v1.0'])
 
+    @webob.dec.wsgify
+    def _get_metrics(self, _req):
+        '''Return the backend metrics in the Prometheus text format.'''
+        if not self.metrics:
+            return self._response(status=404)
+        response = webob.Response()
+        response.body = self.backend.metrics.render()
+        response.headers['Content-Type'] = burrow.metrics.CONTENT_TYPE
+        return response
+
+    def _check_profile_token(self, req):
+        '''Return an error response unless profiling is enabled and the
+        request has the profile token.'''
+        if not self.profile_token:
+            return self._response(status=404)
+        if req.headers.get('X-Profile-Token') != self.profile_token:
+            return self._response(status=403)
+        return None
+
+    @webob.dec.wsgify
+    def _get_profile(self, req):
+        '''Return the profiling status.'''
+        response = self._check_profile_token(req)
+        if response is not None:
+            return response
+        return self._response(body=self.backend.profiler.get_status())
+
+    @webob.dec.wsgify
+    def _post_profile(self, req):
+        '''Start profiling the process, or a sampled fraction of
+        requests, for a number of seconds.'''
+        response = self._check_profile_token(req)
+        if response is not None:
+            return response
+        try:
+            seconds = float(req.params.get('seconds',
+                DEFAULT_PROFILE_SECONDS))
+            sample_rate = float(req.params.get('sample_rate', 1))
+        except ValueError as exception:
+            return self._response(status=400, body=str(exception))
+        if seconds <= 0 or sample_rate <= 0:
+            return self._response(status=400)
+        if not self.backend.profiler.start(seconds, sample_rate):
+            return self._response(status=409)
+        return self._response(body=self.backend.profiler.get_status())
+
+    @webob.dec.wsgify
+    def _delete_profile(self, req):
+        '''Stop profiling and return the name of the file written.'''
+        response = self._check_profile_token(req)
+        if response is not None:
+            return response
+        name = self.backend.profiler.stop()
+        if name is None:
+            return self._response(status=404)
+        return self._response(body=dict(file=name))
+
+    def _is_subscribe(self, req):
+        '''Check if a request asks for server-sent events.'''
+        if 'subscribe' in req.params and \
+            req.params['subscribe'].lower() == 'true':
+            return True
+        return 'text/event-stream' in req.headers.get('Accept', '')
+
+    def _subscribe_events(self, req, account, queue):
+        '''Stream new messages in the queue as server-sent events until
+        the client disconnects. The event ID is the message ID, so a
+        reconnecting client resumes after the last message it saw with
+        the Last-Event-ID header. A comment is sent when no messages
+        arrive within the wait time so closed connections are noticed.'''
+        filters = self._parse_filters(req)
+        if 'Last-Event-ID' in req.headers:
+            filters['marker'] = req.headers['Last-Event-ID']
+        limit = filters.get('limit', self.subscribe_limit)
+
+        def _events():
+            '''Generate the event stream.'''
+            yield ': subscribed\n\n'
+            while True:
+                messages = self._subscribe_messages(account, queue, filters,
+                    limit)
+                if not messages:
+                    yield ': keepalive\n\n'
+                    continue
+                events = []
+                for message in messages:
+                    events.append('id: %s\ndata: %s\n\n' %
+                        (message['id'], json.dumps(message)))
+                yield ''.join(events)
+
+        # Send each event as soon as it is ready instead of buffering.
+        req.environ['eventlet.minimum_write_chunk_size'] = 0
+        response = webob.Response(content_type='text/event-stream')
+        response.cache_control = 'no-cache'
+        response.app_iter = _events()
+        return response
+
+    def _subscribe_websocket(self, websocket):
+        '''Send new messages in the queue over a WebSocket until the
+        client disconnects. The client grants credits by sending JSON
+        objects such as {"credits": 10}, and each message sent uses one
+        credit, so a slow client is never sent more than it asked for.
+        Each message is sent as a JSON object. While waiting for credits
+        the subscriber is parked like a long-poll, so idle subscribers
+        do not hold pool slots.'''
+        args = websocket.environ['wsgiorg.routing_args'][1]
+        req = webob.Request(websocket.environ)
+        filters = self._parse_filters(req)
+        credits = eventlet.queue.LightQueue()
+        key = ('websocket', id(credits))
+        reader = eventlet.spawn(self._subscribe_credits, websocket, credits,
+            key)
+        try:
+            available = 0
+            while True:
+                while credits.qsize() > 0:
+                    grant = credits.get()
+                    if grant is None:
+                        return
+                    available += grant
+                if available == 0:
+                    self.backend.waiters.wait(key, self.subscribe_wait)
+                    continue
+                messages = self._subscribe_messages(args['account'],
+                    args['queue'], filters, available)
+                for message in messages:
+                    websocket.send(json.dumps(message))
+                available -= len(messages)
+        finally:
+            reader.kill()
+
+    def _subscribe_credits(self, websocket, credits, key):
+        '''Read credit grants from a WebSocket, adding None to the
+        credits queue when the client disconnects or sends an invalid
+        grant. The parked subscriber is woken through key after each
+        grant.'''
+        try:
+            while True:
+                grant = websocket.wait()
+                if grant is None:
+                    break
+                try:
+                    grant = json.loads(grant)['credits']
+                except (ValueError, TypeError, KeyError):
+                    break
+                if not isinstance(grant, (int, long)) or grant < 0:
+                    break
+                credits.put(grant)
+                self.backend.waiters.notify(key)
+        except IOError:
+            pass
+        credits.put(None)
+        self.backend.waiters.notify(key)
+
+    def _subscribe_messages(self, account, queue, filters, limit):
+        '''Wait for up to limit messages after the marker in filters,
+        advancing the marker past the messages returned. This waits
+        on the backend, so subscribers are woken when messages are
+        created instead of polling.'''
+        params = dict(filters, limit=limit, detail='all',
+            wait=self.subscribe_wait)
+        try:
+            messages = self.call_backend('get_messages', account, queue,
+                params)
+        except burrow.NotFound:
+            return []
+        if messages:
+            filters['marker'] = messages[-1]['id']
+        return messages
+
     @webob.dec.wsgify
     def _put_message(self, req, account, queue, message):
         '''Read the request body and create a new message.'''
+        if self._body_too_large(req.content_length):
+            return self._response(status=413)
+        encoding = req.headers.get('Content-Encoding', 'identity').lower()
+        if encoding != 'identity':
+            if not self.compression or \
+                encoding not in burrow.common.ENCODINGS:
+                return self._response(status=415)
         attributes = self._parse_attributes(req, self.default_ttl,
             self.default_hide)
-        body = ''
-        for chunk in iter(lambda: req.body_file.read(16384), ''):
-            body += str(chunk)
-        if self.backend.create_message(account, queue, message, body,
-            attributes):
+        try:
+            body = self._read_body(req)
+        except zlib.error as exception:
+            return self._response(status=400, body=str(exception))
+        if body is None:
+            return self._response(status=413)
+        if self.call_backend('create_message', account, queue, message,
+            body, attributes):
             return self._response(status=201)
         return self._response()
 
+    def _body_too_large(self, size):
+        '''Check if a body size is over the configured maximum.'''
+        if size is None or self.max_body_size <= 0:
+            return False
+        return size > self.max_body_size
+
+    def _read_body(self, req):
+        '''Read the request body in chunks and join them once, so the
+        time taken is linear in the body size. Compressed bodies are
+        decompressed as they are read. This returns None as soon as the
+        body is larger than the maximum size, or a compressed body is
+        larger than the maximum decompressed size.'''
+        chunks = iter(lambda: req.body_file.read(READ_CHUNK_SIZE), '')
+        encoding = req.headers.get('Content-Encoding', 'identity').lower()
+        limit = 0
+        if encoding in burrow.common.ENCODINGS:
+            chunks = burrow.common.decompress(chunks, encoding)
+            limit = self.max_decompressed_size
+        body = []
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if self._body_too_large(size) or 0 < limit < size:
+                return None
+            body.append(chunk)
+        return ''.join(body)
+
+    def _encode_response(self, req, response):
+        '''Compress the response body if the client accepts a supported
+        encoding and the body is large enough to benefit. Compression is
+        done incrementally as the body is iterated, so this works with
+        streamed responses of unknown length as well.'''
+        if not self.compression or 'Accept-Encoding' not in req.headers:
+            return response
+        length = response.content_length
+        if length == 0 or response.content_encoding is not None:
+            return response
+        if length is not None and length < self.compress_min_size:
+            return response
+        encoding = req.accept_encoding.best_match(burrow.common.ENCODINGS)
+        if encoding is None:
+            return response
+        response.app_iter = burrow.common.compress(response.app_iter,
+            encoding, self.compress_level)
+        response.content_length = None
+        response.content_encoding = encoding
+        response.vary = 'Accept-Encoding'
+        return response
+
+    def _parse_queues(self, req):
+        '''Parse the comma separated list of queues from a request
+        object, returning None for all queues in the account.'''
+        queues = req.params['queues']
+        if queues == '*':
+            return None
+        return [queue for queue in queues.split(',') if queue != '']
+
     def _parse_filters(self, req):
         '''Parse filters from a request object and build a dict to
         pass into the backend methods.'''
@@ -0,0 +1,167 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Metrics for burrow. Counters and histograms are updated in place
+as requests are handled, and gauges are read from collectors when the
+metrics are rendered in the Prometheus text format. Labels are given
+as a tuple of (name, value) pairs so they can be used as dict keys
+without any formatting on the hot path.'''
+
+import bisect
+
+# Upper bounds in seconds of the default histogram buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10)
+
+# Content type of the rendered metrics.
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram(object):
+    '''Histogram with fixed buckets. Observing a value is a binary
+    search and a few additions.'''
+
+    __slots__ = ['buckets', 'counts', 'sum', 'count']
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        '''Add a value to the histogram.'''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        '''Return (upper bound, count) pairs for each bucket, where the
+        count includes all smaller buckets.'''
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Metrics(object):
+    '''Registry of counters, histograms, and gauge collectors.'''
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.descriptions = {}
+
+    def describe(self, name, kind, description):
+        '''Set the type and help text for a metric.'''
+        self.descriptions[name] = (kind, description)
+
+    def increment(self, name, labels=(), value=1):
+        '''Increment a counter.'''
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        '''Add a value to a histogram.'''
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        '''Add a function that returns a list of (name, labels, value)
+        gauge samples when metrics are rendered.'''
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        '''Remove a gauge collector.'''
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def get(self, name, labels=()):
+        '''Return the value of a counter or gauge, or the histogram for
+        a histogram, or None if there is no such metric.'''
+        key = (name, labels)
+        if key in self.counters:
+            return self.counters[key]
+        if key in self.histograms:
+            return self.histograms[key]
+        for sample_name, sample_labels, value in self._collect():
+            if sample_name == name and sample_labels == labels:
+                return value
+        return None
+
+    def render(self):
+        '''Render all metrics in the Prometheus text format, encoded
+        as UTF-8.'''
+        samples = {}
+        for (name, labels), value in self.counters.iteritems():
+            samples.setdefault(name, []).append(
+                (labels, [(name, labels, value)]))
+        for name, labels, value in self._collect():
+            samples.setdefault(name, []).append(
+                (labels, [(name, labels, value)]))
+        for (name, labels), histogram in self.histograms.iteritems():
+            lines = []
+            for bound, count in histogram.cumulative():
+                lines.append((name + '_bucket', labels + (('le', bound),),
+                    count))
+            lines.append((name + '_sum', labels, histogram.sum))
+            lines.append((name + '_count', labels, histogram.count))
+            samples.setdefault(name, []).append((labels, lines))
+        lines = []
+        for name in sorted(samples):
+            if name in self.descriptions:
+                kind, description = self.descriptions[name]
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, kind))
+            for _labels, sample_lines in sorted(samples[name]):
+                for sample in sample_lines:
+                    lines.append(_format_sample(*sample))
+        text = '\n'.join(lines) + '\n'
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return text
+
+    def _collect(self):
+        '''Return gauge samples from all collectors.'''
+        samples = []
+        for collector in self.collectors:
+            samples.extend(collector())
+        return samples
+
+
+def _format_sample(name, labels, value):
+    '''Format a single sample line.'''
+    if labels:
+        labels = ','.join('%s="%s"' % (label, _escape(label_value))
+            for label, label_value in labels)
+        name = '%s{%s}' % (name, labels)
+    if isinstance(value, bool):
+        value = int(value)
+    return '%s %s' % (name, repr(value) if isinstance(value, float) else
+        value)
+
+
+def _escape(value):
+    '''Escape a label value.'''
+    if not isinstance(value, basestring):
+        return str(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+        '\\n')
@@ -0,0 +1,162 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''On demand profiling for burrow. Profiling is started for a number
+of seconds, either for the whole process or for a sampled fraction of
+requests, and the results are written to a file when it stops. While
+profiling is stopped, wrapping a call costs a single attribute check.
+
+Results are either cProfile statistics that can be loaded with the
+pstats module, or collapsed stacks sampled from a CPU timer, one
+stack per line with frames separated by semicolons followed by a
+count, as used by flame graph tools. All green threads share one
+operating system thread, so profiling a sampled request also covers
+any green threads that run while it is waiting.'''
+
+import cProfile
+import os
+import random
+import signal
+import tempfile
+import time
+
+import eventlet
+import eventlet.hubs
+
+from burrow.openstack.common.gettextutils import _
+
+# Formats that results can be written in.
+FORMATS = ['pstats', 'collapsed']
+
+# Seconds of CPU time between stack samples for the collapsed format.
+DEFAULT_INTERVAL = 0.005
+
+
+class Profiler(object):
+    '''Profile the process or a sampled fraction of the calls made
+    through :func:`call` and write the results to a file in path.'''
+
+    def __init__(self, path=None, output_format='pstats',
+        interval=DEFAULT_INTERVAL, log=None):
+        if output_format not in FORMATS:
+            raise ValueError(output_format)
+        self.path = path or tempfile.gettempdir()
+        self.format = output_format
+        self.log = log
+        self.interval = interval
+        self.enabled = False
+        self.sample_rate = 0
+        self.started = None
+        self.session = 0
+        self.running = 0
+        self.profile = None
+        self.stacks = {}
+        self.timer = None
+
+    def start(self, seconds, sample_rate=1.0):
+        '''Start profiling for the given number of seconds. With a
+        sample rate of 1 or more the whole process is profiled,
+        otherwise only that fraction of calls are. Returns False if
+        profiling was already started.'''
+        if self.enabled:
+            return False
+        self.enabled = True
+        self.sample_rate = sample_rate
+        self.started = time.time()
+        self.session += 1
+        self.running = 0
+        self.profile = cProfile.Profile()
+        self.stacks = {}
+        if sample_rate >= 1:
+            self._resume()
+        self.timer = eventlet.hubs.get_hub().schedule_call_global(seconds,
+            eventlet.spawn_n, self.stop)
+        return True
+
+    def stop(self):
+        '''Stop profiling and write the results, returning the file
+        name, or None if profiling was not started.'''
+        if not self.enabled:
+            return None
+        self.timer.cancel()
+        self.timer = None
+        if self.sample_rate >= 1 or self.running > 0:
+            self._pause()
+        self.enabled = False
+        name = os.path.join(self.path, 'burrow-%d-%d.%s' %
+            (os.getpid(), int(self.started), self.format))
+        if self.format == 'pstats':
+            self.profile.dump_stats(name)
+        else:
+            with open(name, 'w') as output:
+                for stack, count in sorted(self.stacks.iteritems()):
+                    output.write('%s %d\n' % (stack, count))
+        self.profile = None
+        self.stacks = {}
+        if self.log is not None:
+            self.log.info(_('Profile written to %s') % name)
+        return name
+
+    def get_status(self):
+        '''Return whether profiling is enabled along with the sample
+        rate and the number of seconds since it started.'''
+        status = dict(enabled=self.enabled, format=self.format)
+        if self.enabled:
+            status['sample_rate'] = self.sample_rate
+            status['seconds'] = time.time() - self.started
+        return status
+
+    def call(self, function, *args, **kwargs):
+        '''Call the function, profiling it if it is sampled.'''
+        if not self.enabled or self.sample_rate >= 1 or \
+            random.random() >= self.sample_rate:
+            return function(*args, **kwargs)
+        session = self.session
+        self.running += 1
+        if self.running == 1:
+            self._resume()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # Profiling may have been stopped or restarted meanwhile.
+            if session == self.session and self.enabled:
+                self.running -= 1
+                if self.running == 0:
+                    self._pause()
+
+    def _resume(self):
+        '''Start collecting profile data.'''
+        if self.format == 'pstats':
+            self.profile.enable()
+            return
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def _pause(self):
+        '''Stop collecting profile data.'''
+        if self.format == 'pstats':
+            self.profile.disable()
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+    def _sample(self, _signum, frame):
+        '''Signal handler to count the stack that was interrupted.'''
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s' % (code.co_filename, code.co_name))
+            frame = frame.f_back
+        stack = ';'.join(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
@@ -15,12 +15,16 @@
 '''Server module for burrow.'''
 from __future__ import print_function
 
+import signal
 import sys
 
 import eventlet
 
+import burrow.backend
 import burrow.common
 import burrow.config
+import burrow.profiler
+import burrow.watchdog
 from burrow.openstack.common.gettextutils import _
 from burrow.openstack.common import importutils
 
@@ -28,6 +32,12 @@ from burrow.openstack.common import importutils
 DEFAULT_BACKEND = 'burrow.backend.sqlite'
 DEFAULT_FRONTENDS = 'burrow.frontend.wsgi'
 DEFAULT_THREAD_POOL_SIZE = 1000
+DEFAULT_PROFILE_PATH = None
+DEFAULT_PROFILE_FORMAT = 'pstats'
+DEFAULT_PROFILE_SIGNAL = 'SIGUSR2'
+DEFAULT_PROFILE_SECONDS = 30
+DEFAULT_PROFILE_SAMPLE_RATE = 1.0
+DEFAULT_WATCHDOG_THRESHOLD = 0
 
 
 class Server(object):
@@ -44,6 +54,10 @@ class Server(object):
         if len(self.log.handlers) == 0 and add_default_log_handler:
             burrow.common.add_default_log_handler()
         self.backend = self._import_backend()
+        self.backend.profiler = burrow.profiler.Profiler(
+            self.config.get('profile_path', DEFAULT_PROFILE_PATH),
+            self.config.get('profile_format', DEFAULT_PROFILE_FORMAT),
+            log=self.log)
         self.frontends = self._import_frontends()
 
     def _import_backend(self):
@@ -72,7 +86,27 @@ class Server(object):
         frontends and backend never remove threads.'''
         thread_pool_size = self.config.getint('thread_pool_size',
             DEFAULT_THREAD_POOL_SIZE)
-        thread_pool = eventlet.GreenPool(size=int(thread_pool_size))
+        thread_pool = burrow.backend.WaiterPool(size=int(thread_pool_size))
+        metrics = self.backend.metrics
+        metrics.describe('burrow_pool_size', 'gauge',
+            'Size of green thread pools.')
+        metrics.describe('burrow_pool_running', 'gauge',
+            'Green threads running in pools.')
+        labels = (('pool', 'server'),)
+        metrics.add_collector(lambda: [
+            ('burrow_pool_size', labels, thread_pool.size),
+            ('burrow_pool_running', labels, thread_pool.running())])
+        profile_signal = self.config.get('profile_signal',
+            DEFAULT_PROFILE_SIGNAL)
+        if profile_signal:
+            signal.signal(getattr(signal, profile_signal),
+                self._profile_signal)
+        watchdog_threshold = self.config.getfloat('watchdog_threshold',
+            DEFAULT_WATCHDOG_THRESHOLD)
+        if watchdog_threshold > 0:
+            watchdog = burrow.watchdog.Watchdog(watchdog_threshold / 1000.0,
+                self.backend.metrics, self.log)
+            watchdog.start(thread_pool)
         self.backend.run(thread_pool)
         for frontend in self.frontends:
             frontend.run(thread_pool)
@@ -81,6 +115,25 @@ class Server(object):
             thread_pool.waitall()
         except KeyboardInterrupt:
             pass
+        finally:
+            self.backend.close()
+
+    def _profile_signal(self, _signum, _frame):
+        '''Signal handler to start or stop profiling.'''
+        eventlet.spawn_n(self._toggle_profile)
+
+    def _toggle_profile(self):
+        '''Stop profiling if it was started, or else start it.'''
+        profiler = self.backend.profiler
+        if profiler.enabled:
+            profiler.stop()
+            return
+        seconds = self.config.getfloat('profile_seconds',
+            DEFAULT_PROFILE_SECONDS)
+        sample_rate = self.config.getfloat('profile_sample_rate',
+            DEFAULT_PROFILE_SAMPLE_RATE)
+        profiler.start(seconds, sample_rate)
+        self.log.info(_('Profiling for %d seconds') % seconds)
 
 
 def main():
@@ -44,7 +44,11 @@ class Shell(object):
             account=True,
             filters=True,
             args=['queue'],
-            commands=['delete_messages', 'get_messages', 'update_messages']),
+            commands=[
+                'delete_messages',
+                'get_messages',
+                'update_messages',
+                'claim_messages']),
         dict(name='Message',
             account=True,
             args=['queue', 'message'],
@@ -52,10 +56,15 @@ class Shell(object):
                 'create_message',
                 'delete_message',
                 'get_message',
-                'update_message'])]
+                'update_message']),
+        dict(name='Stats',
+            account=True,
+            args=['queue'],
+            commands=['get_queue_stats'])]
 
     attribute_commands = [
         'update_messages',
+        'claim_messages',
         'create_message',
         'update_message']
 
@@ -21,6 +21,12 @@ import sys
 import time
 
 import burrow
+import burrow.frontend.binary
+import burrow.frontend.wsgi
+
+# Unix domain socket paths the test server also listens on.
+WSGI_UNIX_SOCKET = os.path.abspath('TestHTTP.sock')
+BINARY_UNIX_SOCKET = os.path.abspath('TestBinary.sock')
 
 
 def start_server():
@@ -29,7 +35,19 @@ def start_server():
     pid = os.fork()
     if pid == 0:
         server = burrow.Server(add_default_log_handler=False)
-        server.frontends[0].default_ttl = 0
+        config = (server._config, 'burrow.frontend.binary')
+        server.frontends.append(
+            burrow.frontend.binary.Frontend(config, server.backend))
+        config = (server._config, 'burrow.frontend.wsgi', 'unix')
+        frontend = burrow.frontend.wsgi.Frontend(config, server.backend)
+        frontend.config.set('unix_socket', WSGI_UNIX_SOCKET)
+        server.frontends.append(frontend)
+        config = (server._config, 'burrow.frontend.binary', 'unix')
+        frontend = burrow.frontend.binary.Frontend(config, server.backend)
+        frontend.config.set('unix_socket', BINARY_UNIX_SOCKET)
+        server.frontends.append(frontend)
+        for frontend in server.frontends:
+            frontend.default_ttl = 0
         server.run()
         sys.exit(0)
     pid_file = open('TestHTTP.pid', 'w')
@@ -54,5 +72,8 @@ def kill_server():
         os.unlink('TestHTTP.pid')
     except IOError:
         pass
+    for path in [WSGI_UNIX_SOCKET, BINARY_UNIX_SOCKET]:
+        if os.path.exists(path):
+            os.unlink(path)
 
 start_server()
@@ -734,6 +734,129 @@ class TestMessages(Base):
         self.assertTrue(self.success)
         self.delete_messages()
 
+    def test_claim(self):
+        self.backend.create_message('a', 'q', 'm1', 'test')
+        self.backend.create_message('a', 'q', 'm2', 'test')
+        attributes = dict(hide=100)
+        messages = list(self.backend.claim_messages('a', 'q', attributes))
+        ids = [message['id'] for message in messages]
+        self.assertEquals(['m1', 'm2'], ids)
+        for message in messages:
+            self.assertTrue(message['hide'] > 0)
+            self.assertEquals('test', message['body'])
+        messages = self.backend.get_messages('a', 'q')
+        self.assertRaises(burrow.NotFound, list, messages)
+        messages = self.backend.claim_messages('a', 'q', attributes)
+        self.assertRaises(burrow.NotFound, list, messages)
+        self.delete_messages()
+
+    def test_claim_detail_id(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        attributes = dict(hide=100)
+        filters = dict(detail='id')
+        messages = self.backend.claim_messages('a', 'q', attributes, filters)
+        self.assertEquals(['m'], list(messages))
+        self.delete_messages()
+
+    def test_claim_limit(self):
+        self.backend.create_message('a', 'q', 'm1', 'test')
+        self.backend.create_message('a', 'q', 'm2', 'test')
+        self.backend.create_message('a', 'q', 'm3', 'test')
+        attributes = dict(hide=100)
+        filters = dict(detail='id', limit=2)
+        messages = self.backend.claim_messages('a', 'q', attributes, filters)
+        self.assertEquals(['m1', 'm2'], list(messages))
+        messages = self.backend.claim_messages('a', 'q', attributes, filters)
+        self.assertEquals(['m3'], list(messages))
+        self.delete_messages()
+
+    def test_claim_match_hidden(self):
+        attributes = dict(hide=100)
+        self.backend.create_message('a', 'q', 'm1', 'test', attributes)
+        self.backend.create_message('a', 'q', 'm2', 'test')
+        filters = dict(detail='id', match_hidden=True)
+        messages = self.backend.claim_messages('a', 'q', attributes, filters)
+        self.assertEquals(['m2'], list(messages))
+        self.delete_messages()
+
+    def test_claim_hide_bad(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        messages = self.backend.claim_messages('a', 'q', dict(hide=0))
+        self.assertRaises(burrow.InvalidArguments, list, messages)
+        messages = self.backend.claim_messages('a', 'q', dict())
+        self.assertRaises(burrow.InvalidArguments, list, messages)
+        self.assertEquals(1, len(list(self.backend.get_messages('a', 'q'))))
+        self.delete_messages()
+
+    def test_claim_wait(self):
+        self.success = False
+
+        def claim_messages():
+            attributes = dict(hide=100)
+            filters = dict(detail='id', wait=2)
+            messages = self.backend.claim_messages('a', 'q', attributes,
+                filters)
+            self.assertEquals(['m'], list(messages))
+            self.success = True
+        thread = eventlet.spawn(claim_messages)
+        eventlet.spawn_after(0.2,
+            self.backend.create_message, 'a', 'q', 'm', 'test')
+        thread.wait()
+        self.assertTrue(self.success)
+        self.delete_messages()
+
+    def test_get_any(self):
+        self.backend.create_message('a', 'q2', 'm', 'test')
+        filters = dict(detail='id')
+        result = self.backend.get_messages_any('a', ['q1', 'q2'], filters)
+        self.assertEquals(dict(queue='q2', messages=['m']), result)
+        result = self.backend.get_messages_any('a', None, filters)
+        self.assertEquals(dict(queue='q2', messages=['m']), result)
+        self.assertRaises(burrow.NotFound,
+            self.backend.get_messages_any, 'a', ['q1'])
+        self.assertRaises(burrow.NotFound,
+            self.backend.get_messages_any, 'b', None)
+        self.assertEquals([], list(self.backend.delete_messages('a', 'q2')))
+
+    def test_delete_any(self):
+        self.backend.create_message('a', 'q1', 'm1', 'test')
+        self.backend.create_message('a', 'q2', 'm2', 'test')
+        filters = dict(detail='id')
+        result = self.backend.delete_messages_any('a', ['q2', 'q1'], filters)
+        self.assertEquals(dict(queue='q2', messages=['m2']), result)
+        result = self.backend.delete_messages_any('a', None, filters)
+        self.assertEquals(dict(queue='q1', messages=['m1']), result)
+        self.assertRaises(burrow.NotFound,
+            self.backend.delete_messages_any, 'a', None)
+
+    def test_claim_any(self):
+        self.backend.create_message('a', 'q1', 'm1', 'test')
+        self.backend.create_message('a', 'q2', 'm2', 'test')
+        attributes = dict(hide=100)
+        filters = dict(detail='id')
+        result = self.backend.claim_messages_any('a', None, attributes,
+            filters)
+        self.assertEquals(dict(queue='q1', messages=['m1']), result)
+        result = self.backend.claim_messages_any('a', None, attributes,
+            filters)
+        self.assertEquals(dict(queue='q2', messages=['m2']), result)
+        self.assertRaises(burrow.NotFound,
+            self.backend.claim_messages_any, 'a', None, attributes)
+        messages = self.backend.delete_messages('a', 'q1', dict(
+            match_hidden=True))
+        self.assertEquals([], list(messages))
+        messages = self.backend.delete_messages('a', 'q2', dict(
+            match_hidden=True))
+        self.assertEquals([], list(messages))
+
+    def test_any_wait(self):
+        for queues in [['q1', 'q2'], None]:
+            eventlet.spawn_after(0.2,
+                self.backend.create_message, 'a', 'q2', 'm', 'test')
+            filters = dict(detail='id', wait=2)
+            result = self.backend.delete_messages_any('a', queues, filters)
+            self.assertEquals(dict(queue='q2', messages=['m']), result)
+
 
 class TestMessage(Base):
     '''Test case for message.'''
@@ -959,3 +1082,62 @@ class TestMessage(Base):
         thread.wait()
         self.assertTrue(self.success)
         self.delete_messages()
+
+    def test_delete_wait(self):
+        results = []
+
+        def delete_messages():
+            filters = dict(detail='id', wait=1)
+            try:
+                results.extend(self.backend.delete_messages('a', 'q', filters))
+            except burrow.NotFound:
+                results.append(None)
+        threads = [eventlet.spawn(delete_messages) for _ in xrange(2)]
+        eventlet.spawn_after(0.2,
+            self.backend.create_message, 'a', 'q', 'm', 'test')
+        for thread in threads:
+            thread.wait()
+        self.assertEquals(['m', None], results)
+
+
+class TestQueueStats(Base):
+    '''Test case for queue statistics.'''
+
+    def get_stats(self, **expected):
+        '''Get the queue statistics and check the expected values.'''
+        stats = self.backend.get_queue_stats('a', 'q')
+        for name, value in expected.iteritems():
+            self.assertEquals(value, stats[name])
+        return stats
+
+    def test_stats(self):
+        self.assertRaises(burrow.NotFound, self.backend.get_queue_stats,
+            'a', 'q')
+        self.backend.create_message('a', 'q', 'm', 'test')
+        self.backend.create_message('a', 'q', 'n', 'hidden', dict(hide=100))
+        self.backend.create_message('a', 'q', 'm', 'longer')
+        stats = self.get_stats(id='q', visible=1, hidden=1, bytes=12,
+            enqueued=2, dequeued=0, dequeue_rate=0)
+        self.assertTrue(0 <= stats['oldest_age'] < 10)
+        self.assertTrue(stats['enqueue_rate'] > 0)
+        self.backend.update_message('a', 'q', 'n', dict(hide=0))
+        self.get_stats(visible=2, hidden=0)
+        attributes = dict(hide=100)
+        list(self.backend.claim_messages('a', 'q', attributes,
+            dict(limit=1)))
+        self.get_stats(visible=1, hidden=1)
+        self.backend.delete_message('a', 'q', 'm')
+        stats = self.get_stats(visible=1, hidden=0, bytes=6, enqueued=2,
+            dequeued=1)
+        self.assertTrue(stats['dequeue_rate'] > 0)
+        self.delete_messages()
+        self.assertRaises(burrow.NotFound, self.backend.get_queue_stats,
+            'a', 'q')
+
+    def test_stats_clean(self):
+        self.backend.create_message('a', 'q', 'm', 'test', dict(ttl=1))
+        self.backend.create_message('a', 'q', 'n', 'test', dict(hide=1))
+        time.sleep(2)
+        self.backend.clean()
+        self.get_stats(visible=1, hidden=0, bytes=4, enqueued=2, dequeued=1)
+        self.delete_messages()
@@ -0,0 +1,107 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the binary backend. This uses the binary frontend
+of the test server so tests the binary frontend as well.'''
+
+import ConfigParser
+
+import eventlet
+
+import burrow.backend.binary
+from burrow import tests
+from burrow.tests import backend
+
+
+class BinaryBase(backend.Base):
+    '''Base test case for binary backend.'''
+
+    def setUp(self):
+        super(BinaryBase, self).setUp()
+        config = (ConfigParser.ConfigParser(), 'test')
+        self.backend = burrow.backend.binary.Backend(config)
+        self.check_empty()
+
+
+class TestBinaryAccounts(BinaryBase, backend.TestAccounts):
+    '''Test case for accounts with binary backend.'''
+    pass
+
+
+class TestBinaryQueues(BinaryBase, backend.TestQueues):
+    '''Test case for queues with binary backend.'''
+    pass
+
+
+class TestBinaryMessages(BinaryBase, backend.TestMessages):
+    '''Test case for messages with binary backend.'''
+    pass
+
+
+class TestBinaryMessage(BinaryBase, backend.TestMessage):
+    '''Test case for message with binary backend.'''
+    pass
+
+
+class TestBinaryQueueStats(BinaryBase, backend.TestQueueStats):
+    '''Test case for queue statistics with binary backend.'''
+    pass
+
+
+class TestBinaryUnix(BinaryBase, backend.TestMessage):
+    '''Test case for message with binary backend over a unix domain
+    socket.'''
+
+    def setUp(self):
+        super(TestBinaryUnix, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'url', 'unix://' + tests.BINARY_UNIX_SOCKET)
+        self.backend = burrow.backend.binary.Backend((config, 'test'))
+
+    def test_server(self):
+        self.assertEquals(tests.BINARY_UNIX_SOCKET, self.backend.server)
+
+
+class TestBinaryConnection(BinaryBase):
+    '''Test case for the shared connection with binary backend.'''
+
+    def test_multiplex(self):
+        filters = dict(detail='id', wait=2)
+        waiter = eventlet.spawn(list,
+            self.backend.get_messages('a', 'q', filters))
+        eventlet.sleep(0.1)
+        connection = self.backend.connection
+        self.backend.create_message('a', 'q', 'm', 'test')
+        self.assertEquals(['m'], waiter.wait())
+        self.assertEquals(connection, self.backend.connection)
+        self.assertEquals({}, connection.pending)
+        self.delete_messages()
+
+    def test_raw_body(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        filters = dict(detail='body')
+        body = self.backend.get_message('a', 'q', 'm', filters)
+        self.assertEquals(str, type(body))
+        self.assertEquals('test', body)
+        self.delete_messages()
+
+    def test_reconnect(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        connection = self.backend.connection
+        connection.close()
+        self.assertEquals('test',
+            self.backend.get_message('a', 'q', 'm')['body'])
+        self.assertNotEqual(connection, self.backend.connection)
+        self.delete_messages()
@@ -17,7 +17,11 @@ tests the WSGI frontend as well.'''
 
 import ConfigParser
 
+import eventlet
+
+import burrow
 import burrow.backend.http
+from burrow import tests
 from burrow.tests import backend
 
 
@@ -49,3 +53,276 @@ class TestHTTPMessages(HTTPBase, backend.TestMessages):
 class TestHTTPMessage(HTTPBase, backend.TestMessage):
     '''Test case for message with http backend.'''
     pass
+
+
+class TestHTTPQueueStats(HTTPBase, backend.TestQueueStats):
+    '''Test case for queue statistics with http backend.'''
+    pass
+
+
+class TestHTTPCompression(HTTPBase):
+    '''Test case for compressed requests and responses with http
+    backend.'''
+
+    def setUp(self):
+        super(TestHTTPCompression, self).setUp()
+        self.backend.compress_requests = True
+        self.backend.compress_min_size = 0
+
+    def test_compression(self):
+        body = 'test' * 1000
+        self.backend.create_message('a', 'q', 'm', body)
+        message = self.backend.get_message('a', 'q', 'm')
+        self.assertEquals(body, message['body'])
+        filters = dict(detail='body')
+        self.assertEquals([body], list(self.backend.get_messages('a', 'q',
+            filters)))
+        self.delete_messages()
+
+
+class TestHTTPConnectionPool(HTTPBase):
+    '''Test case for the connection pool with http backend.'''
+
+    def test_reuse(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        for _count in xrange(5):
+            self.backend.get_message('a', 'q', 'm')
+        self.delete_messages()
+        stats = self.backend.get_connection_stats()
+        self.assertEquals(1, stats['created'])
+        self.assertEquals(1, stats['idle'])
+        self.assertTrue(stats['reuse_rate'] > 0.8)
+
+    def test_stale(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        pool = self.backend.endpoints[0].pool
+        for connection, _last_used in pool.connections:
+            connection.sock.close()
+        message = self.backend.get_message('a', 'q', 'm')
+        self.assertEquals('test', message['body'])
+        self.assertEquals(1, self.backend.get_connection_stats()['retried'])
+        self.delete_messages()
+
+    def test_stale_not_idempotent(self):
+        pool = self.backend.endpoints[0].pool
+        for connection, _last_used in pool.connections:
+            connection.sock.close()
+        attributes = dict(hide=60)
+        messages = self.backend.claim_messages('a', 'q', attributes)
+        self.assertRaises(Exception, list, messages)
+
+    def test_idle_timeout(self):
+        reused = self.backend.get_connection_stats()['reused']
+        self.backend.endpoints[0].pool.idle_timeout = -1
+        self.backend.create_message('a', 'q', 'm', 'test')
+        self.backend.get_message('a', 'q', 'm')
+        self.delete_messages()
+        stats = self.backend.get_connection_stats()
+        self.assertEquals(reused, stats['reused'])
+        self.assertEquals(3, stats['evicted'])
+
+    def test_partial_read(self):
+        self.backend.compression = False
+        body = 'x' * burrow.backend.http.READ_CHUNK_SIZE
+        for count in xrange(10):
+            self.backend.create_message('a', 'q', 'm%d' % count, body)
+        filters = dict(detail='body')
+        messages = self.backend.get_messages('a', 'q', filters)
+        self.assertEquals(body, messages.next())
+        messages.close()
+        self.assertEquals(0, self.backend.get_connection_stats()['idle'])
+        self.delete_messages()
+
+
+class TestHTTPUnix(HTTPBase, backend.TestMessage):
+    '''Test case for message with http backend over a unix domain
+    socket.'''
+
+    def setUp(self):
+        super(TestHTTPUnix, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'url', 'unix://' + tests.WSGI_UNIX_SOCKET)
+        self.backend = burrow.backend.http.Backend((config, 'test'))
+
+    def test_parse_server(self):
+        parse_server = burrow.backend.parse_server
+        self.assertEquals('/tmp/b.sock',
+            parse_server('unix:///tmp/b.sock', 80))
+        self.assertEquals('b.sock', parse_server('unix://b.sock', 80))
+        self.assertEquals('run/b.sock',
+            parse_server('binary+unix://run/b.sock', 80))
+        self.assertRaises(ValueError, parse_server, 'unix://', 80)
+
+    def test_server(self):
+        endpoint = self.backend.endpoints[0]
+        self.assertEquals(tests.WSGI_UNIX_SOCKET, endpoint.server)
+        self.backend.create_message('a', 'q', 'm', 'test')
+        filters = dict(detail='body')
+        body = self.backend.get_message('a', 'q', 'm', filters)
+        self.assertEquals('test', body)
+        stats = self.backend.get_connection_stats()
+        self.assertEquals(1, stats['created'])
+        self.assertEquals('unix:' + tests.WSGI_UNIX_SOCKET,
+            stats['endpoints'][0]['server'])
+        self.delete_messages()
+
+
+class TestHTTPEndpoints(HTTPBase):
+    '''Test case for multiple servers with http backend. Both
+    endpoints are the same test server.'''
+
+    def setUp(self):
+        super(TestHTTPEndpoints, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'url', 'http://localhost:8080, http://127.0.0.1')
+        self.backend = burrow.backend.http.Backend((config, 'test'))
+
+    def test_servers(self):
+        servers = [endpoint.server for endpoint in self.backend.endpoints]
+        self.assertEquals([('localhost', 8080), ('127.0.0.1', 8080)],
+            servers)
+
+    def test_least_outstanding(self):
+        filters = dict(detail='id', wait=2)
+        threads = [eventlet.spawn(list,
+            self.backend.get_messages('a', 'q', filters)) for _ in xrange(4)]
+        eventlet.sleep(0.2)
+        outstanding = [endpoint.outstanding
+            for endpoint in self.backend.endpoints]
+        self.assertEquals([2, 2], outstanding)
+        self.backend.create_message('a', 'q', 'm', 'test')
+        for thread in threads:
+            self.assertEquals(['m'], thread.wait())
+        outstanding = [endpoint.outstanding
+            for endpoint in self.backend.endpoints]
+        self.assertEquals([0, 0], outstanding)
+        self.delete_messages()
+
+    def test_ewma(self):
+        self.backend.balance = 'ewma'
+        self.backend.endpoints[0].ewma = 0.1
+        self.backend.endpoints[1].ewma = 0.01
+        self.assertEquals(self.backend.endpoints[1], self.backend._choose())
+        self.backend.endpoints[1].outstanding = 10
+        self.assertEquals(self.backend.endpoints[0], self.backend._choose())
+        self.backend.endpoints[1].outstanding = 0
+
+    def test_bad_balance(self):
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'balance', 'bad')
+        self.assertRaises(burrow.InvalidArguments,
+            burrow.backend.http.Backend, (config, 'test'))
+
+    def test_hedge(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        # This server accepts connections but never responds.
+        slow = eventlet.listen(('localhost', 0))
+        self.addCleanup(slow.close)
+        server = slow.getsockname()
+        pool = burrow.backend.http.ConnectionPool(server, 1, 60)
+        slow_endpoint = burrow.backend.http.Endpoint(server, pool)
+        endpoint = self.backend.endpoints[0]
+        self.backend.endpoints = [slow_endpoint, endpoint]
+        self.backend.hedge_delay = 0.1
+        # Make sure the slow server is chosen first.
+        endpoint.outstanding = 1
+        message = self.backend.get_message('a', 'q', 'm')
+        endpoint.outstanding = 0
+        self.assertEquals('test', message['body'])
+        self.assertEquals(1, slow_endpoint.hedged)
+        self.assertEquals(0, slow_endpoint.outstanding)
+        self.assertEquals(1, self.backend.get_connection_stats()['hedged'])
+        self.backend.endpoints = [endpoint]
+        self.delete_messages()
+
+
+class TestHTTPPipeline(HTTPBase):
+    '''Test case for pipelined requests with http backend.'''
+
+    def setUp(self):
+        super(TestHTTPPipeline, self).setUp()
+        self.backend.pipeline_depth = 4
+
+    def test_pipeline(self):
+        pool = eventlet.GreenPool()
+        created = list(pool.imap(lambda count: self.backend.create_message(
+            'a', 'q', 'm%d' % count, 'test%d' % count), xrange(20)))
+        self.assertEquals([True] * 20, created)
+        messages = list(pool.imap(lambda count: self.backend.get_message(
+            'a', 'q', 'm%d' % count), xrange(20)))
+        self.assertEquals(['test%d' % count for count in xrange(20)],
+            [message['body'] for message in messages])
+        stats = self.backend.get_connection_stats()
+        self.assertTrue(stats['pipelined'] > 20)
+        self.delete_messages()
+
+    def test_partial_read(self):
+        self.backend.compression = False
+        body = 'x' * burrow.backend.http.READ_CHUNK_SIZE
+        for count in xrange(4):
+            self.backend.create_message('a', 'q', 'm%d' % count, body)
+        filters = dict(detail='body')
+        messages = self.backend.get_messages('a', 'q', filters)
+        self.assertEquals(body, messages.next())
+        pipeline = self.backend.endpoints[0].pipeline
+        self.assertEquals(0, len(pipeline.turns))
+        with eventlet.Timeout(3):
+            thread = eventlet.spawn(self.backend.get_message, 'a', 'q', 'm1')
+            self.assertEquals(body, thread.wait()['body'])
+        self.assertEquals(False, pipeline.closed)
+        self.assertEquals([body] * 3, list(messages))
+        self.delete_messages()
+
+    def test_same_thread(self):
+        self.backend.create_message('a', 'q', 'm0', 'test0')
+        self.backend.create_message('a', 'q', 'm1', 'test1')
+        messages = self.backend.get_messages('a', 'q')
+        self.assertEquals('m0', messages.next()['id'])
+        with eventlet.Timeout(5):
+            message = self.backend.get_message('a', 'q', 'm1')
+        self.assertEquals('test1', message['body'])
+        self.assertEquals('m1', messages.next()['id'])
+        messages.close()
+        self.delete_messages()
+
+    def test_hedge(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        # This server accepts connections but never responds.
+        slow = eventlet.listen(('localhost', 0))
+        self.addCleanup(slow.close)
+        server = slow.getsockname()
+        pool = burrow.backend.http.ConnectionPool(server, 1, 60)
+        slow_endpoint = burrow.backend.http.Endpoint(server, pool)
+        endpoint = self.backend.endpoints[0]
+        self.backend.endpoints = [slow_endpoint, endpoint]
+        self.backend.hedge_delay = 0.1
+        # Another request is waiting on the slow server pipeline.
+        thread = eventlet.spawn(self.backend._send_pipeline, slow_endpoint,
+            'GET', '/v1.0/a/q/m', None, {})
+        self.addCleanup(thread.kill)
+        eventlet.sleep(0.1)
+        pipeline = slow_endpoint.pipeline
+        # Make sure the slow server is chosen first.
+        endpoint.outstanding = 1
+        message = self.backend.get_message('a', 'q', 'm')
+        endpoint.outstanding = 0
+        self.assertEquals('test', message['body'])
+        self.assertEquals(1, slow_endpoint.hedged)
+        self.assertEquals(False, pipeline.closed)
+        self.assertEquals(1, len(pipeline.turns))
+        self.assertEquals(False, thread.dead)
+        self.backend.endpoints = [endpoint]
+        self.delete_messages()
+
+    def test_not_idempotent(self):
+        self.backend.create_message('a', 'q', 'm', 'test')
+        pipelined = self.backend.get_connection_stats()['pipelined']
+        attributes = dict(hide=60)
+        messages = list(self.backend.claim_messages('a', 'q', attributes))
+        self.assertEquals('m', messages[0]['id'])
+        self.assertEquals(pipelined,
+            self.backend.get_connection_stats()['pipelined'])
+        self.delete_messages()
@@ -48,3 +48,8 @@ class TestMemoryMessages(MemoryBase, backend.TestMessages):
 class TestMemoryMessage(MemoryBase, backend.TestMessage):
     '''Test case for message with memory backend.'''
     pass
+
+
+class TestMemoryQueueStats(MemoryBase, backend.TestQueueStats):
+    '''Test case for queue statistics with memory backend.'''
+    pass
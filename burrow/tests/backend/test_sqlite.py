@@ -15,8 +15,13 @@
 '''Unittests for the sqlite backend.'''
 
 import ConfigParser
+import os
+import sqlite3
+import time
 
+import eventlet
 import fixtures
+import testtools
 
 import burrow.backend.sqlite
 from burrow.tests import backend
@@ -52,6 +57,11 @@ class TestSQLiteMessage(SQLiteBase, backend.TestMessage):
     pass
 
 
+class TestSQLiteQueueStats(SQLiteBase, backend.TestQueueStats):
+    '''Test case for queue statistics with sqlite backend.'''
+    pass
+
+
 class SQLiteFileBase(backend.Base):
     '''Base test case for file-based sqlite backend.'''
 
@@ -85,3 +95,111 @@ class TestSQLiteFileMessages(SQLiteFileBase, backend.TestMessages):
 class TestSQLiteFileMessage(SQLiteFileBase, backend.TestMessage):
     '''Test case for message with file-based sqlite backend.'''
     pass
+
+
+class TestSQLiteMetrics(SQLiteBase):
+    '''Test case for sqlite statement metrics.'''
+
+    def test_fetch(self):
+        for account in ['a', 'b', 'c']:
+            self.backend.create_message(account, 'q', 'm', 'test')
+        self.backend.db.create_function('slow', 1,
+            lambda value: time.sleep(0.05) or value)
+        labels = (('statement', 'SELECT'),)
+        histogram = self.backend.metrics.get(
+            'burrow_sqlite_statement_duration_seconds', labels)
+        before = histogram.sum
+        rows = self.backend.db.execute('SELECT slow(account) FROM accounts')
+        self.assertEquals(['a', 'b', 'c'], sorted(row[0] for row in rows))
+        self.assertTrue(histogram.sum - before >= 0.15)
+        self.assertEquals([], list(self.backend.delete_accounts()))
+
+
+class TestSQLiteUpgrade(testtools.TestCase):
+    '''Test case for adding queue statistics to an existing database.'''
+
+    def test_upgrade(self):
+        database = os.path.join(self.useFixture(fixtures.TempDir()).path,
+            'test.db')
+        db = sqlite3.connect(database)
+        db.execute('CREATE TABLE accounts (account VARCHAR(255) NOT NULL,'
+            ' PRIMARY KEY (account))')
+        db.execute('CREATE TABLE queues (account INT UNSIGNED NOT NULL,'
+            ' queue VARCHAR(255) NOT NULL, PRIMARY KEY (account, queue))')
+        db.execute('CREATE TABLE messages (queue INT UNSIGNED NOT NULL,'
+            ' message VARCHAR(255) NOT NULL, ttl INT UNSIGNED NOT NULL,'
+            ' hide INT UNSIGNED NOT NULL, body BLOB NOT NULL,'
+            ' PRIMARY KEY (queue, message))')
+        db.execute("INSERT INTO accounts VALUES ('a')")
+        db.execute("INSERT INTO queues VALUES (1, 'q')")
+        db.execute("INSERT INTO messages VALUES (1, 'm', 0, 0, 'test')")
+        db.execute("INSERT INTO messages VALUES (1, 'n', 0, 100, 'x')")
+        db.commit()
+        db.close()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'database', database)
+        backend = burrow.backend.sqlite.Backend((config, 'test'))
+        stats = backend.get_queue_stats('a', 'q')
+        self.assertEquals(1, stats['visible'])
+        self.assertEquals(1, stats['hidden'])
+        self.assertEquals(5, stats['bytes'])
+        self.assertTrue(0 <= stats['oldest_age'] < 10)
+        backend.create_message('a', 'q', 'o', 'test')
+        self.assertEquals(2, backend.get_queue_stats('a', 'q')['visible'])
+
+
+class TestSQLiteNotifyBus(testtools.TestCase):
+    '''Test case for notifications between sqlite backends sharing a
+    database file.'''
+
+    def setUp(self):
+        super(TestSQLiteNotifyBus, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'database', os.path.join(tempdir, 'test.db'))
+        config.set('test', 'synchronous', 'OFF')
+        config.set('test', 'notify_path', os.path.join(tempdir, 'notify'))
+        self.backends = []
+        self.threads = []
+        for _count in xrange(2):
+            backend = burrow.backend.sqlite.Backend((config, 'test'))
+            self.addCleanup(backend.bus.close)
+            thread = eventlet.spawn(backend.bus.listen, backend._notify_local)
+            self.addCleanup(thread.kill)
+            self.backends.append(backend)
+            self.threads.append(thread)
+
+    def test_notify(self):
+        start = time.time()
+        thread = eventlet.spawn(list,
+            self.backends[1].get_messages('a', 'q', dict(wait=5)))
+        eventlet.sleep(0.1)
+        self.backends[0].create_message('a', 'q', 'm', 'test')
+        message = dict(id='m', ttl=0, hide=0, body='test')
+        self.assertEquals([message], thread.wait())
+        self.assertTrue(time.time() - start < 1)
+
+    def test_close(self):
+        eventlet.sleep(0)
+        name = self.backends[1].bus.name
+        self.assertTrue(os.path.exists(name))
+        self.backends[1].close()
+        self.assertFalse(os.path.exists(name))
+        self.assertTrue(self.threads[1].dead)
+        self.backends[0].create_message('a', 'q', 'm', 'test')
+        self.assertEquals([], self.backends[0].bus.peers)
+
+    def test_closed_socket(self):
+        # The listener has not started yet, so it finds the socket closed.
+        self.backends[1].bus.socket.close()
+        self.assertEquals(None, self.threads[1].wait())
+
+    def test_stale_peer(self):
+        self.backends[1].bus.close()
+        name = self.backends[1].bus.name
+        open(name, 'w').close()
+        self.backends[0].create_message('a', 'q', 'm', 'test')
+        self.assertFalse(os.path.exists(name))
+        self.assertEquals([], self.backends[0].bus.peers)
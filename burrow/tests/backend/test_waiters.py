@@ -0,0 +1,149 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the backend waiter registry.'''
+
+import eventlet
+import testtools
+
+import burrow.backend
+
+
+class TestWaiters(testtools.TestCase):
+    '''Test case for the waiter registry.'''
+
+    def setUp(self):
+        super(TestWaiters, self).setUp()
+        self.waiters = burrow.backend.Waiters()
+        self.results = []
+
+    def wait(self, key, seconds, exclusive=False, first=False, name=None):
+        '''Wait on the key and save the result. Used as an eventlet
+        thread.'''
+        result = self.waiters.wait(key, seconds, exclusive, first)
+        self.results.append(result if name is None else (name, result))
+
+    def test_notify(self):
+        threads = [eventlet.spawn(self.wait, 'a/q', 2) for _ in xrange(3)]
+        eventlet.sleep(0)
+        self.assertEquals(3, self.waiters.count)
+        self.waiters.notify('a/q')
+        for thread in threads:
+            thread.wait()
+        self.assertEquals([True, True, True], self.results)
+        self.assertEquals(0, self.waiters.count)
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_notify_other_key(self):
+        thread = eventlet.spawn(self.wait, 'a/q', 0.1)
+        eventlet.sleep(0)
+        self.waiters.notify('a/other')
+        thread.wait()
+        self.assertEquals([False], self.results)
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_timeout(self):
+        threads = [eventlet.spawn(self.wait, 'a/q', 0.1) for _ in xrange(50)]
+        threads.append(eventlet.spawn(self.wait, 'a/q', 2))
+        eventlet.sleep(0.2)
+        self.assertEquals(1, self.waiters.count)
+        self.assertTrue(len(self.waiters.queues['a/q'].shared) < 50)
+        self.waiters.notify('a/q')
+        for thread in threads:
+            thread.wait()
+        self.assertEquals([False] * 50 + [True], self.results)
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_exclusive(self):
+        for name in xrange(3):
+            eventlet.spawn(self.wait, 'a/q', 0.5, True, name=name)
+        shared = eventlet.spawn(self.wait, 'a/q', 0.5, name='shared')
+        eventlet.sleep(0)
+        self.waiters.notify('a/q', 1)
+        shared.wait()
+        eventlet.sleep(0)
+        self.assertEquals([('shared', True), (0, True)], self.results)
+        self.waiters.notify('a/q', 0)
+        eventlet.sleep(0)
+        self.assertEquals(2, len(self.results))
+        self.waiters.notify('a/q', 5)
+        eventlet.sleep(0)
+        self.assertEquals([(1, True), (2, True)], self.results[2:])
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_exclusive_all(self):
+        for name in xrange(3):
+            eventlet.spawn(self.wait, 'a/q', 0.5, True, name=name)
+        eventlet.sleep(0)
+        self.waiters.notify('a/q')
+        eventlet.sleep(0)
+        self.assertEquals([(0, True), (1, True), (2, True)], self.results)
+
+    def test_exclusive_first(self):
+        eventlet.spawn(self.wait, 'a/q', 0.5, True, name=0)
+        eventlet.sleep(0)
+        eventlet.spawn(self.wait, 'a/q', 0.5, True, True, name=1)
+        eventlet.sleep(0)
+        self.waiters.notify('a/q', 1)
+        eventlet.sleep(0)
+        self.assertEquals([(1, True)], self.results)
+        self.waiters.notify('a/q', 1)
+        eventlet.sleep(0)
+        self.assertEquals([(1, True), (0, True)], self.results)
+
+    def test_wait_any(self):
+        thread = eventlet.spawn(self.waiters.wait_any, ['a/q1', 'a/q2'], 2)
+        eventlet.sleep(0)
+        self.assertEquals(1, self.waiters.count)
+        self.waiters.notify('a/q2')
+        self.assertEquals(True, thread.wait())
+        self.assertEquals(0, self.waiters.notify('a/q1', 1))
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_kill(self):
+        thread = eventlet.spawn(self.wait, 'a/q', 2)
+        eventlet.sleep(0)
+        thread.kill()
+        self.assertEquals(0, self.waiters.count)
+        self.assertEquals({}, self.waiters.queues)
+
+    def test_pool_slot(self):
+        pool = burrow.backend.WaiterPool(size=1)
+        self.waiters.add_pool(pool)
+        pool.spawn_n(self.wait, 'a/q', 2)
+        eventlet.sleep(0)
+        self.assertEquals(1, self.waiters.count)
+        self.assertEquals(1, pool.free())
+        pool.spawn_n(self.wait, 'a/q', 2)
+        eventlet.sleep(0)
+        self.assertEquals(2, self.waiters.count)
+        self.assertEquals(1, pool.free())
+        waitall = eventlet.spawn(pool.waitall)
+        eventlet.sleep(0)
+        self.assertFalse(waitall.dead)
+        self.waiters.notify('a/q')
+        waitall.wait()
+        self.assertEquals([True, True], self.results)
+        self.assertEquals(1, pool.free())
+        self.assertEquals(0, pool.running())
+
+    def test_pool_slot_kill(self):
+        pool = burrow.backend.WaiterPool(size=1)
+        self.waiters.add_pool(pool)
+        thread = pool.spawn(self.wait, 'a/q', 2)
+        eventlet.sleep(0)
+        pool.spawn_n(eventlet.sleep, 0.1)
+        thread.kill()
+        pool.waitall()
+        self.assertEquals(1, pool.free())
@@ -0,0 +1,268 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for frontend admission control.'''
+
+import ConfigParser
+
+import eventlet
+import fixtures
+import testtools
+import webob
+
+import burrow.backend.memory
+import burrow.frontend.admission
+import burrow.frontend.wsgi
+
+
+class TestRateLimiter(testtools.TestCase):
+    '''Test case for per account rate limits.'''
+
+    def setUp(self):
+        super(TestRateLimiter, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch(
+            'burrow.frontend.admission.time.time', lambda: self.now))
+
+    def test_parse_account_values(self):
+        values = burrow.frontend.admission.parse_account_values(
+            'a:100, b:2.5')
+        self.assertEquals(dict(a=100, b=2.5), values)
+        self.assertEquals({},
+            burrow.frontend.admission.parse_account_values(None))
+
+    def test_rate(self):
+        limiter = burrow.frontend.admission.RateLimiter(2, 4)
+        for _ in xrange(4):
+            self.assertEquals(0, limiter.take('a'))
+        self.assertEquals(0.5, limiter.take('a'))
+        self.assertEquals(0, limiter.take('b'))
+        self.now += 0.5
+        self.assertEquals(0, limiter.take('a'))
+        self.assertEquals(0.5, limiter.take('a'))
+
+    def test_account_rates(self):
+        limiter = burrow.frontend.admission.RateLimiter(0, rates=dict(a=1))
+        self.assertEquals(0, limiter.take('a'))
+        self.assertEquals(1, limiter.take('a'))
+        for _ in xrange(10):
+            self.assertEquals(0, limiter.take('b'))
+        self.assertEquals(['a'], limiter.buckets.keys())
+
+    def test_evict(self):
+        self.patch(burrow.frontend.admission, 'MAX_BUCKETS', 2)
+        limiter = burrow.frontend.admission.RateLimiter(1)
+        limiter.take('a')
+        limiter.take('b')
+        limiter.take('a')
+        limiter.take('c')
+        self.assertEquals(['a', 'c'], limiter.buckets.keys())
+
+    def test_evict_not_full(self):
+        self.patch(burrow.frontend.admission, 'MAX_BUCKETS', 10)
+        limiter = burrow.frontend.admission.RateLimiter(1)
+        for count in xrange(100):
+            self.assertEquals(0, limiter.take('a%d' % count))
+            self.assertTrue(len(limiter.buckets) <= 10)
+        self.assertEquals(['a%d' % count for count in xrange(90, 100)],
+            limiter.buckets.keys())
+        self.assertTrue(limiter.take('a99') > 0)
+
+
+class TestFairScheduler(testtools.TestCase):
+    '''Test case for weighted fair admission.'''
+
+    def run_requests(self, scheduler, accounts):
+        '''Queue requests for the accounts behind a request holding the
+        only slot and return the order they were admitted in.'''
+        order = []
+
+        def _request(account):
+            scheduler.acquire(account)
+            order.append(account)
+            eventlet.sleep(0)
+            scheduler.release()
+
+        scheduler.acquire(None)
+        pool = eventlet.GreenPool()
+        for account in accounts:
+            pool.spawn(_request, account)
+        eventlet.sleep(0)
+        self.assertEquals(len(accounts), scheduler.waiting_count())
+        scheduler.release()
+        pool.waitall()
+        self.assertEquals(1, scheduler.available)
+        return order
+
+    def test_round_robin(self):
+        scheduler = burrow.frontend.admission.FairScheduler(1)
+        order = self.run_requests(scheduler, ['a'] * 4 + ['b'] * 2)
+        self.assertEquals(['a', 'b', 'a', 'b', 'a', 'a'], order)
+
+    def test_weights(self):
+        scheduler = burrow.frontend.admission.FairScheduler(1, dict(b=2))
+        order = self.run_requests(scheduler, ['a'] * 3 + ['b'] * 4)
+        self.assertEquals(['a', 'b', 'b', 'a', 'b', 'b', 'a'], order)
+
+    def test_cancel(self):
+        scheduler = burrow.frontend.admission.FairScheduler(1)
+        scheduler.acquire('a')
+        thread = eventlet.spawn(scheduler.acquire, 'b')
+        eventlet.sleep(0)
+        self.assertEquals(1, scheduler.waiting_count())
+        thread.kill()
+        self.assertEquals(0, scheduler.waiting_count())
+        scheduler.release()
+        self.assertEquals(1, scheduler.available)
+
+    def test_waiters(self):
+        backend = burrow.backend.memory.Backend(
+            (ConfigParser.ConfigParser(), 'test'))
+        scheduler = burrow.frontend.admission.FairScheduler(1)
+        backend.waiters.add_pool(scheduler)
+
+        def _wait():
+            scheduler.acquire('a')
+            try:
+                filters = dict(wait=2)
+                return list(backend.get_messages('a', 'q', filters))
+            finally:
+                scheduler.release()
+
+        thread = eventlet.spawn(_wait)
+        eventlet.sleep(0)
+        # The parked long-poll does not hold its slot.
+        self.assertEquals(1, scheduler.available)
+        scheduler.acquire('b')
+        backend.create_message('a', 'q', 'm', 'test')
+        eventlet.sleep(0)
+        scheduler.release()
+        self.assertEquals('m', thread.wait()[0]['id'])
+        self.assertEquals(1, scheduler.available)
+
+
+class TestLoadShedder(testtools.TestCase):
+    '''Test case for load shedding.'''
+
+    def setUp(self):
+        super(TestLoadShedder, self).setUp()
+        self.scheduler = burrow.frontend.admission.FairScheduler(1)
+        self.shedder = burrow.frontend.admission.LoadShedder(self.scheduler,
+            0.02, 0.01, 0.05, 1)
+
+    def test_overloaded(self):
+        self.scheduler.acquire('x')
+        thread = eventlet.spawn(self.shedder.admit, 'a')
+        eventlet.sleep(0.06)
+        self.scheduler.release()
+        self.assertTrue(thread.wait())
+        eventlet.sleep(0.05)
+        # The only wait in the last interval was over the target, so
+        # listings may now only wait for the listing target.
+        self.assertFalse(self.shedder.admit('b', listing=True))
+        self.assertTrue(self.shedder.overloaded)
+        self.assertEquals(1, self.shedder.stats['timeouts'])
+        # Requests are rejected without waiting if the expected wait is
+        # too long.
+        self.shedder.service_time = 0.1
+        thread = eventlet.spawn(self.shedder.admit, 'c')
+        eventlet.sleep(0)
+        self.assertFalse(self.shedder.admit('d'))
+        self.assertEquals(1, self.shedder.stats['shed'])
+        self.assertFalse(thread.wait())
+        self.shedder.release(0)
+        self.assertEquals(1, self.scheduler.available)
+        stats = self.shedder.get_stats()
+        self.assertEquals(1, stats['admitted'])
+        self.assertEquals(0, stats['waiting'])
+
+    def test_recover(self):
+        self.shedder.overloaded = True
+        eventlet.sleep(0.05)
+        self.assertTrue(self.shedder.admit('a'))
+        self.shedder.release(0)
+        eventlet.sleep(0.05)
+        self.assertTrue(self.shedder.admit('a'))
+        self.assertFalse(self.shedder.overloaded)
+
+    def test_pool_reserve(self):
+        self.shedder.pool_reserve = 0.5
+        self.shedder.pool = eventlet.GreenPool(2)
+        self.shedder.pool.spawn(eventlet.sleep, 0)
+        self.assertTrue(self.shedder.admit('a'))
+        self.shedder.release(0)
+        self.shedder.pool.spawn(eventlet.sleep, 0)
+        self.assertFalse(self.shedder.admit('a'))
+        self.shedder.pool.waitall()
+
+
+class TestWSGIAdmission(testtools.TestCase):
+    '''Test case for admission control in the WSGI frontend.'''
+
+    def setUp(self):
+        super(TestWSGIAdmission, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'rate_limit', '1')
+        config.set('test', 'rate_limits', 'b:0')
+        config.set('test', 'fair_concurrency', '10')
+        config.set('test', 'shed', 'true')
+        backend = burrow.backend.memory.Backend((config, 'test'))
+        self.frontend = burrow.frontend.wsgi.Frontend((config, 'test'),
+            backend)
+
+    def request(self, url, **kwargs):
+        '''Run a request through the frontend and return the response.'''
+        return webob.Request.blank(url, **kwargs).get_response(self.frontend)
+
+    def test_rate_limit(self):
+        response = self.request('/v1.0/a/q')
+        self.assertEquals(404, response.status_int)
+        response = self.request('/v1.0/a/q')
+        self.assertEquals(429, response.status_int)
+        self.assertEquals('1', response.headers['Retry-After'])
+        for _ in xrange(3):
+            response = self.request('/v1.0/b/q')
+            self.assertEquals(404, response.status_int)
+        for _ in xrange(3):
+            response = self.request('/')
+            self.assertEquals(200, response.status_int)
+        self.assertEquals(['a'], self.frontend.rate_limiter.buckets.keys())
+        self.assertEquals(10, self.frontend.scheduler.available)
+
+    def test_shed(self):
+        response = self.request('/v1.0/b/q/m')
+        self.assertEquals(404, response.status_int)
+        self.assertEquals(1, self.frontend.shedder.stats['admitted'])
+        self.frontend.shedder.pool_reserve = 1
+        self.frontend.shedder.pool = eventlet.GreenPool(1)
+        self.frontend.shedder.pool.spawn(eventlet.sleep, 0)
+        response = self.request('/v1.0/b/q/m')
+        self.assertEquals(503, response.status_int)
+        self.assertEquals('1', response.headers['Retry-After'])
+        self.frontend.shedder.pool.waitall()
+
+    def test_admin(self):
+        self.frontend.shedder.pool_reserve = 1
+        self.frontend.shedder.pool = eventlet.GreenPool(1)
+        self.frontend.shedder.pool.spawn(eventlet.sleep, 0)
+        for _ in xrange(3):
+            response = self.request('/metrics')
+            self.assertEquals(200, response.status_int)
+        self.frontend.profile_token = 'secret'
+        for _ in xrange(3):
+            response = self.request('/profile')
+            self.assertEquals(403, response.status_int)
+        self.assertEquals(0, self.frontend.shedder.stats['admitted'])
+        self.frontend.shedder.pool.waitall()
@@ -0,0 +1,84 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the binary frontend protocol. The backend tests
+cover the methods through the binary backend.'''
+
+import json
+import socket
+
+import testtools
+
+import burrow.frontend.binary as protocol
+
+
+class TestBinary(testtools.TestCase):
+    '''Test case for the binary frontend using the test server.'''
+
+    def setUp(self):
+        super(TestBinary, self).setUp()
+        self.socket = socket.create_connection(('localhost', 8081))
+        self.addCleanup(self.socket.close)
+        self.file = self.socket.makefile('rb')
+        self.addCleanup(self.file.close)
+
+    def request(self, request_id, method, args, body=''):
+        '''Send a request frame.'''
+        header = protocol.REQUEST.pack(request_id, method, len(args))
+        self.socket.sendall(protocol.pack_frame(header, args, body))
+
+    def response(self):
+        '''Read a response frame and return the request ID, status,
+        and payload.'''
+        frame = protocol.read_frame(self.file)
+        request_id, status = protocol.RESPONSE.unpack_from(frame)
+        return request_id, status, frame[protocol.RESPONSE.size:]
+
+    def test_requests(self):
+        create = protocol.METHODS.index('create_message')
+        get = protocol.METHODS.index('get_messages')
+        accounts = protocol.METHODS.index('get_accounts')
+        delete = protocol.METHODS.index('delete_accounts')
+        self.request(1, create, json.dumps(['a', 'q', 'm']), 'test')
+        self.assertEquals((1, protocol.STATUS_JSON, 'true'), self.response())
+        self.request(2, get, json.dumps(['a', 'q', dict(detail='body')]))
+        self.request(3, accounts, json.dumps([]))
+        responses = sorted([self.response(), self.response()])
+        self.assertEquals([(2, protocol.STATUS_JSON, '["test"]'),
+            (3, protocol.STATUS_JSON, '["a"]')], responses)
+        self.request(4, delete, json.dumps([None]))
+        self.assertEquals((4, protocol.STATUS_JSON, '[]'), self.response())
+
+    def test_errors(self):
+        get = protocol.METHODS.index('get_messages')
+        self.request(1, get, json.dumps(['a', 'q']))
+        self.assertEquals((1, protocol.STATUS_NOT_FOUND, 'Account not found'),
+            self.response())
+        self.request(2, 255, json.dumps([]))
+        self.assertEquals(protocol.STATUS_INVALID_ARGUMENTS,
+            self.response()[1])
+        self.request(3, get, 'bad')
+        self.assertEquals(protocol.STATUS_INVALID_ARGUMENTS,
+            self.response()[1])
+        self.request(4, get, json.dumps([]))
+        self.assertEquals(protocol.STATUS_ERROR, self.response()[1])
+
+    def test_frame_too_large(self):
+        size = protocol.DEFAULT_MAX_FRAME_SIZE + 1
+        self.socket.sendall(protocol.LENGTH.pack(size))
+        self.assertEquals(None, protocol.read_frame(self.file))
+
+    def test_short_frame(self):
+        self.socket.sendall(protocol.pack_frame('x'))
+        self.assertEquals(None, protocol.read_frame(self.file))
@@ -0,0 +1,88 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the UDP frontend.'''
+
+import ConfigParser
+
+import eventlet
+from eventlet.green import socket
+import testtools
+
+import burrow.backend.memory
+import burrow.frontend.udp
+
+
+class TestUDP(testtools.TestCase):
+    '''Test case for UDP frontend using the memory backend.'''
+
+    def setUp(self):
+        super(TestUDP, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'host', '127.0.0.1')
+        config.set('test', 'port', '0')
+        config.set('test', 'buffer_size', '2')
+        self.backend = burrow.backend.memory.Backend((config, 'test'))
+        self.frontend = burrow.frontend.udp.Frontend((config, 'test'),
+            self.backend)
+        self.frontend.run(eventlet.GreenPool())
+        self.addCleanup(self.frontend.socket.close)
+        self.server = self.frontend.socket.getsockname()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(self.client.close)
+
+    def send(self, *datagrams):
+        '''Send datagrams and wait for them to be processed.'''
+        for datagram in datagrams:
+            self.client.sendto(datagram, self.server)
+        eventlet.sleep(0.1)
+
+    def test_create(self):
+        self.send(burrow.frontend.udp.pack_datagram('a', 'q', 'm', 'test',
+            dict(ttl=100, hide=10)))
+        filters = dict(match_hidden=True)
+        messages = list(self.backend.get_messages('a', 'q', filters))
+        self.assertEquals(1, len(messages))
+        self.assertEquals('m', messages[0]['id'])
+        self.assertEquals('test', messages[0]['body'])
+        self.assertEquals(10, messages[0]['hide'])
+        stats = self.frontend.get_stats()
+        self.assertEquals(1, stats['received'])
+        self.assertEquals(1, stats['created'])
+
+    def test_generated_id(self):
+        datagram = burrow.frontend.udp.pack_datagram('a', 'q', None, 'test')
+        self.send(datagram, datagram)
+        messages = list(self.backend.get_messages('a', 'q'))
+        self.assertEquals(2, len(messages))
+        self.assertNotEqual(messages[0]['id'], messages[1]['id'])
+        self.assertEquals(0, messages[0]['hide'])
+
+    def test_malformed(self):
+        self.send('', '\x00\x05{}', '\x00\x02{}', '\x00\x02[]test',
+            '\x00\x1c{"account": "a", "queue": 1}')
+        stats = self.frontend.get_stats()
+        self.assertEquals(5, stats['received'])
+        self.assertEquals(5, stats['malformed'])
+        self.assertEquals(0, stats['created'])
+
+    def test_dropped(self):
+        datagram = burrow.frontend.udp.pack_datagram('a', 'q', None, 'test')
+        self.send(*[datagram] * 5)
+        stats = self.frontend.get_stats()
+        self.assertEquals(5, stats['received'])
+        self.assertEquals(3, stats['dropped'])
+        self.assertEquals(2, stats['created'])
+        self.assertEquals(2, len(list(self.backend.get_messages('a', 'q'))))
@@ -16,10 +16,29 @@
 the HTTP backend, so this covers things that don't translate directly to
 the Python API.'''
 
+import ConfigParser
+import errno
+import gzip
 import httplib
 import json
+import os
+import select
+import socket
+import stat
+import StringIO
+import zlib
 
+import eventlet.green.socket
+import eventlet.websocket
+import fixtures
 import testtools
+import webob
+
+import burrow.backend.memory
+import burrow.common
+import burrow.frontend.wsgi
+import burrow.metrics
+from burrow import tests
 
 
 class TestWSGI(testtools.TestCase):
@@ -44,3 +63,355 @@ class TestWSGI(testtools.TestCase):
         connection.request('GET', '/unknown')
         response = connection.getresponse()
         self.assertEquals(response.status, 404)
+
+    def test_large_body(self):
+        body = 'x' * (burrow.frontend.wsgi.READ_CHUNK_SIZE * 32 + 1)
+        connection = httplib.HTTPConnection('localhost', 8080)
+        connection.request('PUT', '/v1.0/a/q/m', body)
+        response = connection.getresponse()
+        self.assertEquals(response.status, 201)
+        response.read()
+        connection.request('DELETE', '/v1.0/a/q/m?detail=body')
+        response = connection.getresponse()
+        self.assertEquals(response.status, 200)
+        self.assertEquals(body, response.read())
+
+    def test_pipeline(self):
+        connection = socket.create_connection(('localhost', 8080))
+        self.addCleanup(connection.close)
+        requests = ['PUT /v1.0/a/q/m HTTP/1.1\r\nContent-Length: 4\r\n'
+            '\r\ntest', 'GET /v1.0/a/q/m?detail=body HTTP/1.1\r\n\r\n',
+            'DELETE /v1.0/a/q/m HTTP/1.1\r\n\r\n']
+        connection.sendall(''.join(requests))
+        responses = []
+        for method in ['PUT', 'GET', 'DELETE']:
+            response = httplib.HTTPResponse(connection, method=method)
+            response.begin()
+            responses.append((response.status, response.read()))
+        self.assertEquals([(201, ''), (200, 'test'), (204, '')], responses)
+
+    def test_unix_socket(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(tests.WSGI_UNIX_SOCKET)
+        connection.sendall('GET / HTTP/1.0\r\n\r\n')
+        response = connection.makefile('rb').read()
+        connection.close()
+        self.assertTrue(response.startswith('HTTP/1.1 200'))
+        self.assertTrue(response.endswith(']'))
+        self.assertTrue('"v1.0"' in response)
+
+    def create_message(self, message):
+        '''Create a message in the test queue.'''
+        connection = httplib.HTTPConnection('localhost', 8080)
+        connection.request('PUT', '/v1.0/a/q/%s' % message, 'test')
+        self.assertEquals(201, connection.getresponse().status)
+        self.addCleanup(self.delete_messages)
+
+    def delete_messages(self):
+        '''Delete all messages in the test queue.'''
+        connection = httplib.HTTPConnection('localhost', 8080)
+        connection.request('DELETE', '/v1.0/a/q?match_hidden=true')
+        connection.getresponse().read()
+
+    def test_subscribe_events(self):
+        self.create_message('m1')
+        self.create_message('m2')
+        connection = socket.create_connection(('localhost', 8080))
+        self.addCleanup(connection.close)
+        connection.sendall('GET /v1.0/a/q HTTP/1.0\r\n'
+            'Accept: text/event-stream\r\nLast-Event-ID: m1\r\n\r\n')
+        response = connection.makefile('rb')
+        self.assertEquals('HTTP/1.1 200 OK\r\n', response.readline())
+        while response.readline() != '\r\n':
+            pass
+        self.assertEquals(': subscribed\n', response.readline())
+        self.assertEquals('\n', response.readline())
+        self.assertEquals('id: m2\n', response.readline())
+        message = json.loads(response.readline()[len('data: '):])
+        self.assertEquals('m2', message['id'])
+        self.assertEquals('test', message['body'])
+        self.assertEquals('\n', response.readline())
+        self.create_message('m3')
+        self.assertEquals('id: m3\n', response.readline())
+
+    def test_subscribe_websocket(self):
+        connection = socket.create_connection(('localhost', 8080))
+        self.addCleanup(connection.close)
+        connection.sendall('GET /v1.0/a/q HTTP/1.1\r\nHost: localhost\r\n'
+            'Connection: Upgrade\r\nUpgrade: websocket\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n')
+        response = connection.makefile('rb')
+        self.assertEquals('HTTP/1.1 101 Switching Protocols\r\n',
+            response.readline())
+        while response.readline() != '\r\n':
+            pass
+        websocket = eventlet.websocket.RFC6455WebSocket(connection, {},
+            client=True)
+        websocket.send(json.dumps(dict(credits=1)))
+        self.create_message('m1')
+        self.create_message('m2')
+        message = json.loads(websocket.wait())
+        self.assertEquals('m1', message['id'])
+        # The second message is only sent once more credit is given.
+        self.assertEquals([], select.select([connection], [], [], 0.5)[0])
+        websocket.send(json.dumps(dict(credits=1)))
+        message = json.loads(websocket.wait())
+        self.assertEquals('m2', message['id'])
+
+
+class TestWSGIApplication(testtools.TestCase):
+    '''Test case for the WSGI frontend application without a server.'''
+
+    def setUp(self):
+        super(TestWSGIApplication, self).setUp()
+        config = ConfigParser.ConfigParser()
+        config.add_section('test')
+        config.set('test', 'max_body_size', '100')
+        config.set('test', 'compress_min_size', '50')
+        backend = burrow.backend.memory.Backend((config, 'test'))
+        self.frontend = burrow.frontend.wsgi.Frontend((config, 'test'),
+            backend)
+
+    def request(self, url, **kwargs):
+        '''Run a request through the frontend and return the response.'''
+        return webob.Request.blank(url, **kwargs).get_response(self.frontend)
+
+    def test_body(self):
+        for size in [0, 5, 10, 11, 100]:
+            body = 'x' * size
+            response = self.request('/v1.0/a/q/m', method='PUT', body=body)
+            self.assertEquals(201, response.status_int)
+            response = self.request('/v1.0/a/q/m?detail=body', method='DELETE')
+            self.assertEquals(body, response.body)
+
+    def test_metrics(self):
+        routematch = self.frontend._mapper.routematch
+        matches = []
+
+        def _routematch(*args, **kwargs):
+            matches.append(args)
+            return routematch(*args, **kwargs)
+
+        self.patch(self.frontend._mapper, 'routematch', _routematch)
+        self.request('/v1.0/a/q/m', method='PUT', body='test')
+        self.request('/v1.0/a/q')
+        self.request('/v1.0/a/q/m/x')
+        self.assertEquals(3, len(matches))
+        response = self.request('/metrics')
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(burrow.metrics.CONTENT_TYPE,
+            response.headers['Content-Type'])
+        lines = response.body.splitlines()
+        self.assertTrue('burrow_http_requests_total{route="message",'
+            'method="PUT",status="201"} 1' in lines)
+        self.assertTrue('burrow_backend_calls_total{method="get_messages",'
+            'result="ok"} 1' in lines)
+        self.assertTrue('burrow_http_request_duration_seconds_count{'
+            'route="messages",method="GET"} 1' in lines)
+        self.assertTrue('burrow_http_requests_total{route="unknown",'
+            'method="GET",status="404"} 1' in lines)
+        self.assertTrue('burrow_memory_messages 1' in lines)
+        self.assertTrue('burrow_memory_bytes 4' in lines)
+        self.assertTrue('burrow_waiters 0' in lines)
+        self.frontend.metrics = False
+        self.assertEquals(404, self.request('/metrics').status_int)
+
+    def test_profile(self):
+        self.assertEquals(404, self.request('/profile').status_int)
+        self.frontend.profile_token = 'secret'
+        self.assertEquals(403, self.request('/profile').status_int)
+        self.frontend.backend.profiler.path = \
+            self.useFixture(fixtures.TempDir()).path
+        headers = {'X-Profile-Token': 'secret'}
+        response = self.request('/profile?seconds=10&sample_rate=0.5',
+            method='POST', headers=headers)
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(0.5, json.loads(response.body)['sample_rate'])
+        response = self.request('/profile', method='POST', headers=headers)
+        self.assertEquals(409, response.status_int)
+        response = self.request('/profile', headers=headers)
+        self.assertTrue(json.loads(response.body)['enabled'])
+        response = self.request('/profile', method='DELETE', headers=headers)
+        self.assertTrue(os.path.exists(json.loads(response.body)['file']))
+        response = self.request('/profile?seconds=x', method='POST',
+            headers=headers)
+        self.assertEquals(400, response.status_int)
+
+    def test_body_too_large(self):
+        response = self.request('/v1.0/a/q/m', method='PUT', body='x' * 101)
+        self.assertEquals(413, response.status_int)
+        response = self.request('/v1.0/a/q')
+        self.assertEquals(404, response.status_int)
+
+    def test_body_too_large_unknown_length(self):
+        req = webob.Request.blank('/v1.0/a/q/m', method='PUT', body='x' * 101)
+        req.content_length = None
+        req.environ['wsgi.input_terminated'] = True
+        response = req.get_response(self.frontend)
+        self.assertEquals(413, response.status_int)
+
+    def test_compress_response(self):
+        self.request('/v1.0/a/q/m', method='PUT', body='x' * 100)
+        headers = {'Accept-Encoding': 'gzip'}
+        response = self.request('/v1.0/a/q/m?detail=body', headers=headers)
+        self.assertEquals('gzip', response.content_encoding)
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(response.body)).read()
+        self.assertEquals('x' * 100, body)
+        headers = {'Accept-Encoding': 'deflate'}
+        response = self.request('/v1.0/a/q/m?detail=body', headers=headers)
+        self.assertEquals('deflate', response.content_encoding)
+        self.assertEquals('x' * 100, zlib.decompress(response.body))
+        response = self.request('/v1.0/a/q/m?detail=body')
+        self.assertEquals(None, response.content_encoding)
+        self.assertEquals('x' * 100, response.body)
+        headers = {'Accept-Encoding': 'br'}
+        response = self.request('/v1.0/a/q/m?detail=body', headers=headers)
+        self.assertEquals(None, response.content_encoding)
+        self.request('/v1.0/a/q/m', method='DELETE')
+
+    def test_compress_response_small(self):
+        self.request('/v1.0/a/q/m', method='PUT', body='x' * 10)
+        headers = {'Accept-Encoding': 'gzip'}
+        response = self.request('/v1.0/a/q/m?detail=body', headers=headers)
+        self.assertEquals(None, response.content_encoding)
+        self.assertEquals('x' * 10, response.body)
+        self.request('/v1.0/a/q/m', method='DELETE')
+
+    def test_compressed_body(self):
+        for encoding in burrow.common.ENCODINGS:
+            body = ''.join(burrow.common.compress(['x' * 100], encoding))
+            headers = {'Content-Encoding': encoding}
+            response = self.request('/v1.0/a/q/m', method='PUT', body=body,
+                headers=headers)
+            self.assertEquals(201, response.status_int)
+            response = self.request('/v1.0/a/q/m?detail=body', method='DELETE')
+            self.assertEquals('x' * 100, response.body)
+
+    def test_compressed_body_too_large(self):
+        body = ''.join(burrow.common.compress(['x' * 101], 'gzip'))
+        headers = {'Content-Encoding': 'gzip'}
+        response = self.request('/v1.0/a/q/m', method='PUT', body=body,
+            headers=headers)
+        self.assertEquals(413, response.status_int)
+
+    def test_compressed_body_decompressed_too_large(self):
+        self.frontend.max_body_size = 0
+        self.frontend.max_decompressed_size = 1000
+        body = ''.join(burrow.common.compress(['x' * 1001], 'gzip'))
+        headers = {'Content-Encoding': 'gzip'}
+        response = self.request('/v1.0/a/q/m', method='PUT', body=body,
+            headers=headers)
+        self.assertEquals(413, response.status_int)
+        body = ''.join(burrow.common.compress(['x' * 1000], 'gzip'))
+        response = self.request('/v1.0/a/q/m', method='PUT', body=body,
+            headers=headers)
+        self.assertEquals(201, response.status_int)
+        self.request('/v1.0/a/q/m', method='DELETE')
+
+    def test_compressed_body_bad(self):
+        headers = {'Content-Encoding': 'gzip'}
+        response = self.request('/v1.0/a/q/m', method='PUT', body='bad',
+            headers=headers)
+        self.assertEquals(400, response.status_int)
+        headers = {'Content-Encoding': 'br'}
+        response = self.request('/v1.0/a/q/m', method='PUT', body='bad',
+            headers=headers)
+        self.assertEquals(415, response.status_int)
+
+    def test_listen_unix(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'sock')
+        # Leave a stale socket behind to be replaced.
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        self.frontend.config.set('unix_socket', path)
+        self.frontend.config.set('unix_socket_mode', '600')
+        listener = self.frontend.listen('localhost', 8080, 1)
+        self.addCleanup(listener.close)
+        self.assertEquals(socket.AF_UNIX, listener.family)
+        self.assertEquals(0600, stat.S_IMODE(os.stat(path).st_mode))
+
+    def serve(self, pool_size):
+        '''Run the frontend on a unix socket with its own thread pool
+        and return the socket path.'''
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'sock')
+        self.frontend.config.set('unix_socket', path)
+        self.frontend.config.set('thread_pool_size', str(pool_size))
+        listener = self.frontend.listen('localhost', 8080, 10)
+        self.addCleanup(listener.close)
+        server = eventlet.spawn(self.frontend._run, listener,
+            eventlet.GreenPool())
+        self.addCleanup(server.kill)
+        return path
+
+    def connect(self, path):
+        '''Connect to the unix socket.'''
+        connection = eventlet.green.socket.socket(socket.AF_UNIX,
+            socket.SOCK_STREAM)
+        connection.connect(path)
+        return connection
+
+    def test_pool_waiters(self):
+        path = self.serve(2)
+
+        def _request(method, url):
+            '''Send a request on a new connection and return the status.'''
+            connection = self.connect(path)
+            try:
+                connection.sendall('%s %s HTTP/1.0\r\n'
+                    'Content-Length: 4\r\n\r\ntest' % (method, url))
+                return connection.makefile('rb').read().split(' ', 2)[1]
+            finally:
+                connection.close()
+
+        pool = eventlet.GreenPool()
+        waiting = [pool.spawn(_request, 'GET', '/v1.0/a/q?wait=5')
+            for _count in xrange(2)]
+        eventlet.sleep(0.1)
+        thread_pool = self.frontend.thread_pool
+        self.assertEquals(2, self.frontend.backend.waiters.count)
+        self.assertEquals(2, thread_pool.free())
+        with eventlet.Timeout(2):
+            self.assertEquals(['200'] * 3,
+                list(pool.imap(_request, ['GET'] * 3, ['/'] * 3)))
+            self.assertEquals('201', _request('PUT', '/v1.0/a/q/m'))
+            self.assertEquals(['200', '200'],
+                [thread.wait() for thread in waiting])
+        eventlet.sleep(0.1)
+        self.assertEquals(0, self.frontend.backend.waiters.count)
+        self.assertEquals(2, thread_pool.free())
+        self.assertEquals(0, thread_pool.running())
+
+    def test_pool_websocket(self):
+        path = self.serve(2)
+        websockets = []
+        for _count in xrange(2):
+            connection = self.connect(path)
+            self.addCleanup(connection.close)
+            connection.sendall('GET /v1.0/a/q HTTP/1.1\r\n'
+                'Host: localhost\r\nConnection: Upgrade\r\n'
+                'Upgrade: websocket\r\nSec-WebSocket-Version: 13\r\n'
+                'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n')
+            response = connection.makefile('rb')
+            while response.readline() != '\r\n':
+                pass
+            websockets.append(eventlet.websocket.RFC6455WebSocket(
+                connection, {}, client=True))
+        eventlet.sleep(0.1)
+        # Subscribers waiting for credits do not hold pool slots.
+        self.assertEquals(2, self.frontend.thread_pool.free())
+        self.assertEquals(201, self.request('/v1.0/a/q/m', method='PUT',
+            body='test').status_int)
+        with eventlet.Timeout(2):
+            for websocket in websockets:
+                websocket.send(json.dumps(dict(credits=1)))
+                message = json.loads(websocket.wait())
+                self.assertEquals('m', message['id'])
+
+    def test_listen_unix_in_use(self):
+        self.frontend.config.set('unix_socket', tests.WSGI_UNIX_SOCKET)
+        error = self.assertRaises(socket.error, self.frontend.listen,
+            'localhost', 8080, 1)
+        self.assertEquals(errno.EADDRINUSE, error.errno)
+        self.assertTrue(os.path.exists(tests.WSGI_UNIX_SOCKET))
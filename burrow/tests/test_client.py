@@ -14,9 +14,13 @@
 
 '''Unittests for the Client API.'''
 
+import eventlet
 import testtools
 
 import burrow
+import burrow.backend.binary
+import burrow.backend.http
+from burrow import tests
 
 
 class TestClient(testtools.TestCase):
@@ -51,6 +55,17 @@ class TestClient(testtools.TestCase):
         self.assertEquals(['a'], list(client.get_accounts()))
         self.assertEquals([], list(client.delete_accounts()))
 
+    def test_unix_url(self):
+        client = burrow.Client(url='unix://' + tests.WSGI_UNIX_SOCKET)
+        self.assertTrue(
+            isinstance(client.backend, burrow.backend.http.Backend))
+        self.assertEquals(True, client.create_message('a', 'q', 'm', 'body'))
+        self.assertEquals(['a'], list(client.get_accounts()))
+        client = burrow.Client(url='binary+unix://' + tests.BINARY_UNIX_SOCKET)
+        self.assertTrue(
+            isinstance(client.backend, burrow.backend.binary.Backend))
+        self.assertEquals([], list(client.delete_accounts()))
+
     def test_shared_client(self):
         client = burrow.Client(url='http://localhost:8080')
         self.assertRaises(burrow.NotFound, list, client.get_accounts())
@@ -58,3 +73,177 @@ class TestClient(testtools.TestCase):
         account = burrow.Account('a', client=client)
         self.assertEquals(['q'], list(account.get_queues()))
         self.assertEquals([], list(account.delete_accounts()))
+
+    def test_green_client(self):
+        client = burrow.GreenClient()
+        self.assertRaises(burrow.NotFound, client.get_accounts().wait)
+        filters = dict(detail='id', wait=2)
+        waiters = [client.get_messages('a', 'q', filters) for _ in xrange(3)]
+        created = client.create_message('a', 'q', 'm', 'body')
+        self.assertEquals(True, created.wait())
+        for waiter in waiters:
+            self.assertEquals(['m'], waiter.wait())
+        self.assertEquals([], client.delete_accounts().wait())
+
+    def test_green_queue(self):
+        client = burrow.GreenClient()
+        queue = burrow.Queue('a', 'q', client=client)
+        results = [queue.create_message('m%d' % count, 'body')
+            for count in xrange(20)]
+        client.waitall()
+        self.assertEquals([True] * 20, [result.wait() for result in results])
+        messages = queue.get_messages(filters=dict(detail='id')).wait()
+        self.assertEquals(20, len(messages))
+        self.assertEquals([], queue.delete_accounts().wait())
+
+
+class QueueBase(testtools.TestCase):
+    '''Base test case for helpers using a queue.'''
+
+    def setUp(self):
+        super(QueueBase, self).setUp()
+        self.queue = burrow.Queue('a', 'q')
+        self.addCleanup(self.delete_accounts)
+
+    def delete_accounts(self):
+        '''Remove messages created by the test.'''
+        try:
+            list(self.queue.delete_accounts())
+        except burrow.NotFound:
+            pass
+
+
+class TestProducer(QueueBase):
+    '''Test case for the batching producer.'''
+
+    def test_batch_size(self):
+        producer = burrow.Producer(self.queue, batch_size=4, linger=60,
+            concurrency=1)
+        results = [producer.send('m%d' % count, 'body')
+            for count in xrange(10)]
+        for result in results[:8]:
+            self.assertEquals(True, result.wait())
+        self.assertEquals(2, len(producer.buffer))
+        producer.close()
+        self.assertEquals(True, results[9].wait())
+        messages = self.queue.get_messages(filters=dict(detail='id'))
+        self.assertEquals(['m%d' % count for count in xrange(10)],
+            list(messages))
+
+    def test_concurrency(self):
+        producer = burrow.Producer(self.queue, batch_size=1, linger=60)
+        concurrency = burrow.client.DEFAULT_CONCURRENCY
+        results = [producer.send('m%d' % count, 'body')
+            for count in xrange(concurrency)]
+        self.assertEquals(concurrency, producer.pool.running())
+        producer.close()
+        self.assertEquals([True] * concurrency,
+            [result.wait() for result in results])
+
+    def test_batch_bytes(self):
+        producer = burrow.Producer(self.queue, batch_bytes=10, linger=60)
+        first = producer.send('m1', 'x' * 5)
+        self.assertEquals(1, len(producer.buffer))
+        second = producer.send('m2', 'x' * 5)
+        self.assertEquals(0, len(producer.buffer))
+        self.assertEquals(True, first.wait())
+        self.assertEquals(True, second.wait())
+
+    def test_linger(self):
+        producer = burrow.Producer(self.queue, linger=0.1)
+        result = producer.send('m', 'body')
+        eventlet.sleep(0.05)
+        self.assertEquals(False, result.ready())
+        self.assertEquals(True, result.wait())
+        self.assertEquals(False, producer.send('m', 'body').wait())
+
+    def test_buffer_size(self):
+        producer = burrow.Producer(self.queue, linger=60, buffer_size=2)
+        sender = eventlet.spawn(lambda: [producer.send('m%d' % count, 'body')
+            for count in xrange(3)])
+        eventlet.sleep(0.1)
+        self.assertEquals(2, len(producer.buffer))
+        producer.flush()
+        results = sender.wait()
+        producer.close()
+        self.assertEquals([True] * 3, [result.wait() for result in results])
+
+    def test_callback(self):
+        calls = []
+        producer = burrow.Producer(self.queue)
+        producer.send('m', 'body', callback=lambda *args: calls.append(args))
+        producer.close()
+        self.assertEquals([('m', True, None)], calls)
+
+    def test_error(self):
+        calls = []
+        queue = burrow.Queue('a', 'q', url='http://localhost:1')
+        producer = burrow.Producer(queue)
+        result = producer.send('m', 'body',
+            callback=lambda *args: calls.append(args))
+        producer.close()
+        self.assertRaises(Exception, result.wait)
+        self.assertEquals(('m', None), calls[0][:2])
+        self.assertTrue(isinstance(calls[0][2], Exception))
+
+
+class TestConsumer(QueueBase):
+    '''Test case for the prefetching consumer.'''
+
+    def setUp(self):
+        super(TestConsumer, self).setUp()
+        for count in xrange(10):
+            self.queue.create_message('m%d' % count, 'body')
+
+    def visible(self):
+        '''Return the IDs of messages that are not hidden.'''
+        try:
+            return list(self.queue.get_messages(filters=dict(detail='id')))
+        except burrow.NotFound:
+            return []
+
+    def test_prefetch(self):
+        consumer = burrow.Consumer(self.queue, prefetch=4, refill=2)
+        message = consumer.get()
+        self.assertEquals('m0', message['id'])
+        self.assertEquals('body', message['body'])
+        self.assertEquals(['m%d' % count for count in xrange(4, 10)],
+            self.visible())
+        consumer.get()
+        eventlet.sleep(0.1)
+        self.assertEquals(['m%d' % count for count in xrange(6, 10)],
+            self.visible())
+        self.assertEquals(4, consumer.buffer.qsize())
+        consumer.close()
+        self.assertEquals(['m%d' % count for count in xrange(2, 10)],
+            self.visible())
+
+    def test_ack(self):
+        consumer = burrow.Consumer(self.queue, wait=1, ack_batch_size=2,
+            linger=60)
+        for message in [consumer.get() for _ in xrange(3)]:
+            consumer.ack(message['id'])
+        consumer.ack_pool.waitall()
+        self.assertEquals(['m2'], consumer.acks)
+        consumer.close()
+        self.assertEquals(['m%d' % count for count in xrange(3, 10)],
+            self.visible())
+
+    def test_iter(self):
+        consumer = burrow.Consumer(self.queue, wait=1, linger=0)
+        for message in consumer:
+            consumer.ack(message['id'])
+            if message['id'] == 'm9':
+                break
+        consumer.close()
+        self.assertEquals([], self.visible())
+        self.assertRaises(eventlet.queue.Empty, consumer.get, timeout=0)
+
+    def test_expired(self):
+        consumer = burrow.Consumer(self.queue, prefetch=2)
+        while consumer.buffer.qsize() < 2:
+            eventlet.sleep(0.01)
+        first = consumer.buffer.get()[1]
+        consumer.buffer.queue.appendleft((0, first))
+        self.assertEquals('m1', consumer.get()['id'])
+        consumer.close()
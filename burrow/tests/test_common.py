@@ -0,0 +1,68 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the common module.'''
+
+import json
+
+import testtools
+
+import burrow.common
+
+
+def split(text, size):
+    '''Split text into chunks of the given size.'''
+    return [text[start:start + size] for start in xrange(0, len(text), size)]
+
+
+class TestDecodeJSON(testtools.TestCase):
+    '''Test case for incremental JSON decoding.'''
+
+    def test_list(self):
+        items = [dict(id='m%d' % count, body='x' * count)
+            for count in xrange(100)]
+        text = json.dumps(items + ['id', 1, 2.5, None, [1, [2]]], indent=2)
+        for size in [1, 7, 100, len(text)]:
+            decoded = list(burrow.common.decode_json(split(text, size)))
+            self.assertEquals(items + ['id', 1, 2.5, None, [1, [2]]],
+                decoded)
+
+    def test_empty(self):
+        self.assertEquals([], list(burrow.common.decode_json([])))
+        self.assertEquals([], list(burrow.common.decode_json(['[', ' ]'])))
+
+    def test_object(self):
+        text = json.dumps(dict(id='m', body='test'))
+        decoded = list(burrow.common.decode_json(split(text, 3)))
+        self.assertEquals([dict(id='m', body='test')], decoded)
+
+    def test_incremental(self):
+        def chunks():
+            yield '[{"id": "a"}, '
+            self.assertEquals([dict(id='a')], decoded)
+            yield '{"id": "b"}]'
+        decoded = []
+        for item in burrow.common.decode_json(chunks()):
+            decoded.append(item)
+        self.assertEquals([dict(id='a'), dict(id='b')], decoded)
+
+    def test_truncated(self):
+        for text in ['[', '[1', '["a", ', '[{"id": "a"}']:
+            chunks = split(text, 2)
+            self.assertRaises(ValueError, list,
+                burrow.common.decode_json(chunks))
+
+    def test_bad_separator(self):
+        self.assertRaises(ValueError, list,
+            burrow.common.decode_json(['[1 2]']))
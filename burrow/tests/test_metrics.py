@@ -0,0 +1,83 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the metrics module.'''
+
+import testtools
+
+import burrow.metrics
+
+
+class TestHistogram(testtools.TestCase):
+    '''Test case for fixed bucket histograms.'''
+
+    def test_observe(self):
+        histogram = burrow.metrics.Histogram((1, 2))
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value)
+        self.assertEquals([(1, 2), (2, 3), ('+Inf', 4)],
+            histogram.cumulative())
+        self.assertEquals(6, histogram.sum)
+        self.assertEquals(4, histogram.count)
+
+
+class TestMetrics(testtools.TestCase):
+    '''Test case for the metrics registry.'''
+
+    def test_counter(self):
+        metrics = burrow.metrics.Metrics()
+        metrics.increment('requests', (('method', 'GET'),))
+        metrics.increment('requests', (('method', 'GET'),), 2)
+        self.assertEquals(3, metrics.get('requests', (('method', 'GET'),)))
+        self.assertEquals(None, metrics.get('requests'))
+
+    def test_collector(self):
+        metrics = burrow.metrics.Metrics()
+        collector = lambda: [('waiting', (), 5)]
+        metrics.add_collector(collector)
+        metrics.add_collector(collector)
+        self.assertEquals(5, metrics.get('waiting'))
+        self.assertEquals('waiting 5\n', metrics.render())
+        metrics.remove_collector(collector)
+        self.assertEquals(None, metrics.get('waiting'))
+
+    def test_render(self):
+        metrics = burrow.metrics.Metrics()
+        metrics.describe('calls_total', 'counter', 'Calls.')
+        metrics.describe('time', 'histogram', 'Time.')
+        metrics.increment('calls_total', (('name', 'b"\n'),))
+        metrics.increment('calls_total', (('name', 'a'),))
+        metrics.observe('time', 0.25, (('name', 'a'),))
+        metrics.add_collector(lambda: [('up', (), True)])
+        lines = metrics.render().splitlines()
+        self.assertEquals([
+            '# HELP calls_total Calls.',
+            '# TYPE calls_total counter',
+            'calls_total{name="a"} 1',
+            'calls_total{name="b\\"\\n"} 1'], lines[:4])
+        self.assertEquals([
+            '# HELP time Time.',
+            '# TYPE time histogram',
+            'time_bucket{name="a",le="0.0005"} 0'], lines[4:7])
+        self.assertTrue('time_bucket{name="a",le="0.25"} 1' in lines)
+        self.assertEquals([
+            'time_bucket{name="a",le="10"} 1',
+            'time_bucket{name="a",le="+Inf"} 1',
+            'time_sum{name="a"} 0.25',
+            'time_count{name="a"} 1',
+            'up 1'], lines[-5:])
+        # Four counter lines, two histogram headers, a line for each
+        # bucket and +Inf, the sum and count, and the gauge.
+        self.assertEquals(len(burrow.metrics.DEFAULT_BUCKETS) + 10,
+            len(lines))
@@ -0,0 +1,85 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the profiler module.'''
+
+import pstats
+import time
+
+import eventlet
+import fixtures
+import testtools
+
+import burrow.profiler
+
+
+def busy(seconds):
+    '''Use CPU time for the given number of seconds.'''
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestProfiler(testtools.TestCase):
+    '''Test case for on demand profiling.'''
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+
+    def test_disabled(self):
+        profiler = burrow.profiler.Profiler(self.path)
+        self.assertEquals(3, profiler.call(lambda x: x + 1, 2))
+        self.assertEquals(None, profiler.stop())
+        self.assertEquals(dict(enabled=False, format='pstats'),
+            profiler.get_status())
+
+    def test_pstats(self):
+        profiler = burrow.profiler.Profiler(self.path)
+        self.assertTrue(profiler.start(10))
+        self.assertFalse(profiler.start(10))
+        busy(0.01)
+        name = profiler.stop()
+        self.assertTrue(name.startswith(self.path))
+        functions = [function[2] for function in pstats.Stats(name).stats]
+        self.assertTrue('busy' in functions)
+
+    def test_sample_rate(self):
+        values = iter([0.7, 0.3])
+        self.useFixture(fixtures.MonkeyPatch(
+            'burrow.profiler.random.random', lambda: values.next()))
+        profiler = burrow.profiler.Profiler(self.path)
+        profiler.start(10, 0.5)
+        profiler.call(busy, 0.01)
+        profiler.call(lambda: busy(0.01))
+        name = profiler.stop()
+        functions = [function[2] for function in pstats.Stats(name).stats]
+        self.assertTrue('<lambda>' in functions)
+        self.assertEquals(1, functions.count('busy'))
+
+    def test_collapsed(self):
+        profiler = burrow.profiler.Profiler(self.path, 'collapsed', 0.001)
+        profiler.start(10)
+        busy(0.1)
+        name = profiler.stop()
+        stacks = open(name).read().splitlines()
+        self.assertTrue(len(stacks) > 0)
+        self.assertTrue(any(':busy ' in stack for stack in stacks))
+
+    def test_timeout(self):
+        profiler = burrow.profiler.Profiler(self.path)
+        profiler.start(0.01)
+        self.assertTrue(profiler.get_status()['enabled'])
+        eventlet.sleep(0.05)
+        self.assertFalse(profiler.enabled)
@@ -0,0 +1,60 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the watchdog module.'''
+
+import logging
+
+import eventlet
+import eventlet.patcher
+import fixtures
+import testtools
+
+import burrow.metrics
+import burrow.watchdog
+
+_time = eventlet.patcher.original('time')
+
+
+class TestWatchdog(testtools.TestCase):
+    '''Test case for detecting a blocked hub.'''
+
+    def setUp(self):
+        super(TestWatchdog, self).setUp()
+        self.logger = self.useFixture(fixtures.FakeLogger(name='test'))
+        self.metrics = burrow.metrics.Metrics()
+        self.watchdog = burrow.watchdog.Watchdog(0.05, self.metrics,
+            logging.getLogger('test'))
+        self.watchdog.start(eventlet.GreenPool())
+        self.addCleanup(self.watchdog.stop)
+
+    def call_backend(self, method, environ):
+        '''Block the hub the way a slow backend method would.'''
+        _time.sleep(0.2)
+
+    def test_blocked(self):
+        eventlet.sleep(0.05)
+        self.assertEquals(None, self.metrics.get('burrow_hub_blocked_total'))
+        environ = dict(REQUEST_METHOD='GET', PATH_INFO='/v1.0/a/q')
+        self.call_backend('get_messages', environ)
+        eventlet.sleep(0.05)
+        self.assertEquals(1, self.metrics.get('burrow_hub_blocked_total'))
+        histogram = self.metrics.get('burrow_hub_blocked_seconds')
+        self.assertTrue(histogram.sum > 0.1)
+        output = self.logger.output
+        self.assertTrue('GET /v1.0/a/q get_messages' in output)
+        self.assertTrue('_time.sleep(0.2)' in output)
+
+    def test_describe(self):
+        self.assertEquals('', burrow.watchdog.describe(None))
@@ -0,0 +1,124 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unittests for the worker runtime.'''
+
+import time
+
+import eventlet
+import eventlet.event
+
+import burrow
+from burrow.tests import test_client
+
+
+class TestWorker(test_client.QueueBase):
+    '''Test case for the worker runtime.'''
+
+    def run_worker(self, worker, count):
+        '''Run the worker until count messages have been handled.'''
+        thread = eventlet.spawn(worker.run)
+        while worker.stats['processed'] + worker.stats['failed'] < count:
+            eventlet.sleep(0.01)
+        worker.stop()
+        thread.wait()
+
+    def test_run(self):
+        handled = []
+        for count in xrange(20):
+            self.queue.create_message('m%d' % count, 'body')
+        worker = burrow.Worker(self.queue, handled.append, wait=1)
+        self.run_worker(worker, 20)
+        self.assertEquals(sorted('m%d' % count for count in xrange(20)),
+            sorted(message['id'] for message in handled))
+        self.assertRaises(burrow.NotFound, list, self.queue.get_messages())
+        stats = worker.get_stats()
+        self.assertEquals(20, stats['processed'])
+        self.assertEquals(0, stats['in_flight'])
+        self.assertTrue(stats['throughput'] > 0)
+
+    def test_concurrent(self):
+        running = []
+        maximum = []
+
+        def handler(message):
+            running.append(message['id'])
+            maximum.append(len(running))
+            eventlet.sleep(0.1)
+            running.remove(message['id'])
+        for count in xrange(10):
+            self.queue.create_message('m%d' % count, 'body')
+        worker = burrow.Worker(self.queue, handler, pool_size=5, wait=1)
+        self.run_worker(worker, 10)
+        self.assertEquals(5, max(maximum))
+        self.assertTrue(worker.get_stats()['average_latency'] >= 0.1)
+
+    def test_threads(self):
+        handled = []
+
+        def handler(message):
+            time.sleep(0.05)
+            handled.append(message['id'])
+        self.queue.create_message('m', 'body')
+        worker = burrow.Worker(self.queue, handler, wait=1, threads=True)
+        self.run_worker(worker, 1)
+        self.assertEquals(['m'], handled)
+
+    def test_failed(self):
+        def handler(message):
+            raise Exception(message['id'])
+        self.queue.create_message('m', 'body')
+        worker = burrow.Worker(self.queue, handler, wait=1)
+        self.run_worker(worker, 1)
+        self.assertEquals(1, worker.get_stats()['failed'])
+        filters = dict(match_hidden=True, detail='id')
+        self.assertEquals(['m'], list(self.queue.get_messages(filters)))
+        self.assertRaises(burrow.NotFound, list, self.queue.get_messages())
+
+    def test_renew(self):
+        def handler(message):
+            eventlet.sleep(2.5)
+        self.queue.create_message('m', 'body')
+        worker = burrow.Worker(self.queue, handler, hide=2, wait=1,
+            renew_interval=0.5)
+        thread = eventlet.spawn(worker.run)
+        eventlet.sleep(2.2)
+        self.assertRaises(burrow.NotFound, list, self.queue.get_messages())
+        worker.stop()
+        thread.wait()
+        self.assertTrue(worker.get_stats()['renewed'] > 0)
+        self.assertEquals(1, worker.get_stats()['processed'])
+
+    def test_claimed_again(self):
+        claimed = eventlet.event.Event()
+        calls = []
+        tracked = []
+
+        def handler(message):
+            calls.append(message['id'])
+            if len(calls) == 1:
+                # Keep handling the first claim until the hide time
+                # expires and the message is claimed again.
+                claimed.wait()
+                return
+            claimed.send()
+            eventlet.sleep(0.2)
+            tracked.append(message['id'] in worker.in_flight)
+        self.queue.create_message('m', 'body')
+        worker = burrow.Worker(self.queue, handler, pool_size=2, hide=1,
+            wait=1, renew_interval=60)
+        self.run_worker(worker, 2)
+        self.assertEquals(['m', 'm'], calls)
+        self.assertEquals([True], tracked)
+        self.assertEquals(0, worker.get_stats()['in_flight'])
@@ -0,0 +1,127 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Watchdog to detect when the eventlet hub is blocked. A green
+thread updates a heartbeat, and an operating system thread checks
+that the heartbeat keeps changing. When it stops for longer than the
+threshold, the watchdog thread captures the stack of whatever is
+running in the main thread, along with the HTTP request and backend
+method it is handling if any. The incident is logged and counted in
+the metrics once the hub runs again, so the watchdog thread never
+needs any locks that may have been monkey patched.'''
+
+import sys
+import time
+import traceback
+
+import eventlet
+import eventlet.patcher
+
+from burrow.openstack.common.gettextutils import _
+
+_thread = eventlet.patcher.original('thread')
+_time = eventlet.patcher.original('time')
+
+
+class Watchdog(object):
+    '''Detect when the hub is blocked for more than threshold
+    seconds.'''
+
+    def __init__(self, threshold, metrics, log):
+        self.threshold = threshold
+        self.interval = threshold / 4.0
+        self.metrics = metrics
+        self.log = log
+        self.beat = None
+        self.capture = None
+        self.ident = None
+        self.running = False
+        metrics.describe('burrow_hub_blocked_total', 'counter',
+            'Times the eventlet hub was blocked over the threshold.')
+        metrics.describe('burrow_hub_blocked_seconds', 'histogram',
+            'Time the eventlet hub was blocked for.')
+
+    def start(self, thread_pool):
+        '''Start the heartbeat green thread and the watchdog thread.
+        This must be called from the thread running the hub.'''
+        self.beat = time.time()
+        self.ident = _thread.get_ident()
+        self.running = True
+        thread_pool.spawn_n(self._heartbeat)
+        _thread.start_new_thread(self._watch, ())
+
+    def stop(self):
+        '''Stop the heartbeat and watchdog threads.'''
+        self.running = False
+
+    def _heartbeat(self):
+        '''Green thread to update the heartbeat, and to report when it
+        was delayed by a blocked hub.'''
+        while self.running:
+            eventlet.sleep(self.interval)
+            now = time.time()
+            blocked = now - self.beat - self.interval
+            capture = self.capture
+            self.capture = None
+            if blocked > self.threshold:
+                self._report(blocked, capture)
+            self.beat = now
+
+    def _report(self, blocked, capture):
+        '''Log and count a blocked hub.'''
+        self.metrics.increment('burrow_hub_blocked_total')
+        self.metrics.observe('burrow_hub_blocked_seconds', blocked)
+        if capture is None or capture[0] != self.beat:
+            self.log.warning(_('Hub was blocked for %.3f seconds') % blocked)
+            return
+        _beat, stack, context = capture
+        self.log.warning(
+            _('Hub was blocked for %(seconds).3f seconds in '
+            '%(context)s:\n%(stack)s') % dict(seconds=blocked,
+            context=context or _('unknown'), stack=stack))
+
+    def _watch(self):
+        '''Operating system thread to check the heartbeat and capture
+        the stack of the main thread when it stops.'''
+        while self.running:
+            _time.sleep(self.interval)
+            beat = self.beat
+            if time.time() - beat <= self.threshold + self.interval:
+                continue
+            capture = self.capture
+            if capture is not None and capture[0] == beat:
+                continue
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            self.capture = (beat, stack, describe(frame))
+
+
+def describe(frame):
+    '''Describe the HTTP request and backend method being handled in
+    the given stack, using the local variables of the WSGI call and
+    backend call frames.'''
+    context = []
+    while frame is not None:
+        local = frame.f_locals
+        if frame.f_code.co_name == 'call_backend' and 'method' in local:
+            context.append(str(local['method']))
+        environ = local.get('environ')
+        if isinstance(environ, dict) and 'PATH_INFO' in environ:
+            context.append('%s %s' % (environ.get('REQUEST_METHOD'),
+                environ['PATH_INFO']))
+            break
+        frame = frame.f_back
+    return ' '.join(reversed(context))
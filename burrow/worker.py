@@ -0,0 +1,152 @@
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Worker module for burrow.'''
+
+import time
+
+import eventlet
+import eventlet.queue
+import eventlet.tpool
+
+import burrow
+import burrow.client
+from burrow.openstack.common.gettextutils import _
+
+# Default configuration values for this module.
+DEFAULT_POOL_SIZE = 10
+DEFAULT_HIDE = 60
+DEFAULT_WAIT = 10
+
+# Seconds between checks of whether the worker was stopped.
+STOP_CHECK_INTERVAL = 1
+
+
+class Worker(object):
+    '''Run a handler for each message claimed from a Queue. Up to
+    pool_size handlers run at once in green threads, or in native
+    threads when threads is true so blocking handlers do not stall
+    other work. Messages are claimed with the given hide time, and
+    the hide time of messages still being handled is renewed every
+    renew_interval seconds (half the hide time by default) so they do
+    not reappear. Messages are deleted once the handler returns,
+    and left to reappear after the hide time if it raises.'''
+
+    def __init__(self, queue, handler, pool_size=DEFAULT_POOL_SIZE,
+        hide=DEFAULT_HIDE, wait=DEFAULT_WAIT, renew_interval=None,
+        prefetch=None, threads=False):
+        self.queue = queue
+        self.handler = handler
+        self.hide = hide
+        if renew_interval is None:
+            renew_interval = hide / 2.0
+        self.renew_interval = renew_interval
+        if prefetch is None:
+            prefetch = pool_size
+        self.consumer = burrow.client.Consumer(queue, prefetch=prefetch,
+            hide=hide, wait=wait)
+        self.pool = eventlet.GreenPool(pool_size)
+        self.threads = threads
+        self.running = False
+        self.in_flight = {}
+        self.started = None
+        self.stats = dict(processed=0, failed=0, renewed=0, latency=0.0,
+            max_latency=0.0)
+
+    def run(self):
+        '''Handle messages until stop() is called. Handlers that are
+        still running are allowed to finish before this returns.'''
+        self.running = True
+        self.started = time.time()
+        renewer = eventlet.spawn(self._renew)
+        try:
+            while self.running:
+                try:
+                    claimed, message = self.consumer.get_claim(
+                        STOP_CHECK_INTERVAL)
+                except eventlet.queue.Empty:
+                    continue
+                # A message can be claimed again while an earlier claim
+                # is still being handled if its hide time expired, so
+                # each claim gets its own entry to renew and remove.
+                claim = dict(renewed=claimed)
+                self.in_flight[message['id']] = claim
+                self.pool.spawn_n(self._handle, message, claim)
+            self.pool.waitall()
+        finally:
+            renewer.kill()
+            self.consumer.close()
+
+    def stop(self):
+        '''Stop claiming new messages.'''
+        self.running = False
+
+    def get_stats(self):
+        '''Return worker statistics, including throughput in messages
+        per second and handler latency in seconds.'''
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self.in_flight)
+        handled = stats['processed'] + stats['failed']
+        elapsed = 0 if self.started is None else time.time() - self.started
+        stats['throughput'] = 0.0
+        if elapsed > 0:
+            stats['throughput'] = stats['processed'] / elapsed
+        stats['average_latency'] = 0.0
+        if handled > 0:
+            stats['average_latency'] = stats['latency'] / handled
+        return stats
+
+    def _handle(self, message, claim):
+        '''Run the handler for a message and ack it on success.'''
+        start = time.time()
+        try:
+            if self.threads:
+                eventlet.tpool.execute(self.handler, message)
+            else:
+                self.handler(message)
+        except Exception:
+            self.queue.log.exception(_('Worker handler failed'))
+            self.stats['failed'] += 1
+        else:
+            self.consumer.ack(message['id'])
+            self.stats['processed'] += 1
+        finally:
+            if self.in_flight.get(message['id']) is claim:
+                del self.in_flight[message['id']]
+            latency = time.time() - start
+            self.stats['latency'] += latency
+            self.stats['max_latency'] = max(self.stats['max_latency'],
+                latency)
+
+    def _renew(self):
+        '''Renew the hide time of messages being handled before it
+        expires. All messages due for renewal are updated together
+        over one connection.'''
+        attributes = dict(hide=self.hide)
+        while True:
+            eventlet.sleep(self.renew_interval / 4.0)
+            now = time.time()
+            due = [(message, claim)
+                for message, claim in self.in_flight.items()
+                if now - claim['renewed'] >= self.renew_interval]
+            for message, claim in due:
+                try:
+                    self.queue.update_message(message, attributes)
+                except burrow.NotFound:
+                    continue
+                except Exception:
+                    self.queue.log.exception(_('Worker renewal failed'))
+                    continue
+                claim['renewed'] = now
+                self.stats['renewed'] += 1
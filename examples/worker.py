@@ -13,8 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-'''Normal worker example. This first retrieves messages to be processed
-and then deletes them once work is complete.'''
+'''Normal worker example. This first claims messages to be processed,
+which hides them from other workers, and then deletes them once work
+is complete. If the worker fails, the messages reappear after the hide
+time expires.'''
 from __future__ import print_function
 
 import burrow
@@ -23,7 +25,9 @@ import burrow
 def process_messages(queue):
     while True:
         try:
-            messages = queue.get_messages(filters=dict(wait=10))
+            attributes = dict(hide=60)
+            filters = dict(wait=10)
+            messages = queue.claim_messages(attributes, filters)
             for message in messages:
                 # Process message here
                 print(message)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Worker pool example. This runs a handler for up to ten messages
+at once, renewing the hide time of messages that take a long time to
+process and deleting them once the handler returns.'''
+from __future__ import print_function
+
+import burrow
+
+
+def process_message(message):
+    # Process message here
+    print(message)
+
+
+queue = burrow.Queue('test_account', 'test_queue')
+worker = burrow.Worker(queue, process_message, pool_size=10)
+try:
+    worker.run()
+except KeyboardInterrupt:
+    print(worker.get_stats())